@@ -1,4 +1,4 @@
 """API v1 routers."""
-from app.api.v1 import generate, payment, tokens, metrics
+from app.api.v1 import generate, generations, payment, tokens, metrics, admin
 
-__all__ = ["generate", "payment", "tokens", "metrics"]
+__all__ = ["generate", "generations", "payment", "tokens", "metrics", "admin"]
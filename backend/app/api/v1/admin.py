@@ -0,0 +1,165 @@
+"""Admin Router — Operational endpoints guarded by ADMIN_API_KEY."""
+from datetime import datetime, timezone
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database import get_archive_sessionmaker, get_db, get_sessionmaker
+from app.core.profiling import cpu_accounting, dump_tasks, profiler
+from app.core.security import require_admin
+from app.models import RollupWatermark, UsageRollup
+from app.schemas.admin import AnalyticsReport, AnalyticsRow, ProfileStartRequest, ProfileStatus
+from app.services.drain import generation_drain
+from app.services.export import MEDIA_TYPES, export_stream
+from app.services.retention import run_retention
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+
+@router.post("/profile/start", response_model=ProfileStatus)
+async def start_profile(request: ProfileStartRequest):
+    """Start sampling for a time window and/or the next N requests."""
+    if not profiler.start(request.seconds, request.requests, request.interval_ms):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return profiler.status()
+
+
+@router.post("/profile/stop", response_model=ProfileStatus)
+async def stop_profile():
+    """Stop the running profile early."""
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/profile", response_model=ProfileStatus)
+async def get_profile_status():
+    """Get profiler status."""
+    return profiler.status()
+
+
+@router.get("/profile/folded", response_class=PlainTextResponse)
+async def get_profile_folded():
+    """Collected stacks in folded format (flamegraph.pl, speedscope, inferno)."""
+    return PlainTextResponse(profiler.folded())
+
+
+@router.post("/drain")
+async def start_drain():
+    """Stop accepting generations and report not-ready (e.g. from a pre-stop hook).
+
+    In-flight generations finish normally; shutdown waits for them.
+    """
+    generation_drain.begin()
+    return {"state": generation_drain.state, "in_flight": len(generation_drain.active)}
+
+
+@router.get("/tasks")
+async def get_tasks():
+    """Dump all asyncio tasks with their await chains."""
+    tasks = dump_tasks()
+    return {"count": len(tasks), "tasks": tasks}
+
+
+@router.get("/cpu")
+async def get_cpu_report():
+    """Per-route event-loop CPU and DB time since accounting was enabled."""
+    return cpu_accounting.report()
+
+
+@router.put("/cpu")
+async def set_cpu_accounting(enabled: bool):
+    """Turn per-route CPU accounting on or off."""
+    if enabled:
+        cpu_accounting.enable()
+    else:
+        cpu_accounting.disable()
+    return cpu_accounting.report()
+
+
+@router.delete("/cpu")
+async def reset_cpu_accounting():
+    """Clear accumulated per-route costs."""
+    cpu_accounting.reset()
+    return cpu_accounting.report()
+
+
+def _as_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@router.get("/export/{table}")
+async def export_table(
+    table: Literal["generations", "transactions"],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    sessionmaker: async_sessionmaker = Depends(get_sessionmaker),
+):
+    """Stream all rows with ``since <= created_at < until`` as NDJSON or CSV."""
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    return StreamingResponse(
+        export_stream(sessionmaker, table, format, _as_utc_naive(since), _as_utc_naive(until)),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}-{stamp}.{format}"'},
+    )
+
+
+@router.get("/analytics", response_model=AnalyticsReport, response_model_exclude_none=True)
+async def get_analytics(
+    metric: Literal["generation", "payment"] = "generation",
+    granularity: Literal["hour", "day"] = "hour",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Generations per style/status or payments per SKU, from the hourly rollups only."""
+    query = select(UsageRollup).where(UsageRollup.metric == metric)
+    if since is not None:
+        query = query.where(UsageRollup.hour >= _as_utc_naive(since))
+    if until is not None:
+        query = query.where(UsageRollup.hour < _as_utc_naive(until))
+    rollups = (await db.execute(query.order_by(UsageRollup.hour))).scalars().all()
+
+    buckets: dict[tuple, AnalyticsRow] = {}
+    for r in rollups:
+        bucket = r.hour if granularity == "hour" else r.hour.replace(hour=0)
+        key = (bucket, r.style, r.status, r.product_sku, r.currency)
+        row = buckets.get(key)
+        if row is None:
+            row = buckets[key] = AnalyticsRow(bucket=bucket, status=r.status, count=0)
+            if metric == "generation":
+                row.style = r.style
+            else:
+                row.product_sku, row.currency, row.amount_cents = r.product_sku, r.currency, 0
+        row.count += r.count
+        if metric == "payment":
+            row.amount_cents += r.amount_cents
+
+    watermarks = {
+        w.source: w.last_created_at
+        for w in (await db.execute(select(RollupWatermark))).scalars().all()
+    }
+    source = "image_generations" if metric == "generation" else "payment_transactions"
+    return AnalyticsReport(
+        metric=metric,
+        granularity=granularity,
+        watermarks={source: watermarks.get(source)},
+        rows=list(buckets.values()),
+    )
+
+
+@router.post("/retention/run")
+async def run_retention_now(
+    db: AsyncSession = Depends(get_db),
+    archive: async_sessionmaker = Depends(get_archive_sessionmaker),
+):
+    """Apply retention now instead of waiting for the background pass."""
+    if settings.RETENTION_DAYS <= 0:
+        raise HTTPException(status_code=409, detail="Retention is disabled (RETENTION_DAYS=0)")
+    return {"archived": await run_retention(db, archive)}
@@ -1,18 +1,47 @@
 """Image generation API endpoints."""
+import uuid
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 
+from app.core.admission import admit_generate
+from app.core.cancellation import ClientDisconnected, cancel_on_disconnect, request_deadline
 from app.core.config import settings
 from app.core.database import get_db
+from app.core.metrics import record_generation_cancelled, record_upstream_avoided
+from app.core.ratelimit import rate_limit_generate
+from app.core.security import token_may_be_valid
+from app.core.tracing import span
 from app.models import GenerationToken, FreeTrialUsage, ImageGeneration
+from app.models.device_key import device_is, device_match, device_params, keyed_statement
 from app.schemas.generation import (
     GenerateImageRequest,
     GenerateImageResponse,
     UsageInfo,
 )
+from app.services.drain import Reservation, generation_drain, track_generation
+from app.services.idempotency import (
+    key_in_progress,
+    new_key,
+    pending_keys,
+    settle_key,
+    stored_response,
+    validate_key,
+)
 from app.services.image_generator import generate_image
+from app.services.known_ids import known_ids
+from app.services.scheduler import QueueTimeout, generation_scheduler
+from app.services.similar_prompts import prompt_index
+from app.services.token_cache import (
+    SNAPSHOT_COLUMNS,
+    TokenSnapshot,
+    get_valid_snapshots,
+    token_cache,
+)
 
 router = APIRouter()
 
@@ -20,7 +49,7 @@ router = APIRouter()
 async def get_or_create_free_trial(db: AsyncSession, device_id: str) -> FreeTrialUsage:
     """Get or create free trial usage record for device."""
     result = await db.execute(
-        select(FreeTrialUsage).where(FreeTrialUsage.device_id == device_id)
+        select(FreeTrialUsage).where(device_is(FreeTrialUsage, device_id))
     )
     usage = result.scalar_one_or_none()
     
@@ -28,22 +57,71 @@ async def get_or_create_free_trial(db: AsyncSession, device_id: str) -> FreeTria
         usage = FreeTrialUsage(device_id=device_id, used_count=0)
         db.add(usage)
         await db.flush()
+        known_ids.add_device(device_id)
     
     return usage
 
 
+FREE_USED_COUNT = keyed_statement(
+    lambda: select(FreeTrialUsage.used_count).where(device_match(FreeTrialUsage))
+)
+PAID_REMAINING = keyed_statement(lambda: select(
+    func.coalesce(func.sum(GenerationToken.remaining_generations), 0)
+).where(
+    device_match(GenerationToken),
+    GenerationToken.remaining_generations > 0,
+    GenerationToken.expires_at > bindparam("now"),
+))
+
+
+def _token_update(criterion, delta: int, usable_only: bool):
+    """UPDATE of one token's balance by ``delta`` returning its new snapshot."""
+    stmt = update(GenerationToken).where(criterion)
+    if usable_only:
+        stmt = stmt.where(
+            GenerationToken.remaining_generations > 0,
+            GenerationToken.expires_at > bindparam("now"),
+        )
+    return (
+        stmt.values(remaining_generations=GenerationToken.remaining_generations + delta)
+        .returning(*SNAPSHOT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+
+
+CONSUME_BY_TOKEN = _token_update(GenerationToken.token == bindparam("lookup_token"), -1, True)
+CONSUME_BY_ID = _token_update(GenerationToken.id == bindparam("token_id"), -1, True)
+REFUND_BY_ID = _token_update(GenerationToken.id == bindparam("token_id"), 1, False)
+
+
 async def get_paid_remaining(db: AsyncSession, device_id: str) -> int:
     """Get total remaining paid generations for device."""
-    now = datetime.utcnow()
     result = await db.execute(
-        select(GenerationToken).where(
-            GenerationToken.device_id == device_id,
-            GenerationToken.remaining_generations > 0,
-            GenerationToken.expires_at > now,
-        )
+        PAID_REMAINING(), {**device_params(device_id), "now": datetime.utcnow()}
     )
-    tokens = result.scalars().all()
-    return sum(t.remaining_generations for t in tokens)
+    return result.scalar_one()
+
+
+async def consume_paid_generation(
+    db: AsyncSession, token: Optional[str], device_id: str
+) -> Optional[TokenSnapshot]:
+    """Take one generation from ``token``, else from the device's soonest-expiring token.
+
+    Each attempt is a conditional UPDATE, so two requests can never spend
+    the same last generation. Returns the consumed token's new snapshot, or
+    None if the device has nothing usable. Never skipped via ``known_ids``:
+    a wrong "missing" here would turn paid quota into a free-trial charge.
+    """
+    now = datetime.utcnow()
+    if token and token_may_be_valid(token):
+        row = (await db.execute(CONSUME_BY_TOKEN, {"lookup_token": token, "now": now})).first()
+        if row is not None:
+            return TokenSnapshot.from_row(row)
+    for candidate in await get_valid_snapshots(db, device_id):
+        row = (await db.execute(CONSUME_BY_ID, {"token_id": candidate.id, "now": now})).first()
+        if row is not None:
+            return TokenSnapshot.from_row(row)
+    return None
 
 
 @router.get("/usage/{device_id}", response_model=UsageInfo)
@@ -51,11 +129,21 @@ async def get_usage(
     device_id: str,
     db: AsyncSession = Depends(get_db),
 ):
-    """Get usage information for a device."""
-    free_trial = await get_or_create_free_trial(db, device_id)
-    await db.commit()
-    
-    free_remaining = max(0, settings.FREE_GENERATIONS_PER_DEVICE - free_trial.used_count)
+    """Get usage information for a device.
+
+    Read-only: devices get a free trial row on their first generation.
+    """
+    if known_ids.device_missing(device_id):
+        free_remaining = settings.FREE_GENERATIONS_PER_DEVICE
+        return UsageInfo(
+            free_remaining=free_remaining,
+            paid_remaining=0,
+            total_remaining=free_remaining,
+        )
+
+    result = await db.execute(FREE_USED_COUNT(), device_params(device_id))
+    used_count = result.scalar_one_or_none() or 0
+    free_remaining = max(0, settings.FREE_GENERATIONS_PER_DEVICE - used_count)
     paid_remaining = await get_paid_remaining(db, device_id)
     
     return UsageInfo(
@@ -65,51 +153,100 @@ async def get_usage(
     )
 
 
-@router.post("/generate", response_model=GenerateImageResponse)
+async def refund_generation(
+    db: AsyncSession,
+    paid_token: Optional[TokenSnapshot],
+    free_trial: Optional[FreeTrialUsage],
+) -> Optional[TokenSnapshot]:
+    """Give back a reserved generation.
+
+    A relative UPDATE, so a generation consumed concurrently by another
+    request is not overwritten. Returns the paid token's new snapshot; a
+    loaded free trial row is synced without being marked dirty.
+    """
+    if paid_token:
+        row = (await db.execute(REFUND_BY_ID, {"token_id": paid_token.id})).one()
+        return TokenSnapshot.from_row(row)
+    if free_trial:
+        result = await db.execute(
+            update(FreeTrialUsage)
+            .where(FreeTrialUsage.id == free_trial.id)
+            .values(used_count=FreeTrialUsage.used_count - 1)
+            .returning(FreeTrialUsage.used_count)
+            .execution_options(synchronize_session=False)
+        )
+        set_committed_value(free_trial, "used_count", result.scalar_one())
+    return None
+
+
+async def _generate_in_slot(request: GenerateImageRequest, priority: str, deadline: float) -> dict:
+    try:
+        async with generation_scheduler.slot(priority, request.device_id, deadline):
+            return await generate_image(request.prompt, request.style, deadline)
+    except QueueTimeout:
+        return {
+            "success": False,
+            "error": "Image generation is busy right now. Please try again shortly."
+        }
+
+
+async def _replay(
+    db: AsyncSession, key: str, request: GenerateImageRequest, http_request: Request, deadline: float
+) -> Optional[Response]:
+    """The stored response for a retried key, or None if the key is free to claim."""
+    try:
+        body = await cancel_on_disconnect(
+            http_request, stored_response(db, key, request, deadline)
+        )
+    except ClientDisconnected:
+        return Response(status_code=499)
+    if body is None:
+        return None
+    record_upstream_avoided("idempotent_retry")
+    return Response(body, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+
+
+@router.post(
+    "/generate",
+    response_model=GenerateImageResponse,
+    dependencies=[
+        Depends(track_generation), Depends(rate_limit_generate), Depends(admit_generate),
+    ],
+)
 async def generate_image_endpoint(
     request: GenerateImageRequest,
+    http_request: Request,
     db: AsyncSession = Depends(get_db),
 ):
-    """Generate an image from text prompt."""
+    """Generate an image from text prompt.
+
+    Retries carrying the same ``Idempotency-Key`` get the original outcome
+    without spending quota again (see ``app.services.idempotency``).
+    """
     device_id = request.device_id
+    deadline = request_deadline(http_request)
+    idempotency_key = http_request.headers.get("idempotency-key")
+    if idempotency_key is not None:
+        validate_key(idempotency_key)
+        with span("idempotency_lookup"):
+            replay = await _replay(db, idempotency_key, request, http_request, deadline)
+        if replay is not None:
+            return replay
     
-    # Check for paid token first
-    paid_token = None
-    if request.token:
-        result = await db.execute(
-            select(GenerationToken).where(GenerationToken.token == request.token)
-        )
-        paid_token = result.scalar_one_or_none()
-        if paid_token and not paid_token.is_valid:
-            paid_token = None
-    
-    # If no specific token, try to find any valid token for device
-    if not paid_token:
-        now = datetime.utcnow()
-        result = await db.execute(
-            select(GenerationToken).where(
-                GenerationToken.device_id == device_id,
-                GenerationToken.remaining_generations > 0,
-                GenerationToken.expires_at > now,
-            ).order_by(GenerationToken.expires_at)
-        )
-        paid_token = result.scalar_one_or_none()
+    with span("token_lookup"):
+        # Paid tokens first: the request's own, else any valid one for the device
+        paid_token = await consume_paid_generation(db, request.token, device_id)
     
     # Determine if using free trial or paid
     is_free_trial = False
     free_trial = None
     
     if paid_token:
-        # Use paid token
-        if not paid_token.use_generation():
-            raise HTTPException(
-                status_code=402,
-                detail={"error": "Token exhausted or expired", "code": "payment_required"}
-            )
         remaining = paid_token.remaining_generations
     else:
         # Check free trial
-        free_trial = await get_or_create_free_trial(db, device_id)
+        with span("free_trial_lookup"):
+            free_trial = await get_or_create_free_trial(db, device_id)
         if free_trial.used_count >= settings.FREE_GENERATIONS_PER_DEVICE:
             raise HTTPException(
                 status_code=402,
@@ -125,47 +262,127 @@ async def generate_image_endpoint(
     
     # Record the generation attempt
     generation = ImageGeneration(
+        id=str(uuid.uuid4()),
         device_id=device_id,
         token_id=paid_token.id if paid_token else None,
         prompt=request.prompt,
-        model="dall-e-3",
+        model=settings.LLM_IMAGE_MODEL,
         style=request.style.value if request.style else None,
         status="processing",
     )
     db.add(generation)
-    await db.commit()
+    if idempotency_key:
+        db.add(new_key(idempotency_key, request, generation.id))
+    with span("commit.reserve"):
+        try:
+            await db.commit()
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            # A concurrent retry claimed the key first; nothing was reserved here.
+            await db.rollback()
+            replay = await _replay(db, idempotency_key, request, http_request, deadline)
+            if replay is None:
+                raise key_in_progress()
+            return replay
+    if idempotency_key:
+        pending_keys.start(device_id, idempotency_key)
+    generation_drain.reserve(Reservation(
+        generation.id,
+        token_id=paid_token.id if paid_token else None,
+        token=paid_token.token if paid_token else None,
+        free_trial_id=free_trial.id if free_trial else None,
+        device_id=device_id,
+        idempotency_key=idempotency_key,
+    ))
+    if paid_token:
+        token_cache.put(paid_token)
     
-    # Generate the image
-    result = await generate_image(request.prompt, request.style)
+    # Reuse a recent image for a near-identical prompt if the caller allows it
+    style = request.style.value if request.style else None
+    match = None
+    if request.allow_similar and settings.PROMPT_REUSE_ENABLED:
+        match = prompt_index.find(request.prompt, style, request.device_id)
+        if match:
+            reused_url = await prompt_index.image_url(db, match)
+            if reused_url is None:
+                match = None  # Deleted since it was indexed
+    if match:
+        result = {"success": True, "image_url": reused_url}
+        record_upstream_avoided("similar_prompt")
+    else:
+        # Generate the image; the upstream call is cancelled if the client leaves,
+        # unless it sent an Idempotency-Key: then its retry attaches to this one.
+        with span("generate_image") as upstream_span:
+            work = _generate_in_slot(request, "paid" if paid_token else "free", deadline)
+            try:
+                result = await (
+                    work if idempotency_key else cancel_on_disconnect(http_request, work)
+                )
+            except ClientDisconnected:
+                upstream_span.set_attribute("cancelled", True)
+                generation.status = "cancelled"
+                generation.error_message = "Client disconnected"
+                paid_token = await refund_generation(db, paid_token, free_trial)
+                with span("commit.settle"):
+                    await db.commit()
+                generation_drain.settled()
+                if paid_token:
+                    token_cache.put(paid_token)
+                record_generation_cancelled("client_disconnect")
+                return Response(status_code=499)  # Client Closed Request; nobody reads it
+            upstream_span.set_attribute("success", result["success"])
+            if "upstream" in result:
+                upstream_span.set_attribute("upstream", result["upstream"])
+        if result["success"] and settings.PROMPT_REUSE_ENABLED:
+            prompt_index.add(generation.id, request.device_id, request.prompt, style)
     
     # Update generation record
     if result["success"]:
         generation.status = "completed"
         generation.image_url = result["image_url"]
+        generation.model = result.get("model", generation.model)
     else:
         generation.status = "failed"
         generation.error_message = result.get("error")
         # Refund the generation on failure
+        paid_token = await refund_generation(db, paid_token, free_trial)
         if paid_token:
-            paid_token.remaining_generations += 1
-            remaining += 1
+            remaining = paid_token.remaining_generations
         elif free_trial:
-            free_trial.used_count -= 1
-            remaining += 1
-    
-    await db.commit()
+            remaining = settings.FREE_GENERATIONS_PER_DEVICE - free_trial.used_count
     
-    if not result["success"]:
-        return GenerateImageResponse(
+    if result["success"]:
+        response = GenerateImageResponse(
+            success=True,
+            image_url=result["image_url"],
+            remaining_generations=remaining,
+            is_free_trial=is_free_trial,
+            # Only the requesting device's own generations are named: ids
+            # are enough to fetch another device's generation.
+            reused_from=(
+                match.generation_id if match and match.device_id == request.device_id else None
+            ),
+        )
+    else:
+        response = GenerateImageResponse(
             success=False,
             error=result.get("error", "Image generation failed"),
             remaining_generations=remaining,
             is_free_trial=is_free_trial,
         )
+    if idempotency_key:
+        # Failures were refunded, so a retry gets a fresh attempt.
+        await settle_key(
+            db, device_id, idempotency_key, response if result["success"] else None
+        )
     
-    return GenerateImageResponse(
-        success=True,
-        image_url=result["image_url"],
-        remaining_generations=remaining,
-        is_free_trial=is_free_trial,
-    )
+    with span("commit.settle"):
+        await db.commit()
+    generation_drain.settled()
+    if idempotency_key:
+        pending_keys.done(device_id, idempotency_key)
+    if paid_token and not result["success"]:
+        token_cache.put(paid_token)
+    
+    return response
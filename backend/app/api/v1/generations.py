@@ -0,0 +1,113 @@
+"""Generation history endpoints."""
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database import get_archive_sessionmaker, get_db
+from app.models import ImageGeneration
+from app.models.device_key import device_is
+from app.schemas.generation import GenerationHistoryItem, GenerationHistoryPage, GenerationRecord
+from app.services.retention import get_archived_generation
+
+router = APIRouter()
+
+OPTIONAL_FIELDS = {"prompt", "error_message"}
+
+
+def encode_cursor(created_at: datetime, generation_id: str) -> str:
+    """Opaque keyset cursor for the row (created_at, id)."""
+    raw = f"{created_at.isoformat()}|{generation_id}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, generation_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), generation_id
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get(
+    "/generations",
+    response_model=GenerationHistoryPage,
+    response_model_exclude_unset=True,
+)
+async def list_generations(
+    device_id: str,
+    after: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    limit: Optional[int] = Query(default=None, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    include: Optional[str] = Query(default=None, description="Comma-separated: prompt,error_message"),
+    db: AsyncSession = Depends(get_db),
+):
+    """List a device's generations, newest first.
+
+    Keyset pagination on (created_at, id): ``ix_image_generations_device_created``
+    finds and orders the page without a sort, so page cost does not grow with
+    depth. The index is not covering; the listed columns are read from the
+    table for the page's rows only. Large text columns are only read when
+    listed in ``include``. No known-id short-circuit here: that filter only
+    knows devices with a free trial or a token, not devices that generated
+    with a token bought elsewhere.
+    """
+    extra = set(filter(None, (include or "").split(",")))
+    if extra - OPTIONAL_FIELDS:
+        raise HTTPException(
+            status_code=400, detail=f"include accepts: {', '.join(sorted(OPTIONAL_FIELDS))}"
+        )
+    limit = limit or settings.HISTORY_PAGE_SIZE
+
+    columns = [
+        ImageGeneration.id,
+        ImageGeneration.created_at,
+        ImageGeneration.status,
+        ImageGeneration.style,
+        ImageGeneration.image_url,
+    ] + [getattr(ImageGeneration, name) for name in sorted(extra)]
+    query = select(*columns).where(device_is(ImageGeneration, device_id))
+    if after:
+        query = query.where(
+            tuple_(ImageGeneration.created_at, ImageGeneration.id) < tuple_(*decode_cursor(after))
+        )
+    # One extra row tells whether another page exists.
+    query = query.order_by(
+        ImageGeneration.created_at.desc(), ImageGeneration.id.desc()
+    ).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+
+    page = rows[:limit]
+    items = [GenerationHistoryItem(**row._asdict()) for row in page]
+    if len(rows) > limit:
+        last = page[-1]
+        return GenerationHistoryPage(items=items, next_cursor=encode_cursor(last.created_at, last.id))
+    return GenerationHistoryPage(items=items)
+
+
+@router.get("/generations/{generation_id}", response_model=GenerationRecord)
+async def get_generation(
+    generation_id: str,
+    db: AsyncSession = Depends(get_db),
+    archive: async_sessionmaker = Depends(get_archive_sessionmaker),
+):
+    """Get one generation; records past retention are read from the archive."""
+    generation = await db.get(ImageGeneration, generation_id)
+    if generation is not None:
+        return GenerationRecord(
+            id=generation.id,
+            created_at=generation.created_at,
+            status=generation.status,
+            style=generation.style,
+            image_url=generation.image_url,
+            prompt=generation.prompt,
+            error_message=generation.error_message,
+        )
+    archived = await get_archived_generation(archive, generation_id)
+    if archived is None:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    return GenerationRecord(**archived, archived=True)
@@ -8,12 +8,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
 from app.core.database import get_db
-from app.models import GenerationToken, PaymentTransaction
+from app.core.responses import PrecomputedResponse
+from app.services.webhook_inbox import append_event, inbox_consumer
 from app.schemas.payment import Product, CreateCheckoutRequest, CreateCheckoutResponse
 
 
 def get_creem_api_base():
     """Use test API for test keys, production API for live keys."""
+    if settings.CREEM_API_BASE:
+        return settings.CREEM_API_BASE.rstrip("/")
     if settings.CREEM_API_KEY.startswith("creem_test_"):
         return "https://test-api.creem.io/v1"
     return "https://api.creem.io/v1"
@@ -22,35 +25,38 @@ def get_creem_api_base():
 router = APIRouter()
 
 
-@router.get("/payment/products", response_model=list[Product])
-async def get_products():
-    """Get available product packages."""
-    products = []
-    for sku, info in settings.PRODUCTS.items():
-        products.append(
+def build_product_catalog(products: dict) -> list[Product]:
+    """Build the catalog; discounts are vs the most expensive per-unit price."""
+    per_unit_prices = {
+        sku: info["price"] / info["generations"] for sku, info in products.items()
+    }
+    max_per_unit = max(per_unit_prices.values(), default=0)
+    catalog = []
+    for sku, info in products.items():
+        this_per_unit = per_unit_prices[sku]
+        discount = None
+        if len(products) > 1 and this_per_unit < max_per_unit:
+            discount = int(((max_per_unit - this_per_unit) / max_per_unit) * 100)
+        catalog.append(
             Product(
                 sku=sku,
                 name=sku.replace("_", " ").title(),
                 price_cents=info["price"],
                 generations=info["generations"],
-                discount_percent=_calculate_discount(sku) if len(settings.PRODUCTS) > 1 else None,
+                discount_percent=discount,
             )
         )
-    return products
+    return catalog
 
 
-def _calculate_discount(sku: str) -> int | None:
-    """Calculate discount vs cheapest per-unit price."""
-    if len(settings.PRODUCTS) < 2:
-        return None
-    per_unit_prices = {
-        k: v["price"] / v["generations"] for k, v in settings.PRODUCTS.items()
-    }
-    max_per_unit = max(per_unit_prices.values())
-    this_per_unit = per_unit_prices[sku]
-    if this_per_unit >= max_per_unit:
-        return None
-    return int(((max_per_unit - this_per_unit) / max_per_unit) * 100)
+# Products only change on deploy, so the catalog is serialized once.
+product_catalog = PrecomputedResponse(build_product_catalog(settings.PRODUCTS))
+
+
+@router.get("/payment/products", response_model=list[Product])
+async def get_products(request: Request):
+    """Get available product packages."""
+    return product_catalog(request)
 
 
 @router.post("/payment/create-checkout", response_model=CreateCheckoutResponse)
@@ -120,7 +126,11 @@ async def creem_webhook(
     creem_signature: str = Header(None, alias="creem-signature"),
     db: AsyncSession = Depends(get_db),
 ):
-    """Handle Creem webhook events."""
+    """Handle Creem webhook events.
+
+    Verified events are appended to the durable inbox and acknowledged right
+    away; ``inbox_consumer`` mints tokens in the background.
+    """
     payload = await request.body()
 
     if not creem_signature or not verify_creem_signature(
@@ -133,45 +143,12 @@ async def creem_webhook(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
-    event_type = event.get("eventType")
+    if not isinstance(event, dict):
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
-    if event_type == "checkout.completed":
-        await _handle_checkout_completed(event, db)
+    if not await append_event(db, event, payload):
+        # Replay of an event we already have: ack so Creem stops retrying.
+        return {"received": True, "duplicate": True}
+    inbox_consumer.wake()
 
     return {"received": True}
-
-
-async def _handle_checkout_completed(event: dict, db: AsyncSession):
-    """Handle successful checkout — create token + record transaction."""
-    obj = event.get("object", {})
-    metadata = obj.get("metadata", {})
-    customer = obj.get("customer", {})
-    order = obj.get("order", {})
-
-    product_sku = metadata.get("product_sku")
-    device_id = metadata.get("device_id")
-    generations = int(metadata.get("generations", 1))
-
-    # Create token
-    token = GenerationToken.create_token(
-        product_sku=product_sku,
-        generations=generations,
-        device_id=device_id,
-    )
-    db.add(token)
-    await db.flush()
-
-    # Record transaction
-    transaction = PaymentTransaction(
-        token_id=token.id,
-        product_sku=product_sku,
-        provider="creem",
-        provider_transaction_id=obj.get("id"),
-        amount_cents=order.get("amount"),
-        currency=order.get("currency", "usd"),
-        status="succeeded",
-        device_id=device_id,
-        optional_email=customer.get("email"),
-    )
-    db.add(transaction)
-    await db.commit()
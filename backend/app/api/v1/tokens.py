@@ -1,12 +1,26 @@
 """Token Router — Query, validate, and list tokens."""
+import json
 from datetime import datetime
+from typing import AsyncIterator
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy import select
 
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import get_db, get_sessionmaker
+from app.core.security import token_may_be_valid
 from app.models import GenerationToken
-from app.schemas.payment import TokenInfo, TokenListResponse, ValidateResponse
+from app.models.device_key import device_in
+from app.schemas.payment import (
+    BulkValidateRequest,
+    BulkValidateResponse,
+    TokenInfo,
+    TokenListResponse,
+    ValidateResponse,
+)
+from app.services.known_ids import known_ids
+from app.services.token_cache import get_token_snapshot, get_valid_snapshots
 
 router = APIRouter()
 
@@ -17,10 +31,7 @@ async def get_token_info(
     db: AsyncSession = Depends(get_db),
 ):
     """Get token information."""
-    result = await db.execute(
-        select(GenerationToken).where(GenerationToken.token == token)
-    )
-    token_obj = result.scalar_one_or_none()
+    token_obj = await get_token_snapshot(db, token)
     if not token_obj:
         raise HTTPException(status_code=404, detail="Token not found")
 
@@ -39,30 +50,128 @@ async def validate_token(
     db: AsyncSession = Depends(get_db),
 ):
     """Validate if a token is valid and has remaining generations."""
-    result = await db.execute(
-        select(GenerationToken).where(GenerationToken.token == token)
-    )
-    token_obj = result.scalar_one_or_none()
+    token_obj = await get_token_snapshot(db, token)
     if not token_obj:
         return ValidateResponse(valid=False)
     return ValidateResponse(valid=token_obj.is_valid)
 
 
+def _chunks(items: list[str], size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _status(row, now: datetime) -> dict:
+    return {
+        "token": row.token,
+        "device_id": row.device_id,
+        "found": True,
+        "valid": row.remaining_generations > 0 and now < row.expires_at,
+        "remaining_generations": row.remaining_generations,
+        "expires_at": row.expires_at.isoformat(),
+    }
+
+
+_BULK_COLUMNS = (
+    GenerationToken.token,
+    GenerationToken.device_id,
+    GenerationToken.remaining_generations,
+    GenerationToken.expires_at,
+)
+
+
+async def _bulk_status(
+    sessionmaker: async_sessionmaker, tokens: list[str], device_ids: list[str]
+) -> AsyncIterator[list[dict]]:
+    """Yield result entries one chunk at a time.
+
+    Each chunk is one ``IN (...)`` query on the indexed token/device_id
+    column. Tokens that fail the offline checks never reach the DB.
+    """
+    now = datetime.utcnow()
+    chunk_size = settings.BULK_VALIDATE_CHUNK_SIZE
+    async with sessionmaker() as db:
+        for chunk in _chunks(tokens, chunk_size):
+            lookups = [
+                t for t in chunk if token_may_be_valid(t) and not known_ids.token_missing(t)
+            ]
+            rows = {}
+            if lookups:
+                result = await db.execute(
+                    select(*_BULK_COLUMNS).where(GenerationToken.token.in_(lookups))
+                )
+                rows = {row.token: row for row in result}
+            yield [
+                _status(rows[t], now) if t in rows else {"token": t, "found": False, "valid": False}
+                for t in chunk
+            ]
+
+        for chunk in _chunks(device_ids, chunk_size):
+            lookups = [d for d in chunk if not known_ids.device_missing(d)]
+            by_device: dict[str, list] = {}
+            if lookups:
+                result = await db.execute(
+                    select(*_BULK_COLUMNS)
+                    .where(device_in(GenerationToken, lookups))
+                    .order_by(GenerationToken.expires_at)
+                )
+                for row in result:
+                    by_device.setdefault(row.device_id, []).append(row)
+            entries = []
+            for device_id in chunk:
+                if device_id in by_device:
+                    entries.extend(_status(row, now) for row in by_device[device_id])
+                else:
+                    entries.append({"device_id": device_id, "found": False, "valid": False})
+            yield entries
+
+
+async def _stream_results(chunks: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    yield b'{"results":['
+    separator = b""
+    async for entries in chunks:
+        if entries:
+            yield separator + b",".join(json.dumps(e).encode() for e in entries)
+            separator = b","
+    yield b"]}"
+
+
+@router.post(
+    "/tokens/validate/bulk",
+    response_class=StreamingResponse,
+    responses={200: {"model": BulkValidateResponse, "content": {"application/json": {}}}},
+)
+async def validate_tokens_bulk(
+    request: BulkValidateRequest,
+    sessionmaker: async_sessionmaker = Depends(get_sessionmaker),
+):
+    """Validate many tokens and/or device ids at once.
+
+    Results stream back in request order (duplicates removed) with validity,
+    remaining balance and expiry.
+    """
+    tokens = list(dict.fromkeys(request.tokens))
+    device_ids = list(dict.fromkeys(request.device_ids))
+    if len(tokens) + len(device_ids) > settings.BULK_VALIDATE_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.BULK_VALIDATE_MAX_ITEMS} tokens and device ids per request",
+        )
+    return StreamingResponse(
+        _stream_results(_bulk_status(sessionmaker, tokens, device_ids)),
+        media_type="application/json",
+    )
+
+
 @router.get("/tokens/by-device/{device_id}", response_model=TokenListResponse)
 async def get_tokens_by_device(
     device_id: str,
     db: AsyncSession = Depends(get_db),
 ):
     """Get all valid tokens for a device."""
-    now = datetime.utcnow()
-    result = await db.execute(
-        select(GenerationToken).where(
-            GenerationToken.device_id == device_id,
-            GenerationToken.remaining_generations > 0,
-            GenerationToken.expires_at > now,
-        )
-    )
-    tokens = result.scalars().all()
+    if known_ids.device_missing(device_id):
+        return TokenListResponse(tokens=[])
+    tokens = await get_valid_snapshots(db, device_id)
 
     return TokenListResponse(
         tokens=[
@@ -0,0 +1,130 @@
+"""CoDel-style admission control for /generate.
+
+The scheduler reports how long each generation queued for an upstream slot
+(its sojourn time) and in which class. Per priority class, once every
+sojourn of that class over a full ``ADMISSION_INTERVAL_MS`` has stayed
+above the class's target delay, the class enters the shedding state and new
+arrivals get an immediate 503 instead of joining a queue they would time
+out in. A sojourn below target, the queue draining, or a full interval
+without any above-target sojourn (the queue may empty by cancellation, and
+shed arrivals never queue) ends shedding.
+Free-trial traffic has the lower target and a lower in-flight cap, so it is
+shed first.
+"""
+import time
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from app.core.config import settings
+from app.core.metrics import record_load_shed
+from app.core.ratelimit import generate_caller
+
+
+class DelayDetector:
+    """Sojourn above ``target`` for ``interval`` seconds means overloaded."""
+
+    def __init__(self, target: float, interval: float):
+        self.target = target
+        self.interval = interval
+        self.first_above: Optional[float] = None
+        self.last_above: Optional[float] = None
+        self.shedding = False
+
+    def observe(self, sojourn: float, now: float):
+        if sojourn < self.target:
+            self.reset()
+            return
+        self.last_above = now
+        if self.first_above is None:
+            self.first_above = now + self.interval
+        elif now >= self.first_above:
+            self.shedding = True
+
+    def is_shedding(self, now: float) -> bool:
+        """``shedding``, ended once ``interval`` passes with no sojourn above target."""
+        if self.shedding and self.last_above is not None and now - self.last_above >= self.interval:
+            self.reset()
+        return self.shedding
+
+    def reset(self):
+        self.first_above = None
+        self.last_above = None
+        self.shedding = False
+
+
+class AdmissionController:
+    def __init__(self):
+        self.in_flight = 0
+        self.detectors: dict[str, DelayDetector] = {}
+        self.max_in_flight: dict[str, int] = {}
+
+    def configure(self, priority: str, target: float, interval: float, max_in_flight: int):
+        self.detectors[priority] = DelayDetector(target, interval)
+        self.max_in_flight[priority] = max_in_flight
+
+    def observe(self, priority: str, sojourn: float, now: Optional[float] = None):
+        """Record a ``priority`` request's queue sojourn time in seconds."""
+        detector = self.detectors.get(priority)
+        if detector is not None:
+            detector.observe(sojourn, time.monotonic() if now is None else now)
+
+    def queue_drained(self):
+        for detector in self.detectors.values():
+            detector.reset()
+
+    def rejection(self, priority: str, now: Optional[float] = None) -> Optional[str]:
+        """Why a new ``priority`` arrival is shed, or None to admit it."""
+        if self.in_flight >= self.max_in_flight[priority]:
+            return "in_flight"
+        if self.detectors[priority].is_shedding(time.monotonic() if now is None else now):
+            return "delay"
+        return None
+
+    def reset(self):
+        self.in_flight = 0
+        self.queue_drained()
+
+
+generate_admission = AdmissionController()
+
+
+def configure_admission():
+    """(Re)build the /generate admission thresholds from settings."""
+    interval = settings.ADMISSION_INTERVAL_MS / 1000
+    generate_admission.configure(
+        "paid", settings.ADMISSION_PAID_TARGET_MS / 1000, interval,
+        settings.ADMISSION_MAX_IN_FLIGHT,
+    )
+    generate_admission.configure(
+        "free", settings.ADMISSION_FREE_TARGET_MS / 1000, interval,
+        int(settings.ADMISSION_MAX_IN_FLIGHT * settings.ADMISSION_FREE_IN_FLIGHT_SHARE),
+    )
+
+
+configure_admission()
+
+
+async def admit_generate(request: Request):
+    """Admit or shed a /generate request before any DB session is opened.
+
+    Admitted requests count as in flight until the response is done.
+    """
+    if not settings.ADMISSION_ENABLED:
+        yield
+        return
+    _, paid = await generate_caller(request)
+    priority = "paid" if paid else "free"
+    reason = generate_admission.rejection(priority)
+    if reason is not None:
+        record_load_shed(priority, reason)
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "Server is busy. Please try again shortly.", "code": "overloaded"},
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)},
+        )
+    generate_admission.in_flight += 1
+    try:
+        yield
+    finally:
+        generate_admission.in_flight -= 1
@@ -0,0 +1,63 @@
+"""Request deadlines and client-disconnect cancellation."""
+import asyncio
+import time
+from typing import Awaitable, Optional, TypeVar
+
+from fastapi import Request
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the work finished; the work was cancelled."""
+
+
+def request_deadline(request: Request) -> float:
+    """``time.monotonic()`` by which the request must be answered.
+
+    ``GENERATE_DEADLINE_SECONDS`` from now, or sooner if the client sends a
+    shorter ``X-Request-Timeout`` (seconds).
+    """
+    budget = settings.GENERATE_DEADLINE_SECONDS
+    header = request.headers.get("x-request-timeout")
+    if header:
+        try:
+            budget = min(budget, max(0.0, float(header)))
+        except ValueError:
+            pass
+    return time.monotonic() + budget
+
+
+def remaining(deadline: Optional[float], default: float) -> float:
+    """Seconds left before ``deadline``, at most ``default``."""
+    if deadline is None:
+        return default
+    return max(0.0, min(default, deadline - time.monotonic()))
+
+
+async def cancel_on_disconnect(
+    request: Request, work: Awaitable[T], poll_seconds: Optional[float] = None
+) -> T:
+    """Await ``work``, cancelling it if the client disconnects first.
+
+    Raises ``ClientDisconnected`` once the cancelled work has unwound, so
+    its cleanup (slots, in-flight counts) has run before the caller refunds.
+    """
+    poll = settings.DISCONNECT_POLL_SECONDS if poll_seconds is None else poll_seconds
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                try:
+                    return await task  # Finished before the cancel landed
+                except asyncio.CancelledError:
+                    raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
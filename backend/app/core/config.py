@@ -17,11 +17,60 @@ class Settings(BaseSettings):
     # LLM Proxy (for image generation)
     LLM_PROXY_URL: str = "https://llm-proxy.densematrix.ai"
     LLM_PROXY_KEY: str = ""
+    LLM_IMAGE_MODEL: str = "dall-e-3"
+    
+    # Upstream pool: JSON list of {"name", "url", "key", "model", "max_concurrency"};
+    # empty uses LLM_PROXY_URL / LLM_PROXY_KEY / LLM_IMAGE_MODEL alone
+    LLM_UPSTREAMS: list = []
+    UPSTREAM_MAX_CONCURRENCY: int = 32  # Per upstream unless its entry overrides it
+    UPSTREAM_MAX_ATTEMPTS: int = 2  # Fail over to another upstream on 5xx/timeouts
+    UPSTREAM_TIMEOUT_SECONDS: float = 60.0  # Per attempt, capped by the request deadline
+    UPSTREAM_EWMA_DECAY_SECONDS: float = 10.0
+    UPSTREAM_EJECT_AFTER_FAILURES: int = 5
+    UPSTREAM_EJECT_SECONDS: float = 30.0
+    UPSTREAM_MAX_EJECT_SECONDS: float = 300.0
+    
+    # Startup: skip DDL when the stored schema fingerprint matches, load optional
+    # caches after becoming ready, and pre-open DB / upstream connections first
+    STARTUP_SCHEMA_CHECK: bool = True
+    STARTUP_DEFER_CACHES: bool = True
+    STARTUP_WARM_DB_CONNECTIONS: int = 5
+    STARTUP_WARM_UPSTREAMS: bool = True
+    STARTUP_WARMUP_TIMEOUT_SECONDS: float = 5.0
+    
+    # Shutdown: wait this long for in-flight generations, then cancel and refund them
+    DRAIN_TIMEOUT_SECONDS: float = 30.0
+    
+    # End-to-end /generate budget (clients may ask for less with X-Request-Timeout)
+    GENERATE_DEADLINE_SECONDS: float = 90.0
+    DISCONNECT_POLL_SECONDS: float = 0.5  # How often to check for a closed client
+    
+    # /generate load shedding: 503 once slot queueing stays above target for an interval
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_FREE_TARGET_MS: float = 2000.0
+    ADMISSION_PAID_TARGET_MS: float = 10000.0
+    ADMISSION_INTERVAL_MS: float = 2000.0
+    ADMISSION_MAX_IN_FLIGHT: int = 512
+    ADMISSION_FREE_IN_FLIGHT_SHARE: float = 0.75  # Free traffic hits its cap first
+    ADMISSION_RETRY_AFTER_SECONDS: int = 5
+    
+    # Upstream slot scheduling: paid vs free-trial shares when slots are contended
+    SCHEDULER_SLOTS: int = 0  # 0 = sum of the upstreams' max_concurrency
+    SCHEDULER_PAID_SHARE: float = 4.0
+    SCHEDULER_FREE_SHARE: float = 1.0
+    SCHEDULER_PAID_MAX_WAIT_SECONDS: float = 30.0
+    SCHEDULER_FREE_MAX_WAIT_SECONDS: float = 10.0
     
     # Creem Payment
     CREEM_API_KEY: str = ""
     CREEM_WEBHOOK_SECRET: str = ""
     CREEM_PRODUCT_IDS: dict = {}
+    CREEM_API_BASE: str = ""  # Override the Creem API base URL (e.g. a local fake)
+    WEBHOOK_DEDUPE_CACHE_SIZE: int = 10000
+    WEBHOOK_INBOX_BATCH_SIZE: int = 100
+    WEBHOOK_INBOX_LINGER_MS: float = 50.0  # Wait for more events before a batch
+    WEBHOOK_INBOX_POLL_SECONDS: float = 5.0
+    WEBHOOK_INBOX_MAX_ATTEMPTS: int = 5
     
     # Products configuration
     PRODUCTS: dict = {
@@ -30,12 +79,99 @@ class Settings(BaseSettings):
         "unlimited_monthly": {"price": 1499, "generations": 500},
     }
     
+    # Idempotency-Key on /generate: replay window, how often a retry re-checks an
+    # in-flight key held by another worker, and batched cleanup of expired keys
+    IDEMPOTENCY_TTL_SECONDS: float = 86400.0
+    IDEMPOTENCY_POLL_SECONDS: float = 1.0
+    IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS: float = 600.0
+    IDEMPOTENCY_CLEANUP_BATCH_SIZE: int = 1000
+    IDEMPOTENCY_CLEANUP_PAUSE_MS: float = 50.0
+    
+    # Near-duplicate prompt reuse (opt-in per request with allow_similar)
+    PROMPT_REUSE_ENABLED: bool = True
+    PROMPT_SIMILARITY_THRESHOLD: float = 0.8  # Jaccard over normalized words
+    PROMPT_INDEX_SIZE: int = 20000
+    PROMPT_MINHASH_PERMUTATIONS: int = 64
+    PROMPT_REUSE_MAX_AGE_SECONDS: float = 3000.0  # Upstream image URLs expire
+    
     # Free trial
     FREE_GENERATIONS_PER_DEVICE: int = 3
     
+    # /generate rate limits (token buckets per client IP and per device, by tier)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_FREE_PER_MINUTE: float = 10.0
+    RATE_LIMIT_FREE_BURST: float = 5.0
+    RATE_LIMIT_PAID_PER_MINUTE: float = 30.0
+    RATE_LIMIT_PAID_BURST: float = 10.0
+    RATE_LIMIT_IP_PER_MINUTE: float = 60.0
+    RATE_LIMIT_IP_BURST: float = 30.0
+    RATE_LIMIT_MAX_KEYS: int = 100_000  # Per store; idle keys are evicted LRU
+    RATE_LIMIT_TRUST_FORWARDED_FOR: bool = False  # Only behind a trusted proxy
+    
+    # HMAC key for self-validating tokens; empty keeps issuing legacy tok_ tokens
+    TOKEN_SIGNING_SECRET: str = ""
+    # JSON list of previous signing secrets, newest first: tokens signed with
+    # them still verify after a rotation
+    TOKEN_SIGNING_SECRETS: list = []
+    
+    # Key of the 64-bit device_id hash used for indexed device lookups; empty
+    # looks devices up by device_id. Changing it rewrites the keys at startup.
+    DEVICE_KEY_SECRET: str = ""
+    DEVICE_KEY_BACKFILL_BATCH_SIZE: int = 5000
+    
+    # Bloom filters of known device ids / tokens (per filter: ~1.8 MB at 1M, 0.1%).
+    # Per process, so they stay off when WEB_CONCURRENCY (uvicorn/gunicorn
+    # worker count) is above 1: other workers' inserts would read as missing.
+    BLOOM_FILTER_ENABLED: bool = True
+    WEB_CONCURRENCY: int = 1
+    BLOOM_FILTER_CAPACITY: int = 1_000_000
+    BLOOM_FILTER_ERROR_RATE: float = 0.001
+    
+    # Generation history pagination
+    HISTORY_PAGE_SIZE: int = 20
+    HISTORY_MAX_PAGE_SIZE: int = 100
+    
+    # Usage rollups: rows newer than ROLLUP_SETTLE_SECONDS may still change status
+    ROLLUP_ENABLED: bool = True
+    ROLLUP_INTERVAL_SECONDS: float = 60.0
+    ROLLUP_SETTLE_SECONDS: float = 600.0
+    ROLLUP_BATCH_SIZE: int = 5000
+    
+    # Retention: generations older than RETENTION_DAYS move to the archive DB (0 = keep all)
+    RETENTION_DAYS: int = 0
+    ARCHIVE_DATABASE_URL: str = "sqlite+aiosqlite:///./archive.db"
+    RETENTION_INTERVAL_SECONDS: float = 3600.0
+    RETENTION_BATCH_SIZE: int = 500
+    RETENTION_BATCH_PAUSE_MS: float = 50.0  # Gap between delete batches for writers
+    RETENTION_VACUUM_PAGES: int = 2000  # Pages released per incremental_vacuum
+    
+    # Admin exports: rows per fetch, and rows per read transaction
+    EXPORT_BATCH_SIZE: int = 1000
+    EXPORT_WINDOW_ROWS: int = 50000
+    
+    # Bulk token validation
+    BULK_VALIDATE_MAX_ITEMS: int = 5000
+    BULK_VALIDATE_CHUNK_SIZE: int = 500  # IN (...) list size; SQLite allows 999 params
+    
+    # In-process token snapshot cache (per worker)
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL_SECONDS: float = 30.0
+    
     # Tool name for metrics
     TOOL_NAME: str = "ai-image-gen"
     
+    # Admin surface (disabled when empty)
+    ADMIN_API_KEY: str = ""
+    
+    # On-demand profiling
+    PROFILER_SAMPLE_INTERVAL_MS: float = 5.0
+    PROFILER_MAX_SECONDS: float = 120.0
+    
+    # Request tracing: "" (off), "log", or "file" (OTLP/JSON lines)
+    TRACING_EXPORTER: str = ""
+    TRACING_FILE_PATH: str = "./traces.jsonl"
+    TRACING_SAMPLE_RATE: float = 1.0
+    
     class Config:
         env_file = ".env"
         extra = "ignore"
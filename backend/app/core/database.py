@@ -1,6 +1,16 @@
 """Database configuration."""
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import (
+    Column, DateTime, MetaData, String, Table, delete, insert, inspect, select, text,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.schema import CreateColumn
 
 from app.core.config import settings
 
@@ -19,7 +29,173 @@ async def get_db():
             await session.close()
 
 
-async def init_db():
-    """Initialize database tables."""
-    async with engine.begin() as conn:
+def get_sessionmaker() -> async_sessionmaker:
+    """Dependency for endpoints that open sessions themselves.
+
+    Streaming responses outlive ``get_db`` (its session is closed before the
+    body is sent), so they open a session inside the body generator.
+    """
+    return async_session
+
+
+def insert_or_ignore(model, dialect_name: str):
+    """INSERT that silently skips rows violating a unique constraint.
+
+    Check ``result.rowcount`` to see whether the row was written.
+    """
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(model).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(model).on_conflict_do_nothing()
+    return insert(model).prefix_with("IGNORE", dialect="mysql")
+
+
+def _add_missing_columns(conn):
+    """create_all skips tables that already exist; add their new nullable columns."""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            conn.exec_driver_sql(
+                f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} "
+                f"ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}"
+            )
+
+
+def _create_missing_indexes(conn):
+    """create_all skips indexes of tables that already exist; add them."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def insert_or_increment(model, dialect_name: str, rows: list[dict], increments: list[str]):
+    """Bulk upsert that adds ``increments`` columns onto existing rows.
+
+    Conflicts are detected on the primary key.
+    """
+    table = model.__table__
+    if dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table).values(rows)
+        return stmt.on_duplicate_key_update(
+            {name: table.c[name] + stmt.inserted[name] for name in increments}
+        )
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert_insert
+    stmt = upsert_insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={name: table.c[name] + stmt.excluded[name] for name in increments},
+    )
+
+
+_archive_session: async_sessionmaker = None
+
+
+def get_archive_sessionmaker() -> async_sessionmaker:
+    """Dependency for the archive database (old generations), created on first use."""
+    global _archive_session
+    if _archive_session is None:
+        archive_engine = create_async_engine(settings.ARCHIVE_DATABASE_URL, echo=settings.DEBUG)
+        _archive_session = async_sessionmaker(
+            archive_engine, class_=AsyncSession, expire_on_commit=False
+        )
+    return _archive_session
+
+
+# Fingerprint of the schema the DDL last created; kept out of Base.metadata.
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("name", String(32), primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def schema_fingerprint(metadata: MetaData = Base.metadata) -> str:
+    """Hash of the tables, columns and indexes the models declare."""
+    parts = []
+    for table in metadata.sorted_tables:
+        parts.append(f"table:{table.name}")
+        parts += [
+            f"column:{c.name}:{c.type!r}:{c.nullable}:{c.primary_key}" for c in table.columns
+        ]
+        parts += sorted(
+            f"index:{ix.name}:{','.join(c.name for c in ix.columns)}:{ix.unique}"
+            for ix in table.indexes
+        )
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+async def stored_fingerprint(db_engine: AsyncEngine, name: str = "main") -> Optional[str]:
+    # Own connection: on PostgreSQL a failed query would abort the DDL transaction.
+    try:
+        async with db_engine.connect() as conn:
+            result = await conn.execute(
+                select(schema_version.c.fingerprint).where(schema_version.c.name == name)
+            )
+            return result.scalar_one_or_none()
+    except DBAPIError:
+        return None  # No schema_version table yet.
+
+
+async def store_fingerprint(conn, name: str, fingerprint: str):
+    await conn.execute(delete(schema_version).where(schema_version.c.name == name))
+    await conn.execute(insert(schema_version).values(
+        name=name, fingerprint=fingerprint, applied_at=datetime.utcnow(),
+    ))
+
+
+async def init_db(db_engine: Optional[AsyncEngine] = None) -> bool:
+    """Initialize database tables. Returns False if the DDL was skipped.
+
+    With ``STARTUP_SCHEMA_CHECK`` the DDL (``create_all`` reflects every
+    table) only runs when the models' fingerprint differs from the one
+    stored by the last run.
+    """
+    db_engine = db_engine or engine
+    fingerprint = schema_fingerprint()
+    if settings.STARTUP_SCHEMA_CHECK and await stored_fingerprint(db_engine) == fingerprint:
+        return False
+    async with db_engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            # Only takes effect before the first table exists; lets retention
+            # hand freed pages back with PRAGMA incremental_vacuum.
+            await conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.run_sync(schema_version.create, checkfirst=True)
+        await store_fingerprint(conn, "main", fingerprint)
+    return True
+
+
+async def warm_db_pool(connections: int):
+    """Open up to ``connections`` pooled connections so first requests skip the connect."""
+    size = getattr(engine.pool, "size", lambda: 1)()
+
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(max(1, min(connections, size)))))
+
+
+async def close_db():
+    """Close pooled connections of the main and archive databases."""
+    global _archive_session
+    await engine.dispose()
+    if _archive_session is not None:
+        await _archive_session.kw["bind"].dispose()
+        _archive_session = None
@@ -0,0 +1,303 @@
+"""Prometheus metric definitions and recording helpers."""
+import os
+from prometheus_client import Counter, Histogram, Gauge
+
+TOOL_NAME = os.getenv("TOOL_NAME", "ai-image-gen")
+
+# HTTP Metrics
+http_requests = Counter(
+    "http_requests_total",
+    "Total HTTP requests",
+    ["tool", "endpoint", "method", "status"]
+)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request duration",
+    ["tool", "endpoint", "method"]
+)
+
+# Payment Metrics
+payment_success = Counter(
+    "payment_success_total",
+    "Successful payments",
+    ["tool", "product_sku"]
+)
+
+payment_revenue_cents = Counter(
+    "payment_revenue_cents_total",
+    "Total revenue in cents",
+    ["tool"]
+)
+
+webhook_duplicates = Counter(
+    "webhook_duplicates_total",
+    "Webhook deliveries recognised as replays",
+    ["tool", "source"]
+)
+
+webhook_inbox_pending = Gauge(
+    "webhook_inbox_pending",
+    "Webhook events waiting in the inbox",
+    ["tool"]
+)
+
+webhook_inbox_lag = Gauge(
+    "webhook_inbox_lag_seconds",
+    "Age of the oldest unprocessed webhook event",
+    ["tool"]
+)
+
+webhook_inbox_delay = Histogram(
+    "webhook_inbox_processing_delay_seconds",
+    "Time from webhook receipt to processing",
+    ["tool"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+
+generations_archived = Counter(
+    "generations_archived_total",
+    "Generation rows moved to the archive database",
+    ["tool"]
+)
+
+# Usage Metrics
+tokens_consumed = Counter(
+    "tokens_consumed_total",
+    "Total tokens consumed",
+    ["tool"]
+)
+
+free_trial_used = Counter(
+    "free_trial_used_total",
+    "Free trial generations used",
+    ["tool"]
+)
+
+tokens_rejected = Counter(
+    "tokens_rejected_total",
+    "Tokens rejected without a DB lookup",
+    ["tool", "reason"]  # malformed | signature | expired
+)
+
+load_shed = Counter(
+    "load_shed_total",
+    "Requests rejected with 503 by admission control",
+    ["tool", "priority", "reason"]
+)
+
+rate_limited = Counter(
+    "rate_limited_total",
+    "Requests rejected by the ingress rate limiter",
+    ["tool", "bucket"]  # ip | device:free | device:paid
+)
+
+known_ids_misses = Counter(
+    "known_ids_filter_misses_total",
+    "Lookups answered as definite misses by the known-id Bloom filters",
+    ["tool", "kind"]  # device | token
+)
+
+known_ids_items = Gauge(
+    "known_ids_filter_items",
+    "Items added to the known-id Bloom filters",
+    ["tool", "kind"]
+)
+
+known_ids_error_rate = Gauge(
+    "known_ids_filter_false_positive_rate",
+    "Estimated false-positive rate of the known-id Bloom filters",
+    ["tool", "kind"]
+)
+
+token_cache_lookups = Counter(
+    "token_cache_lookups_total",
+    "Token snapshot cache lookups",
+    ["tool", "result"]  # hit | miss | stale
+)
+
+# Core Function Metrics
+image_generations = Counter(
+    "image_generations_total",
+    "Total image generations",
+    ["tool", "style", "status"]
+)
+
+upstream_requests = Counter(
+    "upstream_requests_total",
+    "Image upstream requests by outcome",
+    ["tool", "upstream", "outcome"]
+)
+
+upstream_request_duration = Histogram(
+    "upstream_request_duration_seconds",
+    "Image upstream request duration",
+    ["tool", "upstream"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60)
+)
+
+upstream_ejections = Counter(
+    "upstream_ejections_total",
+    "Image upstreams ejected from routing after failures",
+    ["tool", "upstream"]
+)
+
+generation_queue_depth = Gauge(
+    "generation_queue_depth",
+    "Generations waiting for an upstream slot",
+    ["tool", "priority"]
+)
+
+generation_queue_wait = Histogram(
+    "generation_queue_wait_seconds",
+    "Time a generation waited for an upstream slot",
+    ["tool", "priority"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+generation_queue_timeouts = Counter(
+    "generation_queue_timeouts_total",
+    "Generations that gave up waiting for an upstream slot",
+    ["tool", "priority"]
+)
+
+generations_cancelled = Counter(
+    "generations_cancelled_total",
+    "Generations cancelled and refunded before completion",
+    ["tool", "reason"]
+)
+
+upstream_calls_avoided = Counter(
+    "upstream_calls_avoided_total",
+    "Generations served without an upstream call",
+    ["tool", "reason"]
+)
+
+# SEO Metrics
+page_views = Counter(
+    "page_views_total",
+    "Total page views",
+    ["tool", "page"]
+)
+
+crawler_visits = Counter(
+    "crawler_visits_total",
+    "Crawler visits",
+    ["tool", "bot"]
+)
+
+programmatic_pages = Gauge(
+    "programmatic_pages_count",
+    "Number of programmatic SEO pages",
+    ["tool"]
+)
+
+# Helper functions to increment metrics
+def record_generation(style: str = "none", success: bool = True):
+    """Record an image generation."""
+    status = "success" if success else "failed"
+    image_generations.labels(tool=TOOL_NAME, style=style, status=status).inc()
+
+
+def record_upstream_avoided(reason: str):
+    """Record a generation served without calling the upstream."""
+    upstream_calls_avoided.labels(tool=TOOL_NAME, reason=reason).inc()
+
+
+def record_upstream_request(upstream: str, outcome: str, seconds: float):
+    """Record one image upstream request."""
+    upstream_requests.labels(tool=TOOL_NAME, upstream=upstream, outcome=outcome).inc()
+    upstream_request_duration.labels(tool=TOOL_NAME, upstream=upstream).observe(seconds)
+
+
+def record_upstream_ejected(upstream: str):
+    """Record an upstream taken out of routing."""
+    upstream_ejections.labels(tool=TOOL_NAME, upstream=upstream).inc()
+
+
+def record_queue_depth(priority: str, depth: int):
+    """Record the number of generations queued in a priority class."""
+    generation_queue_depth.labels(tool=TOOL_NAME, priority=priority).set(depth)
+
+
+def record_queue_wait(priority: str, seconds: float):
+    """Record how long a generation waited for its slot."""
+    generation_queue_wait.labels(tool=TOOL_NAME, priority=priority).observe(seconds)
+
+
+def record_queue_timeout(priority: str):
+    """Record a generation that exceeded its class's max queue wait."""
+    generation_queue_timeouts.labels(tool=TOOL_NAME, priority=priority).inc()
+
+
+def record_generation_cancelled(reason: str):
+    """Record a generation cancelled and refunded before completion."""
+    generations_cancelled.labels(tool=TOOL_NAME, reason=reason).inc()
+
+
+def record_payment(product_sku: str, amount_cents: int):
+    """Record a successful payment."""
+    payment_success.labels(tool=TOOL_NAME, product_sku=product_sku).inc()
+    payment_revenue_cents.labels(tool=TOOL_NAME).inc(amount_cents)
+
+
+def record_webhook_duplicate(source: str):
+    """Record a replayed webhook delivery (source: cache or db)."""
+    webhook_duplicates.labels(tool=TOOL_NAME, source=source).inc()
+
+
+def record_inbox_state(pending: int, lag_seconds: float):
+    """Record current inbox depth and lag."""
+    webhook_inbox_pending.labels(tool=TOOL_NAME).set(pending)
+    webhook_inbox_lag.labels(tool=TOOL_NAME).set(lag_seconds)
+
+
+def record_inbox_delay(seconds: float):
+    """Record how long an event waited in the inbox."""
+    webhook_inbox_delay.labels(tool=TOOL_NAME).observe(seconds)
+
+
+def record_generations_archived(count: int):
+    """Record generation rows moved to the archive."""
+    generations_archived.labels(tool=TOOL_NAME).inc(count)
+
+
+def record_token_rejected(reason: str):
+    """Record a token rejected by the format/signature/expiry pre-check."""
+    tokens_rejected.labels(tool=TOOL_NAME, reason=reason).inc()
+
+
+def record_rate_limited(bucket: str):
+    """Record a request rejected with 429."""
+    rate_limited.labels(tool=TOOL_NAME, bucket=bucket).inc()
+
+
+def record_load_shed(priority: str, reason: str):
+    """Record a request shed by admission control."""
+    load_shed.labels(tool=TOOL_NAME, priority=priority, reason=reason).inc()
+
+
+def record_known_ids_miss(kind: str):
+    """Record a lookup short-circuited by a known-id filter."""
+    known_ids_misses.labels(tool=TOOL_NAME, kind=kind).inc()
+
+
+def record_known_ids_filter(kind: str, items: int, error_rate: float):
+    """Record known-id filter fill and estimated false-positive rate."""
+    known_ids_items.labels(tool=TOOL_NAME, kind=kind).set(items)
+    known_ids_error_rate.labels(tool=TOOL_NAME, kind=kind).set(error_rate)
+
+
+def record_token_cache_lookup(result: str):
+    """Record a token cache lookup (result: hit, miss or stale)."""
+    token_cache_lookups.labels(tool=TOOL_NAME, result=result).inc()
+
+
+def record_token_consumed():
+    """Record a token consumption."""
+    tokens_consumed.labels(tool=TOOL_NAME).inc()
+
+
+def record_free_trial():
+    """Record a free trial usage."""
+    free_trial_used.labels(tool=TOOL_NAME).inc()
@@ -0,0 +1,328 @@
+"""On-demand profiling: stack sampling, asyncio task dumps and per-route CPU time.
+
+Everything here is off by default. When off, the only per-request cost is the
+attribute check at the top of ``ProfilingMiddleware``; the sampler thread and
+the SQLAlchemy listeners exist only while a profile or CPU accounting is on.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+ADMIN_PATH_PREFIX = "/api/v1/admin"
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler producing folded (flamegraph-compatible) stacks.
+
+    Samples every thread, so time spent in the event loop, the aiosqlite
+    worker threads and the threadpool all show up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self.deadline: Optional[float] = None
+        self.remaining_requests: Optional[int] = None
+        self.interval = settings.PROFILER_SAMPLE_INTERVAL_MS / 1000
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: Optional[float] = None, requests: Optional[int] = None,
+              interval_ms: Optional[float] = None) -> bool:
+        """Start a profile bounded by time and/or request count. False if one is running."""
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks.clear()
+            self.samples = 0
+            self.interval = (interval_ms or settings.PROFILER_SAMPLE_INTERVAL_MS) / 1000
+            # A time bound always applies so a forgotten profile cannot run forever.
+            seconds = min(seconds or settings.PROFILER_MAX_SECONDS, settings.PROFILER_MAX_SECONDS)
+            self.started_at = time.time()
+            self.stopped_at = None
+            self.deadline = time.monotonic() + seconds
+            self.remaining_requests = requests
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling; collected stacks stay available."""
+        self._stop.set()
+        thread = self._thread
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=1.0)
+
+    def request_finished(self):
+        """Count down the request budget, stopping when it is used up."""
+        remaining = self.remaining_requests
+        if remaining is None:
+            return
+        self.remaining_requests = remaining - 1
+        if remaining <= 1:
+            self.remaining_requests = 0
+            self._stop.set()
+
+    def folded(self) -> str:
+        """Return stacks as ``frame;frame;frame count`` lines."""
+        with self._lock:
+            items = sorted(self._stacks.items(), key=lambda kv: kv[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "unique_stacks": len(self._stacks),
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "remaining_requests": self.remaining_requests,
+        }
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own_ident:
+                        continue
+                    self._stacks[_fold(names.get(ident, str(ident)), frame)] += 1
+                self.samples += 1
+        self.stopped_at = time.time()
+        if self.remaining_requests:
+            # Timed out before the request budget was used up.
+            self.remaining_requests = None
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _fold(thread_name: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(f"thread:{thread_name}")
+    labels.reverse()
+    return ";".join(label.replace(";", ",") for label in labels)
+
+
+@dataclass
+class RouteCost:
+    """Accumulated cost for one route template."""
+    requests: int = 0
+    cpu_seconds: float = 0.0
+    db_seconds: float = 0.0
+    db_statements: int = 0
+    wall_seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        n = self.requests or 1
+        return {
+            "requests": self.requests,
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "db_seconds": round(self.db_seconds, 6),
+            "db_statements": self.db_statements,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_ms_per_request": round(self.cpu_seconds / n * 1000, 3),
+            "db_ms_per_request": round(self.db_seconds / n * 1000, 3),
+        }
+
+
+@dataclass
+class _RequestCost:
+    cpu: float = 0.0
+    db: float = 0.0
+    statements: int = 0
+    db_started: list = field(default_factory=list)
+
+
+_request_cost: contextvars.ContextVar[Optional[_RequestCost]] = contextvars.ContextVar(
+    "profiling_request_cost", default=None
+)
+
+
+class CPUAccounting:
+    """Per-route event-loop CPU time and DB statement time."""
+
+    def __init__(self):
+        self.enabled = False
+        self.routes: dict[str, RouteCost] = {}
+        self.since: Optional[float] = None
+
+    def enable(self):
+        if self.enabled:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        self.since = self.since or time.time()
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    def reset(self):
+        self.routes.clear()
+        self.since = time.time() if self.enabled else None
+
+    def record(self, route: str, cost: _RequestCost, wall: float):
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = RouteCost()
+        stats.requests += 1
+        stats.cpu_seconds += cost.cpu
+        stats.db_seconds += cost.db
+        stats.db_statements += cost.statements
+        stats.wall_seconds += wall
+
+    def report(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "since": self.since,
+            "routes": {route: cost.as_dict() for route, cost in sorted(self.routes.items())},
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    cost = _request_cost.get()
+    if cost is not None:
+        cost.db_started.append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    cost = _request_cost.get()
+    if cost is not None and cost.db_started:
+        cost.db += time.perf_counter() - cost.db_started.pop()
+        cost.statements += 1
+
+
+class _StepTimer:
+    """Await a coroutine while charging loop-thread CPU time of each step to ``cost``.
+
+    Only the time the coroutine itself runs is counted, not time other tasks
+    spend while it is suspended.
+    """
+
+    def __init__(self, coro, cost: _RequestCost):
+        self._coro = coro
+        self._cost = cost
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        started = time.thread_time()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._cost.cpu += time.thread_time() - started
+
+    def throw(self, *args):
+        started = time.thread_time()
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._cost.cpu += time.thread_time() - started
+
+    def close(self):
+        return self._coro.close()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware feeding ``cpu_accounting`` and the profiler request budget."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (
+            cpu_accounting.enabled or profiler.remaining_requests
+        ):
+            return await self.app(scope, receive, send)
+        if scope["path"].startswith(ADMIN_PATH_PREFIX):
+            return await self.app(scope, receive, send)
+
+        cost = _RequestCost()
+        token = _request_cost.set(cost)
+        started = time.perf_counter()
+        try:
+            await _StepTimer(self.app(scope, receive, send), cost)
+        finally:
+            _request_cost.reset(token)
+            if cpu_accounting.enabled:
+                route = scope.get("route")
+                name = getattr(route, "path", None) or "<unmatched>"
+                cpu_accounting.record(
+                    f"{scope['method']} {name}", cost, time.perf_counter() - started
+                )
+            profiler.request_finished()
+
+
+def _await_chain(coro) -> list[str]:
+    """Follow a coroutine's await chain down to the innermost frame."""
+    frames = []
+    while coro is not None:
+        frame = (getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+                 or getattr(coro, "ag_frame", None))
+        if frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_filename}:{frame.f_lineno} in {code.co_name}")
+        coro = (getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+                or getattr(coro, "ag_await", None))
+    return frames
+
+
+def dump_tasks() -> list[dict]:
+    """Describe every task on the running loop with its await chain."""
+    tasks = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        tasks.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "done": task.done(),
+            "cancelling": task.cancelling() if hasattr(task, "cancelling") else None,
+            "stack": _await_chain(coro),
+        })
+    tasks.sort(key=lambda t: t["name"])
+    return tasks
+
+
+profiler = SamplingProfiler()
+cpu_accounting = CPUAccounting()
@@ -0,0 +1,179 @@
+"""In-memory token-bucket rate limiting."""
+import math
+import time
+import zlib
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.metrics import record_rate_limited
+from app.core.security import SIGNED_TOKEN_RE, token_rejection, verification_secrets
+from app.services.known_ids import known_ids
+from app.services.token_cache import token_cache
+
+
+class BucketStore:
+    """Token buckets keyed by string, spread over LRU shards.
+
+    A bucket that is evicted or has not been created yet behaves like a full
+    one, so evicting idle keys never tightens a limit. Sharding keeps each
+    LRU small and makes eviction per shard, so one hot tenant churning keys
+    does not evict everyone else's buckets.
+    """
+
+    def __init__(self, rate: float, burst: float, shards: int = 16, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self._shards = [LRUCache(max(1, max_keys // shards)) for _ in range(shards)]
+
+    def _shard(self, key: str) -> LRUCache:
+        return self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+
+    def _tokens(self, key: str, now: float) -> float:
+        state = self._shard(key).get(key)
+        if state is None:
+            return self.burst
+        tokens, updated = state
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def wait_time(self, key: str, now: float) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        tokens = self._tokens(key, now)
+        if tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (1 - tokens) / self.rate
+
+    def take(self, key: str, now: float):
+        self._shard(key).put(key, (self._tokens(key, now) - 1, now))
+
+    def clear(self):
+        for shard in self._shards:
+            shard.clear()
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+
+class RateLimiter:
+    """Named bucket stores checked together.
+
+    A request passes only if every bucket it maps to has a token; only then
+    are tokens taken, so a rejected request costs nothing.
+    """
+
+    def __init__(self):
+        self.stores: dict[str, BucketStore] = {}
+
+    def configure(self, name: str, per_minute: float, burst: float, max_keys: int):
+        self.stores[name] = BucketStore(per_minute / 60.0, burst, max_keys=max_keys)
+
+    def acquire(self, keys: list[tuple[str, str]], now: Optional[float] = None) -> tuple[float, Optional[str]]:
+        """Try to take one token from each ``(store, key)``.
+
+        Returns ``(0, None)`` on success, else the longest wait and the store
+        that imposed it; nothing is taken then.
+        """
+        now = time.monotonic() if now is None else now
+        wait, limited_by = 0.0, None
+        for name, key in keys:
+            store_wait = self.stores[name].wait_time(key, now)
+            if store_wait > wait:
+                wait, limited_by = store_wait, name
+        if limited_by is None:
+            for name, key in keys:
+                self.stores[name].take(key, now)
+        return wait, limited_by
+
+    def clear(self):
+        for store in self.stores.values():
+            store.clear()
+
+
+generate_limiter = RateLimiter()
+
+
+def configure_rate_limits():
+    """(Re)build the /generate buckets from settings."""
+    generate_limiter.configure(
+        "ip", settings.RATE_LIMIT_IP_PER_MINUTE, settings.RATE_LIMIT_IP_BURST,
+        settings.RATE_LIMIT_MAX_KEYS,
+    )
+    for tier in ("free", "paid"):
+        generate_limiter.configure(
+            f"device:{tier}",
+            getattr(settings, f"RATE_LIMIT_{tier.upper()}_PER_MINUTE"),
+            getattr(settings, f"RATE_LIMIT_{tier.upper()}_BURST"),
+            settings.RATE_LIMIT_MAX_KEYS,
+        )
+
+
+configure_rate_limits()
+
+
+def client_ip(request: Request) -> str:
+    if settings.RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def token_confirmed(token: str) -> bool:
+    """True if ``token`` is known to be issued and usable, without a DB round trip.
+
+    A well-formed legacy ``tok_`` token proves nothing, so it needs a usable
+    entry in the token cache or a hit in the known-token filter. A signed
+    token is confirmed by its signature and expiry unless the cache knows it
+    is used up; with no signing secret configured it is treated like a
+    legacy token.
+    """
+    if token_rejection(token) is not None:
+        return False
+    snapshot = token_cache.peek(token)
+    if snapshot is not None:
+        return snapshot.is_valid
+    if SIGNED_TOKEN_RE.match(token) and verification_secrets():
+        return True
+    return known_ids.ready and token in known_ids.tokens
+
+
+async def generate_caller(request: Request) -> tuple[Optional[str], bool]:
+    """``(device_id, paid)`` from a /generate body, without touching the DB.
+
+    Only requests whose token is confirmed (see ``token_confirmed``) count
+    as paid; anything else gets the free tier. Malformed bodies give
+    ``(None, False)`` and are left to request validation.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        return None, False
+    device_id, token = body.get("device_id"), body.get("token")
+    paid = isinstance(token, str) and token_confirmed(token)
+    return (device_id if isinstance(device_id, str) else None), paid
+
+
+async def rate_limit_generate(request: Request):
+    """Per-IP and per-device (by tier) limit for /generate, checked before any DB work."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    keys = [("ip", client_ip(request))]
+    device_id, paid = await generate_caller(request)
+    if device_id is not None:
+        keys.append(("device:paid" if paid else "device:free", device_id))
+
+    wait, limited_by = generate_limiter.acquire(keys)
+    if limited_by is None:
+        return
+    record_rate_limited(limited_by)
+    raise HTTPException(
+        status_code=429,
+        detail={"error": "Too many requests. Please slow down.", "code": "rate_limited"},
+        headers={"Retry-After": str(max(1, math.ceil(wait)))},
+    )
@@ -0,0 +1,100 @@
+"""Access control helpers."""
+import base64
+import hashlib
+import hmac
+import re
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from app.core.config import settings
+from app.core.metrics import record_token_rejected
+
+# Legacy random tokens: only the shape can be checked without the DB.
+LEGACY_TOKEN_RE = re.compile(r"^tok_[0-9a-f]{32}$")
+# Signed tokens: tks_<token id hex>.<expiry unix seconds>.<truncated HMAC-SHA256>
+SIGNED_TOKEN_RE = re.compile(r"^tks_([0-9a-f]{32})\.([0-9]{1,12})\.([A-Za-z0-9_-]{22})$")
+
+
+async def require_admin(x_admin_key: str = Header(None, alias="X-Admin-Key")):
+    """Guard admin endpoints. The admin surface does not exist without ADMIN_API_KEY."""
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_key or not hmac.compare_digest(x_admin_key, settings.ADMIN_API_KEY):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+
+
+def _token_signature(payload: str, secret: str) -> str:
+    digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).rstrip(b"=").decode()
+
+
+def verification_secrets() -> list[str]:
+    """The signing secret, then previous ones (``TOKEN_SIGNING_SECRETS``)."""
+    secrets = [settings.TOKEN_SIGNING_SECRET, *settings.TOKEN_SIGNING_SECRETS]
+    return [secret for secret in secrets if secret]
+
+
+def sign_token(token_id: str, expires_at: datetime) -> str:
+    """Build a self-validating token string for ``token_id`` (a UUID)."""
+    expiry = int(expires_at.replace(tzinfo=timezone.utc).timestamp())
+    payload = f"tks_{token_id.replace('-', '')}.{expiry}"
+    return f"{payload}.{_token_signature(payload, settings.TOKEN_SIGNING_SECRET)}"
+
+
+def token_rejection(token: str) -> Optional[str]:
+    """Why ``token`` cannot be valid, or None if it needs a DB lookup.
+
+    Reasons: ``malformed``, ``signature`` or ``expired``. Costs no I/O, so
+    callers run it before touching the cache or the database. Signatures
+    from any of ``verification_secrets`` count; with none configured signed
+    tokens cannot be checked here and go to the database like legacy ones.
+    """
+    if LEGACY_TOKEN_RE.match(token):
+        return None
+    match = SIGNED_TOKEN_RE.match(token)
+    if not match:
+        return "malformed"
+    secrets = verification_secrets()
+    if not secrets:
+        return None
+    payload = token[: match.start(3) - 1]
+    if not any(
+        hmac.compare_digest(match.group(3), _token_signature(payload, secret))
+        for secret in secrets
+    ):
+        return "signature"
+    if int(match.group(2)) <= time.time():
+        return "expired"
+    return None
+
+
+def token_may_be_valid(token: str) -> bool:
+    """Cheap pre-check before a token lookup; rejections are counted."""
+    reason = token_rejection(token)
+    if reason is None:
+        return True
+    record_token_rejected(reason)
+    return False
+
+
+@lru_cache(maxsize=4)
+def _device_hash_key(secret: str) -> bytes:
+    return hashlib.sha256(secret.encode()).digest()  # BLAKE2b keys are at most 64 bytes
+
+
+def device_key(device_id: Optional[str]) -> Optional[int]:
+    """Signed 64-bit keyed hash of ``device_id`` (fits a BIGINT column).
+
+    None without ``DEVICE_KEY_SECRET`` or without a device id. Keyed, so
+    clients cannot pick device ids that collide on purpose.
+    """
+    if device_id is None or not settings.DEVICE_KEY_SECRET:
+        return None
+    digest = hashlib.blake2b(
+        device_id.encode(), digest_size=8, key=_device_hash_key(settings.DEVICE_KEY_SECRET)
+    ).digest()
+    return int.from_bytes(digest, "big", signed=True)
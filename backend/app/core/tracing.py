@@ -0,0 +1,426 @@
+"""Lightweight in-process request tracing.
+
+A trace starts in ``TracingMiddleware`` (continuing an incoming W3C
+``traceparent`` when present), phases are wrapped with ``span(...)``, and
+SQLAlchemy statements and upstream httpx calls add child spans through event
+hooks. Finished traces go to a pluggable exporter. With no exporter set,
+``span`` returns a shared no-op and the hooks return immediately.
+"""
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Protocol
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TRACE_ID_HEADER = "X-Trace-Id"
+_MAX_STATEMENT_LENGTH = 300
+
+
+@dataclass
+class Span:
+    """A timed operation within a trace."""
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: dict = field(default_factory=dict)
+    error: Optional[str] = None
+    _trace: "Optional[_Trace]" = field(default=None, repr=False)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[str] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error:
+            self.error = error
+        if self._trace is not None:
+            self._trace.finished(self)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+class _Trace:
+    """Collects the spans of one request and exports them when the root ends."""
+
+    def __init__(self, root_id: str):
+        self.root_id = root_id
+        self.spans: list[Span] = []
+
+    def finished(self, span: Span):
+        self.spans.append(span)
+        if span.span_id == self.root_id and _exporter is not None:
+            try:
+                _exporter.export(self.spans)
+            except Exception:
+                logger.exception("Span export failed")
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: list[Span]) -> None: ...
+
+    def shutdown(self) -> None: ...
+
+
+class LogSpanExporter:
+    """Log one line per span, children indented under their parent."""
+
+    def __init__(self, log: logging.Logger = logger):
+        self.log = log
+
+    def export(self, spans: list[Span]):
+        depth = {}
+        for span in sorted(spans, key=lambda s: s.start_ns):
+            level = depth.get(span.parent_id, -1) + 1
+            depth[span.span_id] = level
+            attrs = " ".join(f"{k}={v}" for k, v in span.attributes.items())
+            self.log.info(
+                f"trace={span.trace_id} {'  ' * level}{span.name} "
+                f"{span.duration_ms:.2f}ms {attrs}{' error=' + span.error if span.error else ''}"
+            )
+
+    def shutdown(self):
+        pass
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_kind(span: Span) -> int:
+    if span._trace is not None and span._trace.root_id == span.span_id:
+        return 2  # SERVER
+    if span.name.startswith("HTTP "):
+        return 3  # CLIENT
+    return 1  # INTERNAL
+
+
+def to_otlp(spans: list[Span], service_name: str) -> dict:
+    """Encode spans as an OTLP/JSON ``ExportTraceServiceRequest``."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": service_name}},
+        ]},
+        "scopeSpans": [{
+            "scope": {"name": "app.core.tracing"},
+            "spans": [{
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": _otlp_kind(s),
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 0},
+            } for s in spans],
+        }],
+    }]}
+
+
+class OTLPFileExporter:
+    """Append one OTLP/JSON document per trace to a file, from a writer thread."""
+
+    def __init__(self, path: str, service_name: str = settings.TOOL_NAME):
+        self.path = path
+        self.service_name = service_name
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: list[Span]):
+        self._queue.put(spans)
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as fh:
+            while True:
+                spans = self._queue.get()
+                if spans is None:
+                    return
+                fh.write(json.dumps(to_otlp(spans, self.service_name)) + "\n")
+                if self._queue.empty():
+                    fh.flush()
+
+
+EXPORTERS = {
+    "log": lambda: LogSpanExporter(),
+    "file": lambda: OTLPFileExporter(settings.TRACING_FILE_PATH),
+}
+
+_exporter: Optional[SpanExporter] = None
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "tracing_current_span", default=None
+)
+
+
+def set_exporter(exporter: Optional[SpanExporter]):
+    """Install (or with None, remove) the span exporter."""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    if previous is not None and previous is not exporter:
+        previous.shutdown()
+    if exporter is not None and not event.contains(Engine, "before_cursor_execute", _before_execute):
+        event.listen(Engine, "before_cursor_execute", _before_execute)
+        event.listen(Engine, "after_cursor_execute", _after_execute)
+        event.listen(Engine, "handle_error", _on_db_error)
+
+
+def configure_tracing():
+    """Set up the exporter named by TRACING_EXPORTER, if any."""
+    name = settings.TRACING_EXPORTER
+    if not name:
+        return
+    if name not in EXPORTERS:
+        logger.warning(f"Unknown TRACING_EXPORTER {name!r}; tracing disabled")
+        return
+    set_exporter(EXPORTERS[name]())
+
+
+def is_enabled() -> bool:
+    return _exporter is not None
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple[str, str, bool]]:
+    """Parse a W3C traceparent into (trace_id, parent_span_id, sampled)."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_trace(name: str, traceparent: Optional[str] = None) -> Optional[Span]:
+    """Start a root span, or return None when tracing is off or not sampled."""
+    if _exporter is None:
+        return None
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id = _new_id(128), None
+        sampled = random.random() < settings.TRACING_SAMPLE_RATE
+    if not sampled:
+        return None
+    span_id = _new_id(64)
+    root = Span(trace_id=trace_id, span_id=span_id, parent_id=parent_id, name=name)
+    root._trace = _Trace(span_id)
+    return root
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes) -> Optional[Span]:
+    """Start a child span without making it current."""
+    parent = parent or _current.get()
+    if parent is None:
+        return None
+    return Span(
+        trace_id=parent.trace_id, span_id=_new_id(64), parent_id=parent.span_id,
+        name=name, attributes=attributes, _trace=parent._trace,
+    )
+
+
+class _SpanScope:
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.span.finish(error=f"{exc_type.__name__}: {exc}" if exc_type else None)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """Context manager timing a phase as a child of the current span."""
+    if _current.get() is None:
+        return _NOOP
+    return _SpanScope(start_span(name, **attributes))
+
+
+# SQLAlchemy hooks
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    context.trace_span = start_span(
+        "db.statement", **{"db.statement": statement[:_MAX_STATEMENT_LENGTH]}
+    )
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    db_span = getattr(context, "trace_span", None)
+    if db_span is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            db_span.set_attribute("db.rowcount", cursor.rowcount)
+        db_span.finish()
+
+
+def _on_db_error(context):
+    db_span = getattr(context.execution_context, "trace_span", None)
+    if db_span is not None:
+        db_span.finish(error=str(context.original_exception)[:_MAX_STATEMENT_LENGTH])
+
+
+# httpx hooks
+
+_HTTPCORE_PHASES = {
+    "connection.connect_tcp": "http.connect",
+    "connection.connect_unix_socket": "http.connect",
+    "connection.start_tls": "http.tls",
+    "http11.send_request_headers": "http.send_headers",
+    "http11.send_request_body": "http.send_body",
+    "http2.send_request_headers": "http.send_headers",
+    "http2.send_request_body": "http.send_body",
+    "http11.receive_response_headers": "http.ttfb",
+    "http2.receive_response_headers": "http.ttfb",
+    "http11.receive_response_body": "http.download",
+    "http2.receive_response_body": "http.download",
+}
+
+
+async def _on_request(request):
+    client_span = start_span(
+        f"HTTP {request.method}", **{"http.url": str(request.url.copy_with(query=None))}
+    )
+    if client_span is None:
+        return
+    request.headers["traceparent"] = client_span.traceparent()
+    open_phases: dict[str, Span] = {}
+
+    async def trace(name: str, info: dict):
+        prefix, _, stage = name.rpartition(".")
+        phase = _HTTPCORE_PHASES.get(prefix)
+        if phase is not None and stage == "started":
+            open_phases[prefix] = start_span(phase, parent=client_span)
+        elif phase is not None and prefix in open_phases:
+            open_phases.pop(prefix).finish(
+                error=str(info.get("exception")) if stage == "failed" else None
+            )
+        if name.endswith("response_closed.complete") or stage == "failed":
+            client_span.finish(error=str(info.get("exception")) if stage == "failed" else None)
+
+    request.extensions["trace"] = trace
+    request.extensions["trace_span"] = client_span
+
+
+async def _on_response(response):
+    client_span = response.request.extensions.get("trace_span")
+    if client_span is not None:
+        client_span.set_attribute("http.status_code", response.status_code)
+
+
+def httpx_event_hooks() -> dict:
+    """Event hooks for an httpx client; empty when tracing is off."""
+    if _exporter is None:
+        return {}
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a root span per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _exporter is None:
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent")
+        root = start_trace(
+            f"{scope['method']} {scope['path']}",
+            traceparent.decode("latin-1") if traceparent else None,
+        )
+        if root is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", root.traceparent().encode()),
+                    (TRACE_ID_HEADER.lower().encode(), root.trace_id.encode()),
+                ]
+            await send(message)
+
+        root.set_attribute("http.method", scope["method"])
+        root.set_attribute("http.target", scope["path"])
+        error = None
+        token = _current.set(root)
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            root.finish(error=error)
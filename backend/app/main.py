@@ -1,28 +1,103 @@
 """FastAPI application for AI Image Generator."""
+import asyncio
 import logging
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from app.core.config import settings
-from app.core.database import init_db
-from app.api.v1 import generate, payment, tokens, metrics
+from app.core.database import async_session, close_db, init_db, warm_db_pool
+from app.core.profiling import ProfilingMiddleware
+from app.core.responses import PrecomputedResponse
+from app.core.tracing import TracingMiddleware, configure_tracing
+from app.services.device_keys import backfill_device_keys
+from app.services.drain import generation_drain
+from app.services.idempotency import idempotency_cleanup_worker
+from app.services.known_ids import known_ids
+from app.services.retention import retention_worker
+from app.services.rollups import rollup_worker
+from app.services.similar_prompts import prompt_index
+from app.services.upstreams import upstream_pool
+from app.services.webhook_inbox import inbox_consumer
+from app.api.v1 import generate, generations, payment, tokens, metrics, admin
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+configure_tracing()
+
+
+startup_phases: dict[str, float] = {}
+_background_loads: list[asyncio.Task] = []
+
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    yield
+    startup_phases[name] = round(time.perf_counter() - started, 4)
+
+
+async def load_caches():
+    """Optional lookup caches; requests fall back to the DB until they are loaded."""
+    if settings.BLOOM_FILTER_ENABLED:
+        await known_ids.load(async_session)
+    if settings.PROMPT_REUSE_ENABLED:
+        await prompt_index.load(async_session)
+
+
+async def _load_caches_after_startup():
+    try:
+        await load_caches()
+    except Exception:
+        logger.exception("Loading lookup caches failed; requests keep using the DB")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager."""
     # Startup
-    logger.info("Initializing database...")
-    await init_db()
-    logger.info("Database initialized")
+    startup_phases.clear()
+    with startup_phase("init_db"):
+        migrated = await init_db()
+    logger.info("Database schema updated" if migrated else "Database schema current; DDL skipped")
+    with startup_phase("device_keys"):
+        await backfill_device_keys()
+    if settings.STARTUP_DEFER_CACHES:
+        _background_loads.append(asyncio.create_task(_load_caches_after_startup(), name="load-caches"))
+    else:
+        with startup_phase("load_caches"):
+            await load_caches()
+    with startup_phase("warmup"):
+        await asyncio.gather(
+            warm_db_pool(settings.STARTUP_WARM_DB_CONNECTIONS),
+            upstream_pool.warm(settings.STARTUP_WARMUP_TIMEOUT_SECONDS)
+            if settings.STARTUP_WARM_UPSTREAMS else asyncio.sleep(0),
+        )
+    inbox_consumer.start()
+    if settings.ROLLUP_ENABLED:
+        rollup_worker.start()
+    if settings.RETENTION_DAYS > 0:
+        retention_worker.start()
+    idempotency_cleanup_worker.start()
+    generation_drain.drain_on_signal(settings.DRAIN_TIMEOUT_SECONDS)
+    logger.info(f"Startup phases (s): {startup_phases}")
     yield
-    # Shutdown
+    # Shutdown: normally already drained on the signal; this covers other exits
     logger.info("Shutting down...")
+    await generation_drain.drain(settings.DRAIN_TIMEOUT_SECONDS)
+    for task in _background_loads:
+        task.cancel()
+    _background_loads.clear()
+    await inbox_consumer.stop()
+    await rollup_worker.stop()
+    await retention_worker.stop()
+    await idempotency_cleanup_worker.stop()
+    await upstream_pool.aclose()
+    await close_db()
+    logger.info("Shutdown complete")
 
 
 app = FastAPI(
@@ -32,6 +107,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Profiling hooks (innermost, so route CPU excludes other middleware)
+app.add_middleware(ProfilingMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -39,8 +117,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["traceparent", "X-Trace-Id", "Idempotent-Replayed"],
 )
 
+# Request tracing (root span per request)
+app.add_middleware(TracingMiddleware)
+
 
 # Exception handler
 @app.exception_handler(Exception)
@@ -53,28 +135,48 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 
-# Health check
+# Static bodies, serialized once
+health_response = PrecomputedResponse(
+    {"status": "healthy", "service": settings.APP_NAME},
+    cache_control="no-cache",
+)
+root_response = PrecomputedResponse({
+    "service": settings.APP_NAME,
+    "version": "1.0.0",
+    "docs": "/docs"
+})
+
+
+# Health check (readiness: 503 once draining, so load balancers stop routing here)
 @app.get("/health")
-async def health():
+async def health(request: Request):
     """Health check endpoint."""
-    return {"status": "healthy", "service": settings.APP_NAME}
+    if not generation_drain.accepting:
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": generation_drain.state,
+                "service": settings.APP_NAME,
+                "in_flight": len(generation_drain.active),
+            },
+            headers={"Cache-Control": "no-cache"},
+        )
+    return health_response(request)
 
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Root endpoint."""
-    return {
-        "service": settings.APP_NAME,
-        "version": "1.0.0",
-        "docs": "/docs"
-    }
+    return root_response(request)
 
 
 # Include routers
 app.include_router(generate.router, prefix="/api/v1", tags=["generation"])
+app.include_router(generations.router, prefix="/api/v1", tags=["generation"])
 app.include_router(payment.router, prefix="/api/v1", tags=["payment"])
 app.include_router(tokens.router, prefix="/api/v1", tags=["tokens"])
 app.include_router(metrics.router, tags=["metrics"])
+app.include_router(admin.router, prefix="/api/v1", tags=["admin"])
 
 
 # Bot detection middleware for SEO metrics
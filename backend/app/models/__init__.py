@@ -2,5 +2,11 @@
 from app.models.token import GenerationToken
 from app.models.payment import PaymentTransaction
 from app.models.generation import FreeTrialUsage, ImageGeneration
+from app.models.webhook import WebhookInbox
+from app.models.analytics import UsageRollup, RollupWatermark
+from app.models.idempotency import IdempotencyKey
 
-__all__ = ["GenerationToken", "PaymentTransaction", "FreeTrialUsage", "ImageGeneration"]
+__all__ = [
+    "GenerationToken", "PaymentTransaction", "FreeTrialUsage", "ImageGeneration",
+    "WebhookInbox", "UsageRollup", "RollupWatermark", "IdempotencyKey",
+]
@@ -0,0 +1,34 @@
+"""Analytics Models — Hourly usage rollups and their watermarks."""
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, DateTime
+
+from app.core.database import Base
+
+
+class UsageRollup(Base):
+    """Hourly counts of generations and payments.
+
+    ``metric`` is "generation" (keyed by style/status) or "payment" (keyed by
+    status/product_sku/currency). Unused key parts are "" so they can be part
+    of the primary key.
+    """
+    __tablename__ = "usage_rollups"
+
+    metric = Column(String(20), primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    style = Column(String(50), primary_key=True, default="")
+    status = Column(String(20), primary_key=True, default="")
+    product_sku = Column(String(50), primary_key=True, default="")
+    currency = Column(String(3), primary_key=True, default="")
+    count = Column(Integer, nullable=False, default=0)
+    amount_cents = Column(Integer, nullable=False, default=0)
+
+
+class RollupWatermark(Base):
+    """Last (created_at, id) folded into the rollups, per source table."""
+    __tablename__ = "rollup_watermarks"
+
+    source = Column(String(50), primary_key=True)
+    last_created_at = Column(DateTime, nullable=False)
+    last_id = Column(String(36), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
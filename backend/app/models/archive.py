@@ -0,0 +1,28 @@
+"""Archive Models — Generations moved out of the hot database.
+
+These tables live in ARCHIVE_DATABASE_URL, so they use their own metadata and
+are not created by ``init_db``.
+"""
+from sqlalchemy import Column, String, DateTime, LargeBinary
+from sqlalchemy.orm import declarative_base
+
+ArchiveBase = declarative_base()
+
+
+class ArchivedGeneration(ArchiveBase):
+    """An image generation past retention.
+
+    Small columns stay queryable; ``payload`` is zlib-compressed JSON of the
+    large text columns (prompt, image_url, error_message).
+    """
+    __tablename__ = "archived_generations"
+
+    id = Column(String(36), primary_key=True)
+    device_id = Column(String(255), index=True)
+    token_id = Column(String(36))
+    model = Column(String(50), nullable=False)
+    style = Column(String(50))
+    status = Column(String(20))
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
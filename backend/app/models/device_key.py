@@ -0,0 +1,81 @@
+"""Compact device keys: a keyed 64-bit hash of ``device_id``.
+
+Device fingerprints are long strings, so indexes on ``device_id`` are large
+and every probe compares long keys. With ``DEVICE_KEY_SECRET`` set, device
+lookups go through the integer ``device_key`` index instead and
+``device_id`` (kept for display) only re-checks the rare hash collision.
+Inserts fill the key from ``device_id``; ``app.services.device_keys``
+backfills rows written before the secret was set or changed.
+"""
+from typing import Callable, Iterable
+
+from sqlalchemy import BigInteger, Column, and_, bindparam
+
+from app.core.config import settings
+from app.core.security import device_key
+
+
+def _insert_default(context):
+    return device_key(context.get_current_parameters().get("device_id"))
+
+
+def device_key_column(index: bool = True) -> Column:
+    return Column(BigInteger, index=index, default=_insert_default)
+
+
+def device_keys_enabled() -> bool:
+    return bool(settings.DEVICE_KEY_SECRET)
+
+
+def _recheck(model):
+    # An expression rather than the bare column, so the planner probes the
+    # device_key index instead of a (unique) device_id index.
+    return model.device_id.concat("")
+
+
+def device_is(model, device_id: str):
+    """``model.device_id == device_id``, through the device_key index when enabled."""
+    key = device_key(device_id)
+    if key is None:
+        return model.device_id == device_id
+    return and_(model.device_key == key, _recheck(model) == device_id)
+
+
+def device_in(model, device_ids: Iterable[str]):
+    device_ids = list(device_ids)
+    if not device_keys_enabled():
+        return model.device_id.in_(device_ids)
+    return and_(
+        model.device_key.in_([device_key(d) for d in device_ids]),
+        _recheck(model).in_(device_ids),
+    )
+
+
+def device_match(model):
+    """Like ``device_is`` but on bind parameters; execute with ``device_params``."""
+    if not device_keys_enabled():
+        return model.device_id == bindparam("device_id")
+    return and_(
+        model.device_key == bindparam("device_key"),
+        _recheck(model) == bindparam("device_id"),
+    )
+
+
+def device_params(device_id: str) -> dict:
+    return {"device_id": device_id, "device_key": device_key(device_id)}
+
+
+def keyed_statement(build: Callable):
+    """A prebuilt device lookup, rebuilt if ``DEVICE_KEY_SECRET`` is toggled.
+
+    ``build`` uses ``device_match``; call the result to get the statement.
+    """
+    built = {}
+
+    def statement():
+        enabled = device_keys_enabled()
+        if enabled not in built:
+            built[enabled] = build()
+        return built[enabled]
+
+    return statement
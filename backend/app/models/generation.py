@@ -1,9 +1,10 @@
 """Generation Models — Track image generations and free trials."""
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Text
+from sqlalchemy import Column, String, Integer, DateTime, Text, Index
 
 from app.core.database import Base
+from app.models.device_key import device_key_column
 
 
 class FreeTrialUsage(Base):
@@ -12,6 +13,7 @@ class FreeTrialUsage(Base):
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     device_id = Column(String(255), unique=True, nullable=False, index=True)
+    device_key = device_key_column()
     used_count = Column(Integer, default=0)
     first_used_at = Column(DateTime, default=datetime.utcnow)
     last_used_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -20,9 +22,17 @@ class FreeTrialUsage(Base):
 class ImageGeneration(Base):
     """Record of generated images."""
     __tablename__ = "image_generations"
+    __table_args__ = (
+        # Keyset pagination of a device's history, newest first.
+        Index("ix_image_generations_device_created", "device_id", "created_at", "id"),
+        Index("ix_image_generations_device_key_created", "device_key", "created_at", "id"),
+        # Time-range scans (exports).
+        Index("ix_image_generations_created", "created_at", "id"),
+    )
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    device_id = Column(String(255), index=True)
+    device_id = Column(String(255))  # Leading column of ix_image_generations_device_created
+    device_key = device_key_column(index=False)  # ... and of ix_..._device_key_created
     token_id = Column(String(36), nullable=True)
     prompt = Column(Text, nullable=False)
     model = Column(String(50), nullable=False)
@@ -0,0 +1,23 @@
+"""IdempotencyKey Model — Client retry keys for /generate."""
+from datetime import datetime
+from sqlalchemy import Column, String, DateTime, Text
+
+from app.core.database import Base
+
+
+class IdempotencyKey(Base):
+    """An ``Idempotency-Key`` header mapped to the generation it started.
+
+    Keys are scoped to the device that sent them. ``response`` holds the
+    JSON body once the generation succeeded; until then retries wait for it.
+    Rows past ``expires_at`` are deleted in batches.
+    """
+    __tablename__ = "idempotency_keys"
+
+    device_id = Column(String(255), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # Same key, different request: rejected
+    generation_id = Column(String(36), nullable=False)
+    response = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -1,7 +1,7 @@
 """PaymentTransaction Model — Payment records."""
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from app.core.database import Base
@@ -9,6 +9,10 @@ from app.core.database import Base
 
 class PaymentTransaction(Base):
     __tablename__ = "payment_transactions"
+    __table_args__ = (
+        # Time-range scans (exports).
+        Index("ix_payment_transactions_created", "created_at", "id"),
+    )
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     token_id = Column(String(36), ForeignKey("generation_tokens.id"), nullable=False)
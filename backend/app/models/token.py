@@ -4,7 +4,10 @@ from datetime import datetime, timedelta
 from sqlalchemy import Column, String, Integer, DateTime
 from sqlalchemy.orm import relationship
 
+from app.core.config import settings
 from app.core.database import Base
+from app.core.security import sign_token
+from app.models.device_key import device_key_column
 
 
 class GenerationToken(Base):
@@ -17,6 +20,7 @@ class GenerationToken(Base):
     remaining_generations = Column(Integer, nullable=False)
     expires_at = Column(DateTime, nullable=False, index=True)
     device_id = Column(String(255), index=True)
+    device_key = device_key_column()
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -24,13 +28,24 @@ class GenerationToken(Base):
 
     @classmethod
     def create_token(cls, product_sku: str, generations: int, device_id: str = None):
-        """Create a new token with 1 year validity."""
+        """Create a new token with 1 year validity.
+
+        With TOKEN_SIGNING_SECRET set the token string embeds the id, expiry
+        and an HMAC, so invalid tokens are rejected without a DB lookup.
+        """
+        token_id = str(uuid.uuid4())
+        expires_at = datetime.utcnow() + timedelta(days=365)
+        if settings.TOKEN_SIGNING_SECRET:
+            token = sign_token(token_id, expires_at)
+        else:
+            token = f"tok_{uuid.uuid4().hex}"
         return cls(
-            token=f"tok_{uuid.uuid4().hex}",
+            id=token_id,
+            token=token,
             product_sku=product_sku,
             total_generations=generations,
             remaining_generations=generations,
-            expires_at=datetime.utcnow() + timedelta(days=365),
+            expires_at=expires_at,
             device_id=device_id,
         )
 
@@ -0,0 +1,23 @@
+"""WebhookInbox Model — Durable log of received provider webhooks."""
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, DateTime, Text, Index
+
+from app.core.database import Base
+
+
+class WebhookInbox(Base):
+    """Raw webhook events, acknowledged on insert and processed in the background."""
+    __tablename__ = "webhook_inbox"
+    __table_args__ = (
+        Index("ix_webhook_inbox_status_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_id = Column(String(255), unique=True)
+    event_type = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending | done | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = Column(DateTime)
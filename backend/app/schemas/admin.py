@@ -0,0 +1,41 @@
+"""Admin schemas."""
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Optional
+
+
+class ProfileStartRequest(BaseModel):
+    """Start a sampling profile for a time window and/or the next N requests."""
+    seconds: Optional[float] = Field(default=None, gt=0, description="Time window")
+    requests: Optional[int] = Field(default=None, gt=0, description="Stop after N requests")
+    interval_ms: Optional[float] = Field(default=None, ge=1, le=1000)
+
+
+class ProfileStatus(BaseModel):
+    """Sampling profiler state."""
+    running: bool
+    samples: int
+    unique_stacks: int
+    interval_ms: float
+    started_at: Optional[float] = None
+    stopped_at: Optional[float] = None
+    remaining_requests: Optional[int] = None
+
+
+class AnalyticsRow(BaseModel):
+    """Counts for one time bucket and key."""
+    bucket: datetime
+    style: Optional[str] = None
+    status: str
+    product_sku: Optional[str] = None
+    currency: Optional[str] = None
+    count: int
+    amount_cents: Optional[int] = None
+
+
+class AnalyticsReport(BaseModel):
+    """Usage rollups; data is complete up to each source's watermark."""
+    metric: str
+    granularity: str
+    watermarks: dict[str, Optional[datetime]]
+    rows: list[AnalyticsRow]
@@ -1,5 +1,6 @@
 """Image generation schemas."""
 from pydantic import BaseModel, Field
+from datetime import datetime
 from typing import Optional, Literal
 from enum import Enum
 
@@ -22,6 +23,9 @@ class GenerateImageRequest(BaseModel):
     style: Optional[StylePreset] = Field(default=None, description="Style preset")
     device_id: str = Field(..., description="Device fingerprint for tracking")
     token: Optional[str] = Field(default=None, description="Payment token for paid generations")
+    allow_similar: bool = Field(
+        default=False, description="Accept a recent image generated for a near-identical prompt"
+    )
 
 
 class GenerateImageResponse(BaseModel):
@@ -31,6 +35,7 @@ class GenerateImageResponse(BaseModel):
     remaining_generations: Optional[int] = None
     is_free_trial: bool = False
     error: Optional[str] = None
+    reused_from: Optional[str] = None
 
 
 class GenerationStatus(BaseModel):
@@ -46,3 +51,32 @@ class UsageInfo(BaseModel):
     free_remaining: int
     paid_remaining: int
     total_remaining: int
+
+
+class GenerationHistoryItem(BaseModel):
+    """One past generation; ``prompt``/``error_message`` only when requested."""
+    id: str
+    created_at: datetime
+    status: str
+    style: Optional[str] = None
+    image_url: Optional[str] = None
+    prompt: Optional[str] = None
+    error_message: Optional[str] = None
+
+
+class GenerationRecord(BaseModel):
+    """A single generation, from the hot table or the archive."""
+    id: str
+    created_at: Optional[datetime] = None
+    status: Optional[str] = None
+    style: Optional[str] = None
+    image_url: Optional[str] = None
+    prompt: Optional[str] = None
+    error_message: Optional[str] = None
+    archived: bool = False
+
+
+class GenerationHistoryPage(BaseModel):
+    """A page of history, newest first; pass ``next_cursor`` as ``after``."""
+    items: list[GenerationHistoryItem]
+    next_cursor: Optional[str] = None
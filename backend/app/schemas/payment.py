@@ -1,5 +1,5 @@
 """Payment schemas."""
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
@@ -43,3 +43,28 @@ class TokenListResponse(BaseModel):
 class ValidateResponse(BaseModel):
     """Token validation response."""
     valid: bool
+
+
+class BulkValidateRequest(BaseModel):
+    """Tokens and/or device ids to resolve in one call."""
+    tokens: list[str] = Field(default_factory=list)
+    device_ids: list[str] = Field(default_factory=list)
+
+
+class BulkTokenStatus(BaseModel):
+    """One entry of the bulk validation result.
+
+    Token lookups echo ``token``; device lookups return one entry per token
+    of the device, or a single ``found: false`` entry.
+    """
+    token: Optional[str] = None
+    device_id: Optional[str] = None
+    found: bool
+    valid: bool = False
+    remaining_generations: int = 0
+    expires_at: Optional[str] = None
+
+
+class BulkValidateResponse(BaseModel):
+    """Bulk validation result, in request order (streamed)."""
+    results: list[BulkTokenStatus]
@@ -0,0 +1,71 @@
+"""Backfill of compact device keys (see ``app.models.device_key``).
+
+New rows get their ``device_key`` on insert. Rows written before
+``DEVICE_KEY_SECRET`` was set (or under a different secret) are rewritten
+at startup, in primary-key order and one short transaction per batch, before
+the worker reports ready. A fingerprint of the key stored in
+``schema_version`` makes later startups skip the scan.
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+from app.core.database import engine, store_fingerprint, stored_fingerprint
+from app.core.security import device_key
+from app.models import FreeTrialUsage, GenerationToken, ImageGeneration
+
+logger = logging.getLogger(__name__)
+
+KEYED_TABLES = (FreeTrialUsage.__table__, GenerationToken.__table__, ImageGeneration.__table__)
+
+
+def key_fingerprint() -> str:
+    """Identifies the current key without revealing it; "" when keys are off."""
+    key = device_key("device-key-fingerprint")
+    return "" if key is None else format(key & (2**64 - 1), "016x")
+
+
+async def backfill_table(db_engine: AsyncEngine, table, batch_size: int) -> int:
+    """Recompute ``device_key`` for every row of ``table``. Returns rows written."""
+    set_key = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(device_key=bindparam("key"))
+    )
+    written = 0
+    last_id = ""
+    while True:
+        async with db_engine.begin() as conn:
+            rows = (await conn.execute(
+                select(table.c.id, table.c.device_id)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                return written
+            await conn.execute(
+                set_key, [{"row_id": row.id, "key": device_key(row.device_id)} for row in rows]
+            )
+        last_id = rows[-1].id
+        written += len(rows)
+
+
+async def backfill_device_keys(db_engine: Optional[AsyncEngine] = None) -> int:
+    """Bring stored device keys in line with ``DEVICE_KEY_SECRET``. Returns rows rewritten."""
+    db_engine = db_engine or engine
+    fingerprint = key_fingerprint()
+    if await stored_fingerprint(db_engine, "device_key") == fingerprint:
+        return 0
+    written = 0
+    if fingerprint:  # Keys turned off leave stale keys behind; nothing reads them.
+        for table in KEYED_TABLES:
+            count = await backfill_table(db_engine, table, settings.DEVICE_KEY_BACKFILL_BATCH_SIZE)
+            logger.info(f"Backfilled device_key on {count} {table.name} rows")
+            written += count
+    async with db_engine.begin() as conn:
+        await store_fingerprint(conn, "device_key", fingerprint)
+    return written
@@ -0,0 +1,221 @@
+"""Graceful drain of in-flight generations.
+
+Every /generate request is tracked from admission until it returns. Once
+the endpoint has reserved quota it attaches a ``Reservation``, cleared
+again after the settle commit. On shutdown (or ``POST /admin/drain``) the
+worker stops accepting generations, reports not-ready on ``/health``, waits
+up to ``DRAIN_TIMEOUT_SECONDS`` for in-flight requests, then cancels the
+rest. Under uvicorn the drain starts as soon as SIGTERM/SIGINT arrives,
+while the listener is still open, and uvicorn's own shutdown follows once
+it is over: uvicorn waits for open requests before running the lifespan
+shutdown, so a drain started there would never see them. A request that
+ends with its reservation still attached is refunded with a conditional
+UPDATE on the still-``processing`` generation, so a refund can never be
+applied twice or to a generation that completed.
+"""
+import asyncio
+import logging
+import signal
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import delete, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.core.database import get_sessionmaker
+from app.core.metrics import record_generation_cancelled
+from app.models import FreeTrialUsage, GenerationToken, IdempotencyKey, ImageGeneration
+from app.services.idempotency import pending_keys
+from app.services.token_cache import token_cache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Reservation:
+    generation_id: str
+    token_id: Optional[str] = None
+    token: Optional[str] = None
+    free_trial_id: Optional[str] = None
+    device_id: Optional[str] = None  # Scope of idempotency_key
+    idempotency_key: Optional[str] = None
+
+
+async def refund_reservation(
+    sessionmaker: async_sessionmaker, reservation: Reservation, reason: str
+) -> bool:
+    """Cancel an unsettled generation and give its quota back. Returns True if refunded."""
+    async with sessionmaker() as db:
+        result = await db.execute(
+            update(ImageGeneration)
+            .where(
+                ImageGeneration.id == reservation.generation_id,
+                ImageGeneration.status == "processing",
+            )
+            .values(status="cancelled", error_message=reason)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            await db.rollback()
+            return False
+        if reservation.token_id:
+            await db.execute(
+                update(GenerationToken)
+                .where(GenerationToken.id == reservation.token_id)
+                .values(remaining_generations=GenerationToken.remaining_generations + 1)
+                .execution_options(synchronize_session=False)
+            )
+        elif reservation.free_trial_id:
+            await db.execute(
+                update(FreeTrialUsage)
+                .where(FreeTrialUsage.id == reservation.free_trial_id)
+                .values(used_count=FreeTrialUsage.used_count - 1)
+                .execution_options(synchronize_session=False)
+            )
+        if reservation.idempotency_key:
+            # Released, so a retry starts afresh.
+            await db.execute(
+                delete(IdempotencyKey)
+                .where(
+                    IdempotencyKey.device_id == reservation.device_id,
+                    IdempotencyKey.key == reservation.idempotency_key,
+                )
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+    if reservation.token:
+        token_cache.invalidate(reservation.token)
+    return True
+
+
+class GenerationDrain:
+    """Tracks in-flight generation requests (by task) and drains them."""
+
+    def __init__(self):
+        self.state = "ready"  # ready -> draining -> drained
+        self.active: dict[asyncio.Task, Optional[Reservation]] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._exit_drain: Optional[asyncio.Task] = None
+
+    @property
+    def accepting(self) -> bool:
+        return self.state == "ready"
+
+    def enter(self):
+        self.active[asyncio.current_task()] = None
+        self._idle.clear()
+
+    def exit(self) -> Optional[Reservation]:
+        """Stop tracking the current task; returns its unsettled reservation."""
+        reservation = self.active.pop(asyncio.current_task(), None)
+        if not self.active:
+            self._idle.set()
+        return reservation
+
+    def reserve(self, reservation: Reservation):
+        """Quota for the current request is committed and not yet settled."""
+        task = asyncio.current_task()
+        if task in self.active:
+            self.active[task] = reservation
+
+    def settled(self):
+        task = asyncio.current_task()
+        if task in self.active:
+            self.active[task] = None
+
+    def begin(self):
+        if self.state == "ready":
+            self.state = "draining"
+            logger.info(f"Draining {len(self.active)} in-flight generations")
+
+    async def drain(self, timeout: float):
+        """Stop accepting, wait up to ``timeout`` s, then cancel what is left."""
+        self.begin()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            tasks = list(self.active)
+            logger.warning(f"Cancelling {len(tasks)} generations still running after {timeout:g}s")
+            for task in tasks:
+                task.cancel()
+            # Cancelled requests refund themselves on the way out.
+            if tasks:
+                await asyncio.wait(tasks, timeout=5.0)
+        self.state = "drained"
+
+    def drain_on_signal(self, timeout: float, signals=(signal.SIGINT, signal.SIGTERM)):
+        """Drain when a shutdown signal arrives, then pass it to the server's handler.
+
+        Call from the running loop (lifespan startup). Wraps the handlers the
+        server installed; a second signal goes straight through, so it still
+        forces a quick exit. No-op off the main thread, where signals cannot
+        be handled.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in signals:
+            previous = signal.getsignal(sig)
+            if callable(previous):
+                signal.signal(sig, self._signal_handler(loop, timeout, previous))
+
+    def _signal_handler(self, loop: asyncio.AbstractEventLoop, timeout: float, previous: Callable):
+        def handle(signum, frame):
+            if self.state != "ready" or self._exit_drain is not None:
+                previous(signum, frame)
+                return
+            self.begin()
+            loop.call_soon_threadsafe(
+                self._start_exit_drain, timeout, lambda: previous(signum, frame)
+            )
+
+        return handle
+
+    def _start_exit_drain(self, timeout: float, then: Callable[[], None]):
+        async def drain_then_exit():
+            try:
+                await self.drain(timeout)
+            finally:
+                then()
+
+        self._exit_drain = asyncio.create_task(drain_then_exit(), name="generation-drain")
+
+    def reset(self):
+        self.state = "ready"
+        self._exit_drain = None
+        self.active.clear()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+
+generation_drain = GenerationDrain()
+
+
+async def track_generation(sessionmaker: async_sessionmaker = Depends(get_sessionmaker)):
+    """Reject new generations while draining; refund ones that end unsettled.
+
+    Resolved before any DB session is opened. The endpoint runs in the same
+    task, which is how ``reserve``/``settled`` find this request.
+    """
+    if not generation_drain.accepting:
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "Server is restarting. Please try again.", "code": "draining"},
+            headers={"Retry-After": "1"},
+        )
+    generation_drain.enter()
+    try:
+        yield
+    finally:
+        reservation = generation_drain.exit()
+        if reservation is not None:
+            try:
+                if await refund_reservation(sessionmaker, reservation, "Generation interrupted"):
+                    record_generation_cancelled("interrupted")
+            except Exception:
+                logger.exception(f"Refund of generation {reservation.generation_id} failed")
+            if reservation.idempotency_key:
+                pending_keys.done(reservation.device_id, reservation.idempotency_key)
@@ -0,0 +1,257 @@
+"""Idempotency-Key handling for /generate.
+
+A request carrying ``Idempotency-Key`` claims the key in the same commit
+that reserves its quota (a primary-key conflict means another request got
+there first). Keys are per device: the primary key is ``(device_id, key)``,
+so devices choosing the same key never see each other's requests. Retries
+with the same key and request spend no quota and make no upstream call:
+while the generation runs they wait for it, woken at once when it runs in
+this worker and re-checking every ``IDEMPOTENCY_POLL_SECONDS`` otherwise.
+Once it has succeeded they get the stored response. A generation that fails
+or is cancelled is refunded and releases its key, so the next retry starts
+afresh. Keys live for ``IDEMPOTENCY_TTL_SECONDS`` and are deleted in small
+batches afterwards.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, delete, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.cancellation import remaining
+from app.core.config import settings
+from app.core.database import async_session
+from app.models import IdempotencyKey
+from app.schemas.generation import GenerateImageRequest, GenerateImageResponse
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+KEY_STATE = select(
+    IdempotencyKey.request_hash, IdempotencyKey.response, IdempotencyKey.expires_at
+).where(
+    IdempotencyKey.device_id == bindparam("lookup_device"),
+    IdempotencyKey.key == bindparam("lookup_key"),
+)
+
+
+def request_hash(request: GenerateImageRequest) -> str:
+    return hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+
+
+def validate_key(key: str):
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters",
+        )
+
+
+def new_key(key: str, request: GenerateImageRequest, generation_id: str) -> IdempotencyKey:
+    now = datetime.utcnow()
+    return IdempotencyKey(
+        device_id=request.device_id,
+        key=key,
+        request_hash=request_hash(request),
+        generation_id=generation_id,
+        created_at=now,
+        expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+    )
+
+
+def key_in_progress() -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail={
+            "error": "A request with this Idempotency-Key is still in progress",
+            "code": "idempotency_in_progress",
+        },
+        headers={"Retry-After": "5"},
+    )
+
+
+def _key_is(device_id: str, key: str):
+    return (IdempotencyKey.device_id == device_id) & (IdempotencyKey.key == key)
+
+
+async def settle_key(
+    db: AsyncSession, device_id: str, key: str, response: Optional[GenerateImageResponse]
+):
+    """Store the response for replays, or release the key (None) after a refund.
+
+    Part of the caller's settle transaction.
+    """
+    if response is None:
+        stmt = delete(IdempotencyKey).where(_key_is(device_id, key))
+    else:
+        stmt = (
+            update(IdempotencyKey)
+            .where(_key_is(device_id, key))
+            .values(response=response.model_dump_json())
+        )
+    await db.execute(stmt.execution_options(synchronize_session=False))
+
+
+class PendingKeys:
+    """Keys whose generation runs in this worker, so local retries wake immediately."""
+
+    def __init__(self):
+        self._events: dict[tuple[str, str], asyncio.Event] = {}
+
+    def start(self, device_id: str, key: str):
+        self._events[device_id, key] = asyncio.Event()
+
+    def done(self, device_id: str, key: str):
+        event = self._events.pop((device_id, key), None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, device_id: str, key: str, timeout: float):
+        """Until ``key`` finishes here, or ``timeout`` s if it runs elsewhere."""
+        event = self._events.get((device_id, key))
+        if event is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def clear(self):
+        for event in self._events.values():
+            event.set()
+        self._events.clear()
+
+
+pending_keys = PendingKeys()
+
+
+async def stored_response(
+    db: AsyncSession, key: str, request: GenerateImageRequest, deadline: float
+) -> Optional[str]:
+    """The response stored for the device's ``key``, waiting while its generation runs.
+
+    None if the key is free to claim. Each check ends its transaction, so
+    the next one sees the other request's commits.
+    """
+    device_id = request.device_id
+    fingerprint = request_hash(request)
+    while True:
+        row = (await db.execute(
+            KEY_STATE, {"lookup_device": device_id, "lookup_key": key}
+        )).first()
+        if row is not None and row.expires_at <= datetime.utcnow():
+            await db.execute(
+                delete(IdempotencyKey)
+                .where(_key_is(device_id, key), IdempotencyKey.expires_at <= datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            row = None
+        await db.commit()
+        if row is None:
+            return None
+        if row.request_hash != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    "error": "Idempotency-Key was already used for a different request",
+                    "code": "idempotency_key_reused",
+                },
+            )
+        if row.response is not None:
+            return row.response
+        wait = remaining(deadline, settings.IDEMPOTENCY_POLL_SECONDS)
+        if wait <= 0:
+            raise key_in_progress()
+        await pending_keys.wait(device_id, key, wait)
+
+
+async def delete_expired_batch(db: AsyncSession, now: datetime) -> int:
+    """Delete up to one batch of expired keys, oldest first. Returns rows deleted."""
+    result = await db.execute(
+        select(IdempotencyKey.device_id, IdempotencyKey.key)
+        .where(IdempotencyKey.expires_at <= now)
+        .order_by(IdempotencyKey.expires_at)
+        .limit(settings.IDEMPOTENCY_CLEANUP_BATCH_SIZE)
+    )
+    keys = [tuple(row) for row in result.all()]
+    if keys:
+        await db.execute(
+            delete(IdempotencyKey)
+            .where(
+                tuple_(IdempotencyKey.device_id, IdempotencyKey.key).in_(keys),
+                IdempotencyKey.expires_at <= now,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    return len(keys)
+
+
+async def cleanup_expired(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """Delete every expired key, pausing between batches for writers."""
+    now = now or datetime.utcnow()
+    deleted = 0
+    while True:
+        count = await delete_expired_batch(db, now)
+        deleted += count
+        if count < settings.IDEMPOTENCY_CLEANUP_BATCH_SIZE:
+            break
+        await asyncio.sleep(settings.IDEMPOTENCY_CLEANUP_PAUSE_MS / 1000)
+    if deleted:
+        logger.info(f"Deleted {deleted} expired idempotency keys")
+    return deleted
+
+
+class IdempotencyCleanupWorker:
+    """Background task deleting expired keys every ``IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS``."""
+
+    def __init__(self, sessionmaker: async_sessionmaker = async_session):
+        self.sessionmaker = sessionmaker
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="idempotency-cleanup")
+
+    async def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
+
+    async def run_once(self) -> int:
+        async with self.sessionmaker() as db:
+            return await cleanup_expired(db)
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Idempotency key cleanup error")
+            try:
+                await asyncio.wait_for(
+                    self._stop.wait(), settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+idempotency_cleanup_worker = IdempotencyCleanupWorker()
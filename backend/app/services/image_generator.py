@@ -1,10 +1,13 @@
-"""Image generation service using LLM Proxy."""
+"""Image generation service using LLM Proxy upstreams."""
 import httpx
 import logging
+import time
 from typing import Optional
 
+from app.core.cancellation import remaining
 from app.core.config import settings
 from app.schemas.generation import StylePreset
+from app.services.upstreams import Upstream, upstream_pool
 
 logger = logging.getLogger(__name__)
 
@@ -21,72 +24,119 @@ STYLE_PROMPTS = {
 }
 
 
-async def generate_image(prompt: str, style: Optional[StylePreset] = None) -> dict:
+async def _post(upstream: Upstream, prompt: str, timeout: float) -> tuple[dict, bool]:
+    """One upstream attempt. Returns the result and whether the upstream was healthy.
+
+    Timeouts, transport errors, 429 and 5xx count against the upstream and
+    may be retried elsewhere; other errors are the request's own.
+    """
+    try:
+        response = await upstream.get_client().post(
+            f"{upstream.url}/v1/images/generations",
+            headers={
+                "Authorization": f"Bearer {upstream.key}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "model": upstream.model,
+                "prompt": prompt,
+                "n": 1,
+                "size": "1024x1024",
+                "quality": "standard",
+            },
+            timeout=timeout,
+        )
+        
+        if response.status_code != 200:
+            error_text = response.text
+            logger.error(
+                f"LLM Proxy error from {upstream.name}: {response.status_code} - {error_text}"
+            )
+            healthy = response.status_code < 500 and response.status_code != 429
+            return {
+                "success": False,
+                "error": f"Image generation failed: {error_text}"
+            }, healthy
+        
+        data = response.json()
+        
+        # Extract image URL from response
+        if "data" in data and len(data["data"]) > 0:
+            image_url = data["data"][0].get("url") or data["data"][0].get("b64_json")
+            if image_url:
+                return {
+                    "success": True,
+                    "image_url": image_url,
+                    "model": upstream.model,
+                    "upstream": upstream.name,
+                }, True
+        
+        return {
+            "success": False,
+            "error": "No image URL in response"
+        }, True
+        
+    except httpx.TimeoutException:
+        logger.error(f"Image generation timed out on {upstream.name}")
+        return {
+            "success": False,
+            "error": "Image generation timed out. Please try again."
+        }, False
+    except httpx.TransportError as e:
+        logger.error(f"Image upstream {upstream.name} unreachable: {e}")
+        return {"success": False, "error": str(e)}, False
+
+
+async def generate_image(
+    prompt: str, style: Optional[StylePreset] = None, deadline: Optional[float] = None
+) -> dict:
     """
-    Generate an image using LLM Proxy's image generation endpoint.
+    Generate an image on the best available upstream of the pool.
     
     Args:
         prompt: The text description for the image
         style: Optional style preset to apply
+        deadline: Optional time.monotonic() by which to give up; each attempt's
+            timeout is capped by the time left
         
     Returns:
-        dict with 'success', 'image_url' or 'error'
+        dict with 'success', 'image_url', 'model' and 'upstream', or 'error'
     """
     # Enhance prompt with style
     enhanced_prompt = prompt
     if style and style in STYLE_PROMPTS:
         enhanced_prompt = f"{prompt}, {STYLE_PROMPTS[style]}"
     
-    try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{settings.LLM_PROXY_URL}/v1/images/generations",
-                headers={
-                    "Authorization": f"Bearer {settings.LLM_PROXY_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "dall-e-3",
-                    "prompt": enhanced_prompt,
-                    "n": 1,
-                    "size": "1024x1024",
-                    "quality": "standard",
-                }
-            )
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"LLM Proxy error: {response.status_code} - {error_text}")
-                return {
-                    "success": False,
-                    "error": f"Image generation failed: {error_text}"
-                }
-            
-            data = response.json()
-            
-            # Extract image URL from response
-            if "data" in data and len(data["data"]) > 0:
-                image_url = data["data"][0].get("url") or data["data"][0].get("b64_json")
-                if image_url:
-                    return {
-                        "success": True,
-                        "image_url": image_url
-                    }
-            
+    result = {
+        "success": False,
+        "error": "All image generation servers are busy. Please try again."
+    }
+    tried: set[str] = set()
+    for _ in range(max(1, settings.UPSTREAM_MAX_ATTEMPTS)):
+        timeout = remaining(deadline, settings.UPSTREAM_TIMEOUT_SECONDS)
+        if timeout <= 0:
             return {
                 "success": False,
-                "error": "No image URL in response"
+                "error": "Image generation timed out. Please try again."
             }
-            
-    except httpx.TimeoutException:
-        logger.error("Image generation timed out")
-        return {
-            "success": False,
-            "error": "Image generation timed out. Please try again."
-        }
-    except Exception as e:
-        logger.exception("Image generation error")
-        return {
-            "success": False,
-            "error": str(e)
-        }
+        upstream = upstream_pool.acquire(tried)
+        if upstream is None:
+            break
+        tried.add(upstream.name)
+        started = time.monotonic()
+        try:
+            result, healthy = await _post(upstream, enhanced_prompt, timeout)
+        except Exception as e:
+            upstream_pool.release(upstream, time.monotonic() - started, ok=False)
+            logger.exception("Image generation error")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        except BaseException:
+            upstream_pool.abandon(upstream)  # Cancelled; not the upstream's fault
+            raise
+        upstream_pool.release(upstream, time.monotonic() - started, ok=healthy)
+        if result["success"] or healthy:
+            break
+    return result
@@ -0,0 +1,112 @@
+"""Negative cache of device ids and tokens that exist in the database.
+
+Random ids from crawlers and abusive clients are answered as definite misses
+by a Bloom filter instead of a DB query. The filters are built at startup by
+a streaming scan and updated by every insert in this process. Until loading
+finishes every id "may exist", so lookups fall through to the DB.
+
+Inserts made by other processes are never seen, so the filters are only
+used with a single worker (``WEB_CONCURRENCY`` of 1) and only for read-only
+lookups: spending quota must never trust a "missing" answer.
+"""
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.core.bloom import BloomFilter
+from app.core.config import settings
+from app.core.metrics import record_known_ids_filter, record_known_ids_miss
+from app.models import FreeTrialUsage, GenerationToken
+
+logger = logging.getLogger(__name__)
+
+SCAN_BATCH_SIZE = 10000
+
+
+class KnownIds:
+    """Bloom filters over device ids and token strings."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        self.devices = BloomFilter(self.capacity, self.error_rate)
+        self.tokens = BloomFilter(self.capacity, self.error_rate)
+
+    def add_device(self, device_id: Optional[str]):
+        if device_id:
+            self.devices.add(device_id)
+
+    def add_token(self, token: str, device_id: Optional[str] = None):
+        self.tokens.add(token)
+        self.add_device(device_id)
+
+    def device_missing(self, device_id: str) -> bool:
+        """True only if ``device_id`` is definitely not in the database."""
+        if not self.ready or device_id in self.devices:
+            return False
+        record_known_ids_miss("device")
+        return True
+
+    def token_missing(self, token: str) -> bool:
+        """True only if ``token`` is definitely not in the database."""
+        if not self.ready or token in self.tokens:
+            return False
+        record_known_ids_miss("token")
+        return True
+
+    async def load(self, sessionmaker: async_sessionmaker):
+        """Rebuild both filters from a streaming scan of the id columns.
+
+        Inserts made while the scan runs are added to the new filters too.
+        """
+        if settings.WEB_CONCURRENCY > 1:
+            logger.warning(
+                f"Known-id filters disabled: WEB_CONCURRENCY={settings.WEB_CONCURRENCY}, "
+                "and they cannot see other workers' inserts"
+            )
+            self.disable()
+            return
+        started = time.perf_counter()
+        self.ready = False
+        self._reset()
+        async with sessionmaker() as db:
+            result = await db.stream(
+                select(FreeTrialUsage.device_id).execution_options(yield_per=SCAN_BATCH_SIZE)
+            )
+            async for device_ids in result.scalars().partitions():
+                for device_id in device_ids:
+                    self.add_device(device_id)
+            result = await db.stream(
+                select(GenerationToken.token, GenerationToken.device_id).execution_options(
+                    yield_per=SCAN_BATCH_SIZE
+                )
+            )
+            async for rows in result.partitions():
+                for token, device_id in rows:
+                    self.add_token(token, device_id)
+        self.ready = True
+        self.report()
+        logger.info(
+            f"Known-id filters loaded in {time.perf_counter() - started:.2f}s: "
+            f"{self.devices.count} devices, {self.tokens.count} tokens, "
+            f"{self.devices.size_bytes + self.tokens.size_bytes} bytes"
+        )
+
+    def report(self):
+        """Export fill level and estimated false-positive rate."""
+        for kind, bloom in (("device", self.devices), ("token", self.tokens)):
+            record_known_ids_filter(kind, bloom.count, bloom.estimated_error_rate())
+
+    def disable(self):
+        self.ready = False
+        self._reset()
+
+
+known_ids = KnownIds(settings.BLOOM_FILTER_CAPACITY, settings.BLOOM_FILTER_ERROR_RATE)
@@ -0,0 +1,213 @@
+"""Retention of image generations.
+
+Rows older than ``RETENTION_DAYS`` are copied to the archive database
+(large text columns zlib-compressed), then deleted from the hot table in
+small batches with a pause between them, so writers never wait long for the
+SQLite lock. Afterwards ``PRAGMA incremental_vacuum`` hands the freed pages
+back to the filesystem. Archiving is idempotent: a crash between the archive
+commit and the delete only means the next pass deletes those rows.
+"""
+import asyncio
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database import async_session, get_archive_sessionmaker, insert_or_ignore
+from app.core.metrics import record_generations_archived
+from app.models import ImageGeneration, RollupWatermark
+from app.models.archive import ArchiveBase, ArchivedGeneration
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_TEXT_COLUMNS = ("prompt", "image_url", "error_message")
+
+
+def pack_payload(row) -> bytes:
+    return zlib.compress(
+        json.dumps({name: getattr(row, name) for name in ARCHIVED_TEXT_COLUMNS}).encode()
+    )
+
+
+def unpack_payload(payload: bytes) -> dict:
+    return json.loads(zlib.decompress(payload))
+
+
+async def init_archive(archive: async_sessionmaker):
+    """Create the archive tables if needed."""
+    async with archive() as db:
+        conn = await db.connection()
+        await conn.run_sync(ArchiveBase.metadata.create_all)
+        await db.commit()
+
+
+async def retention_cutoff(db: AsyncSession, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Rows created before this are archived.
+
+    Never past the rollup watermark, so rows are counted before they leave.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.RETENTION_DAYS)
+    if settings.ROLLUP_ENABLED:
+        watermark = await db.get(RollupWatermark, "image_generations")
+        if watermark is None:
+            return None
+        cutoff = min(cutoff, watermark.last_created_at)
+    return cutoff
+
+
+async def archive_batch(
+    db: AsyncSession, archive: async_sessionmaker, cutoff: datetime
+) -> int:
+    """Move the oldest batch of rows created before ``cutoff``. Returns rows moved."""
+    result = await db.execute(
+        select(*ImageGeneration.__table__.columns)
+        .where(ImageGeneration.created_at < cutoff)
+        .order_by(ImageGeneration.created_at, ImageGeneration.id)
+        .limit(settings.RETENTION_BATCH_SIZE)
+    )
+    rows = result.all()
+    await db.commit()  # End the read transaction before the slow archive write.
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+    async with archive() as archive_db:
+        await archive_db.execute(
+            insert_or_ignore(ArchivedGeneration, archive_db.get_bind().dialect.name),
+            [
+                {
+                    "id": row.id,
+                    "device_id": row.device_id,
+                    "token_id": row.token_id,
+                    "model": row.model,
+                    "style": row.style,
+                    "status": row.status,
+                    "created_at": row.created_at,
+                    "archived_at": now,
+                    "payload": pack_payload(row),
+                }
+                for row in rows
+            ],
+        )
+        await archive_db.commit()
+
+    await db.execute(
+        delete(ImageGeneration)
+        .where(ImageGeneration.id.in_([row.id for row in rows]))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    record_generations_archived(len(rows))
+    return len(rows)
+
+
+async def incremental_vacuum(db: AsyncSession) -> bool:
+    """Release free pages if the DB uses auto_vacuum=INCREMENTAL (SQLite only)."""
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    conn = await db.connection()
+    mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+    if mode != 2:
+        logger.info("auto_vacuum is not INCREMENTAL; run VACUUM once to reclaim space")
+        await db.commit()
+        return False
+    await db.commit()
+    # The pragma frees one page per statement step; executescript steps it to
+    # completion where a plain execute would stop after the first page.
+    raw = await (await db.connection()).get_raw_connection()
+    await raw.driver_connection.executescript(
+        f"PRAGMA incremental_vacuum({int(settings.RETENTION_VACUUM_PAGES)});"
+    )
+    return True
+
+
+async def run_retention(
+    db: AsyncSession, archive: async_sessionmaker, now: Optional[datetime] = None
+) -> int:
+    """Archive everything past retention, then vacuum. Returns rows moved."""
+    cutoff = await retention_cutoff(db, now)
+    if cutoff is None:
+        return 0
+    await init_archive(archive)
+    moved = 0
+    while True:
+        count = await archive_batch(db, archive, cutoff)
+        moved += count
+        if count < settings.RETENTION_BATCH_SIZE:
+            break
+        await asyncio.sleep(settings.RETENTION_BATCH_PAUSE_MS / 1000)
+    if moved:
+        await incremental_vacuum(db)
+        logger.info(f"Archived {moved} generations created before {cutoff.isoformat()}")
+    return moved
+
+
+async def get_archived_generation(archive: async_sessionmaker, generation_id: str) -> Optional[dict]:
+    """Read-only lookup of an archived generation; None if absent."""
+    try:
+        async with archive() as archive_db:
+            row = await archive_db.get(ArchivedGeneration, generation_id)
+    except OperationalError:
+        return None  # No archive yet.
+    if row is None:
+        return None
+    return {
+        "id": row.id,
+        "created_at": row.created_at,
+        "status": row.status,
+        "style": row.style,
+        **unpack_payload(row.payload),
+    }
+
+
+class RetentionWorker:
+    """Background task applying retention every ``RETENTION_INTERVAL_SECONDS``."""
+
+    def __init__(self, sessionmaker: async_sessionmaker = async_session):
+        self.sessionmaker = sessionmaker
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="generation-retention")
+
+    async def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
+
+    async def run_once(self) -> int:
+        async with self.sessionmaker() as db:
+            return await run_retention(db, get_archive_sessionmaker())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Retention error")
+            try:
+                await asyncio.wait_for(self._stop.wait(), settings.RETENTION_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+retention_worker = RetentionWorker()
@@ -0,0 +1,190 @@
+"""Incremental usage rollups.
+
+``RollupWorker`` folds new rows of ``image_generations`` and
+``payment_transactions`` into hourly ``usage_rollups`` counters. A
+(created_at, id) watermark per source table means each pass reads only rows
+added since the last one, via the (created_at, id) indexes. Rows younger
+than ``ROLLUP_SETTLE_SECONDS`` are left for a later pass because a
+generation's status is only final once the upstream call has finished.
+Analytics reads then only touch the rollup table.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.database import async_session, insert_or_ignore, insert_or_increment
+from app.models import ImageGeneration, PaymentTransaction, RollupWatermark, UsageRollup
+
+logger = logging.getLogger(__name__)
+
+
+def _generation_key(row) -> dict:
+    return {"metric": "generation", "style": row.style or "", "status": row.status or ""}
+
+
+def _payment_key(row) -> dict:
+    return {
+        "metric": "payment",
+        "status": row.status or "",
+        "product_sku": row.product_sku or "",
+        "currency": (row.currency or "").upper(),
+    }
+
+
+# source table -> (model, extra columns read, rollup key, summed amount column)
+SOURCES = {
+    "image_generations": (
+        ImageGeneration,
+        (ImageGeneration.style, ImageGeneration.status),
+        _generation_key,
+        None,
+    ),
+    "payment_transactions": (
+        PaymentTransaction,
+        (
+            PaymentTransaction.status,
+            PaymentTransaction.product_sku,
+            PaymentTransaction.currency,
+            PaymentTransaction.amount_cents,
+        ),
+        _payment_key,
+        "amount_cents",
+    ),
+}
+
+_KEY_DEFAULTS = {"style": "", "status": "", "product_sku": "", "currency": ""}
+
+
+def hour_bucket(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+async def roll_up_batch(db: AsyncSession, source: str, cutoff: datetime) -> int:
+    """Fold the next batch of settled rows of ``source``. Returns rows consumed.
+
+    Counters and the watermark change in one transaction. The watermark
+    update is conditional on the value read, so a concurrent roller makes
+    this batch roll back instead of counting rows twice.
+    """
+    model, columns, key, amount_column = SOURCES[source]
+    watermark = await db.get(RollupWatermark, source)
+
+    query = select(model.created_at, model.id, *columns).where(model.created_at < cutoff)
+    if watermark is not None:
+        query = query.where(
+            tuple_(model.created_at, model.id)
+            > tuple_(watermark.last_created_at, watermark.last_id)
+        )
+    query = query.order_by(model.created_at, model.id).limit(settings.ROLLUP_BATCH_SIZE)
+    rows = (await db.execute(query)).all()
+    if not rows:
+        return 0
+
+    counters: dict[tuple, list[int]] = {}
+    for row in rows:
+        bucket = {**_KEY_DEFAULTS, **key(row), "hour": hour_bucket(row.created_at)}
+        totals = counters.setdefault(tuple(sorted(bucket.items())), [0, 0])
+        totals[0] += 1
+        if amount_column:
+            totals[1] += getattr(row, amount_column) or 0
+
+    dialect = db.get_bind().dialect.name
+    await db.execute(insert_or_increment(
+        UsageRollup,
+        dialect,
+        [{**dict(k), "count": c, "amount_cents": a} for k, (c, a) in counters.items()],
+        ["count", "amount_cents"],
+    ))
+
+    last = rows[-1]
+    if watermark is None:
+        result = await db.execute(insert_or_ignore(RollupWatermark, dialect).values(
+            source=source, last_created_at=last.created_at, last_id=last.id,
+            updated_at=datetime.utcnow(),
+        ))
+    else:
+        result = await db.execute(
+            update(RollupWatermark)
+            .where(
+                RollupWatermark.source == source,
+                RollupWatermark.last_created_at == watermark.last_created_at,
+                RollupWatermark.last_id == watermark.last_id,
+            )
+            .values(last_created_at=last.created_at, last_id=last.id, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+    if result.rowcount != 1:
+        await db.rollback()
+        logger.warning(f"Rollup watermark for {source} moved concurrently; batch skipped")
+        return 0
+    await db.commit()
+    return len(rows)
+
+
+async def run_rollups(db: AsyncSession, now: Optional[datetime] = None) -> dict[str, int]:
+    """Bring every source up to the settle cutoff. Returns rows consumed per source."""
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=settings.ROLLUP_SETTLE_SECONDS)
+    consumed = {}
+    for source in SOURCES:
+        total = 0
+        while True:
+            count = await roll_up_batch(db, source, cutoff)
+            total += count
+            if count < settings.ROLLUP_BATCH_SIZE:
+                break
+        consumed[source] = total
+    return consumed
+
+
+class RollupWorker:
+    """Background task refreshing the rollups every ``ROLLUP_INTERVAL_SECONDS``."""
+
+    def __init__(self, sessionmaker: async_sessionmaker = async_session):
+        self.sessionmaker = sessionmaker
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="usage-rollups")
+
+    async def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
+
+    async def run_once(self) -> dict[str, int]:
+        async with self.sessionmaker() as db:
+            return await run_rollups(db)
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                consumed = await self.run_once()
+                if any(consumed.values()):
+                    logger.info(f"Usage rollups advanced: {consumed}")
+            except Exception:
+                logger.exception("Usage rollup error")
+            try:
+                await asyncio.wait_for(self._stop.wait(), settings.ROLLUP_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+rollup_worker = RollupWorker()
@@ -0,0 +1,167 @@
+"""Priority scheduling of upstream generation slots.
+
+Requests wait for one of a fixed number of slots. When slots are contended,
+classes (paid, free) are served in proportion to their shares by stride
+scheduling, and within a class devices are served round-robin, so one
+device queueing many requests cannot starve the others. A request that
+waits longer than its class's max wait gives up with ``QueueTimeout``. When
+a slot is free and nobody is queued, acquiring it costs no scheduling work.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from app.core.admission import generate_admission
+from app.core.cancellation import remaining
+from app.core.config import settings
+from app.core.metrics import record_queue_depth, record_queue_timeout, record_queue_wait
+from app.services.upstreams import upstream_pool
+
+
+class QueueTimeout(Exception):
+    """A request waited longer than its class's max wait."""
+
+
+class PriorityClass:
+    def __init__(self, name: str, share: float, max_wait: float):
+        self.name = name
+        self.share = share
+        self.max_wait = max_wait
+        self.queues: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self.depth = 0
+        self.pass_value = 0.0  # Stride scheduling: advances by 1/share per grant
+
+    def pop(self) -> asyncio.Future:
+        """Next waiter, taking devices in round-robin order."""
+        device_id, queue = next(iter(self.queues.items()))
+        waiter = queue.popleft()
+        if queue:
+            self.queues.move_to_end(device_id)
+        else:
+            del self.queues[device_id]
+        self.depth -= 1
+        return waiter
+
+    def remove(self, device_id: str, waiter: asyncio.Future):
+        queue = self.queues.get(device_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self.queues[device_id]
+        self.depth -= 1
+
+
+class GenerationScheduler:
+    """Grants at most ``slots`` concurrent generations across priority classes."""
+
+    def __init__(self, slots: int, classes: list[PriorityClass]):
+        self.slots = slots
+        self.classes = {c.name: c for c in classes}
+        self.in_use = 0
+        self._vtime = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(c.depth for c in self.classes.values())
+
+    @asynccontextmanager
+    async def slot(
+        self, class_name: str, device_id: str, deadline: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        await self.acquire(class_name, device_id, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, class_name: str, device_id: str, deadline: Optional[float] = None):
+        """Wait for a slot, at most the class's max wait or until ``deadline``."""
+        cls = self.classes[class_name]
+        if self.in_use < self.slots and not self.waiting:
+            self.in_use += 1
+            record_queue_wait(cls.name, 0.0)
+            generate_admission.queue_drained()
+            return
+
+        if not cls.depth:
+            # A class returning from idle does not bank credit for the idle time.
+            cls.pass_value = max(cls.pass_value, self._vtime)
+        waiter = asyncio.get_running_loop().create_future()
+        cls.queues.setdefault(device_id, deque()).append(waiter)
+        cls.depth += 1
+        record_queue_depth(cls.name, cls.depth)
+        started = time.monotonic()
+        max_wait = remaining(deadline, cls.max_wait)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # Granted while we were giving up; hand it on.
+            else:
+                waiter.cancel()
+                cls.remove(device_id, waiter)
+            record_queue_depth(cls.name, cls.depth)
+            if isinstance(exc, asyncio.TimeoutError):
+                record_queue_timeout(cls.name)
+                self._report_sojourn(cls.name, time.monotonic() - started)
+                raise QueueTimeout(f"Waited over {max_wait:g}s for a {cls.name} slot")
+            if not self.waiting:
+                # The last waiter left without a grant; nothing else would end shedding.
+                generate_admission.queue_drained()
+            raise
+        sojourn = time.monotonic() - started
+        record_queue_wait(cls.name, sojourn)
+        self._report_sojourn(cls.name, sojourn)
+
+    def _report_sojourn(self, class_name: str, sojourn: float):
+        """Feed ingress admission control (see ``app.core.admission``)."""
+        if self.waiting:
+            generate_admission.observe(class_name, sojourn)
+        else:
+            generate_admission.queue_drained()
+
+    def release(self):
+        self.in_use -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.in_use < self.slots:
+            active = [c for c in self.classes.values() if c.depth]
+            if not active:
+                return
+            cls = min(active, key=lambda c: c.pass_value)
+            waiter = cls.pop()
+            record_queue_depth(cls.name, cls.depth)
+            if waiter.done():
+                continue  # Timed out or cancelled, not yet removed.
+            self._vtime = cls.pass_value
+            cls.pass_value += 1.0 / cls.share
+            self.in_use += 1
+            waiter.set_result(None)
+
+
+def scheduler_slots() -> int:
+    """``SCHEDULER_SLOTS``, or the pool's total concurrency when 0."""
+    return settings.SCHEDULER_SLOTS or sum(u.max_concurrency for u in upstream_pool.upstreams)
+
+
+generation_scheduler = GenerationScheduler(0, [])
+
+
+def configure_scheduler():
+    """(Re)build the scheduler from settings."""
+    generation_scheduler.slots = scheduler_slots()
+    generation_scheduler.classes = {
+        name: PriorityClass(
+            name,
+            getattr(settings, f"SCHEDULER_{name.upper()}_SHARE"),
+            getattr(settings, f"SCHEDULER_{name.upper()}_MAX_WAIT_SECONDS"),
+        )
+        for name in ("paid", "free")
+    }
+
+
+configure_scheduler()
@@ -0,0 +1,208 @@
+"""Near-duplicate prompt index.
+
+Prompts are normalized (case, punctuation, whitespace, filler words) into a
+word set, so word order does not matter. Each set gets a MinHash signature,
+and LSH banding over the signatures finds candidates in constant time.
+Candidates are then confirmed with the exact Jaccard similarity of the word
+sets. The index holds recent successful generations per style, by id only:
+the image URL can be a large base64 data URL, so it is read from the
+database on a hit. Image URLs from the upstream expire, so entries are only
+served for ``PROMPT_REUSE_MAX_AGE_SECONDS``.
+"""
+import hashlib
+import logging
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.models import ImageGeneration
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset(
+    "a an the of on in at to with and or for by from into onto over under "
+    "is are be this that some very please".split()
+)
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_ROWS_PER_BAND = 4
+
+REUSABLE_IMAGE_URL = select(ImageGeneration.image_url).where(
+    ImageGeneration.id == bindparam("generation_id"),
+    ImageGeneration.status == "completed",
+)
+
+
+def normalize_prompt(prompt: str) -> frozenset[str]:
+    """Order-insensitive word set of a prompt."""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    words = _NON_WORD.sub(" ", text).split()
+    return frozenset(w for w in words if w not in STOPWORDS) or frozenset(words)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """MinHash signatures from universal hashes ``(a*x + b) mod p``."""
+
+    def __init__(self, num_perm: int, seed: int = 1):
+        rng = random.Random(seed)
+        self.params = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, words: frozenset[str]) -> tuple[int, ...]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "little")
+            for w in words
+        ] or [0]
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self.params
+        )
+
+
+@dataclass
+class PromptEntry:
+    generation_id: str
+    device_id: str
+    style: str
+    words: frozenset
+    created: float  # time.time() of the generation
+    bands: tuple
+
+
+@dataclass
+class SimilarMatch:
+    generation_id: str
+    device_id: str
+    similarity: float
+
+
+class PromptIndex:
+    """LSH index of recent prompts, keyed by style, bounded in size."""
+
+    def __init__(self, max_entries: int, num_perm: int, threshold: float, max_age: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_age = max_age
+        self.hasher = MinHasher(num_perm)
+        self._entries: OrderedDict[str, PromptEntry] = OrderedDict()
+        self._buckets: dict[tuple, set[str]] = {}
+
+    def _bands(self, style: str, words: frozenset) -> tuple:
+        signature = self.hasher.signature(words)
+        return tuple(
+            (style, i, signature[i:i + _ROWS_PER_BAND])
+            for i in range(0, len(signature), _ROWS_PER_BAND)
+        )
+
+    def add(self, generation_id: str, device_id: str, prompt: str, style: Optional[str],
+            created: Optional[float] = None):
+        style = style or ""
+        words = normalize_prompt(prompt)
+        entry = PromptEntry(
+            generation_id, device_id, style, words,
+            time.time() if created is None else created, self._bands(style, words),
+        )
+        self._remove(generation_id)
+        self._entries[generation_id] = entry
+        for band in entry.bands:
+            self._buckets.setdefault(band, set()).add(generation_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, generation_id: str):
+        entry = self._entries.pop(generation_id, None)
+        if entry is None:
+            return
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(generation_id)
+                if not bucket:
+                    del self._buckets[band]
+
+    def find(self, prompt: str, style: Optional[str],
+             device_id: Optional[str] = None) -> Optional[SimilarMatch]:
+        """Most similar fresh entry at or above the threshold, if any.
+
+        Among equally similar entries, ``device_id``'s own generations win.
+        """
+        style = style or ""
+        words = normalize_prompt(prompt)
+        candidates = set()
+        for band in self._bands(style, words):
+            candidates |= self._buckets.get(band, set())
+        oldest = time.time() - self.max_age
+        best, best_rank = None, None
+        for generation_id in candidates:
+            entry = self._entries[generation_id]
+            if entry.created < oldest:
+                continue
+            similarity = jaccard(words, entry.words)
+            rank = (similarity, entry.device_id == device_id)
+            if similarity >= self.threshold and (best is None or rank > best_rank):
+                best, best_rank = SimilarMatch(generation_id, entry.device_id, similarity), rank
+        return best
+
+    async def image_url(self, db: AsyncSession, match: SimilarMatch) -> Optional[str]:
+        """The matched generation's image, or None (and the entry dropped) if it is gone."""
+        image_url = (
+            await db.execute(REUSABLE_IMAGE_URL, {"generation_id": match.generation_id})
+        ).scalar()
+        if image_url is None:
+            self._remove(match.generation_id)
+        return image_url
+
+    async def load(self, sessionmaker: async_sessionmaker):
+        """Index recent successful generations."""
+        since = datetime.utcnow() - timedelta(seconds=self.max_age)
+        async with sessionmaker() as db:
+            result = await db.stream(
+                select(
+                    ImageGeneration.id, ImageGeneration.device_id, ImageGeneration.prompt,
+                    ImageGeneration.style, ImageGeneration.created_at,
+                )
+                .where(
+                    ImageGeneration.status == "completed",
+                    ImageGeneration.image_url.isnot(None),
+                    ImageGeneration.created_at >= since,
+                )
+                .order_by(ImageGeneration.created_at)
+                .execution_options(yield_per=1000)
+            )
+            async for rows in result.partitions():
+                for row in rows:
+                    created = (row.created_at - datetime(1970, 1, 1)).total_seconds()
+                    self.add(row.id, row.device_id, row.prompt, row.style, created)
+        logger.info(f"Prompt index loaded with {len(self)} recent generations")
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+prompt_index = PromptIndex(
+    settings.PROMPT_INDEX_SIZE,
+    settings.PROMPT_MINHASH_PERMUTATIONS,
+    settings.PROMPT_SIMILARITY_THRESHOLD,
+    settings.PROMPT_REUSE_MAX_AGE_SECONDS,
+)
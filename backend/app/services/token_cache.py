@@ -0,0 +1,145 @@
+"""Token snapshot cache for the read-only token endpoints.
+
+``/tokens/info`` and ``/tokens/validate`` run on every page render. They read
+a small immutable snapshot of the token from a per-worker TTL+LRU cache.
+Writers in this process (generation consume/refund, webhook minting) refresh
+the entry after commit. The TTL bounds staleness for writes made by other
+workers.
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Union
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.metrics import record_token_cache_lookup
+from app.core.security import token_may_be_valid
+from app.models import GenerationToken
+from app.models.device_key import device_match, device_params, keyed_statement
+from app.services.known_ids import known_ids
+
+
+@dataclass(frozen=True, slots=True)
+class TokenSnapshot:
+    """Read-only view of a token at the time it was read or cached."""
+    id: str
+    token: str
+    remaining_generations: int
+    total_generations: int
+    expires_at: datetime
+    product_sku: str
+
+    @classmethod
+    def from_model(cls, token: GenerationToken) -> "TokenSnapshot":
+        return cls(
+            id=token.id,
+            token=token.token,
+            remaining_generations=token.remaining_generations,
+            total_generations=token.total_generations,
+            expires_at=token.expires_at,
+            product_sku=token.product_sku,
+        )
+
+    @classmethod
+    def from_row(cls, row) -> "TokenSnapshot":
+        """From a row of ``SNAPSHOT_COLUMNS``."""
+        return cls(*row)
+
+    @property
+    def is_valid(self) -> bool:
+        return self.remaining_generations > 0 and datetime.utcnow() < self.expires_at
+
+
+# Hot read paths select these columns with Core instead of hydrating ORM
+# objects; the statements are built once and their compiled form is cached.
+SNAPSHOT_COLUMNS = (
+    GenerationToken.id,
+    GenerationToken.token,
+    GenerationToken.remaining_generations,
+    GenerationToken.total_generations,
+    GenerationToken.expires_at,
+    GenerationToken.product_sku,
+)
+SNAPSHOT_BY_TOKEN = select(*SNAPSHOT_COLUMNS).where(GenerationToken.token == bindparam("token"))
+VALID_SNAPSHOTS_BY_DEVICE = keyed_statement(lambda: (
+    select(*SNAPSHOT_COLUMNS)
+    .where(
+        device_match(GenerationToken),
+        GenerationToken.remaining_generations > 0,
+        GenerationToken.expires_at > bindparam("now"),
+    )
+    .order_by(GenerationToken.expires_at)
+))
+
+
+class TokenCache:
+    """LRU of token snapshots whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self._entries = LRUCache(maxsize)
+
+    def get(self, token: str) -> Optional[TokenSnapshot]:
+        entry = self._entries.get(token)
+        if entry is None:
+            record_token_cache_lookup("miss")
+            return None
+        snapshot, cached_at = entry
+        if time.monotonic() - cached_at > self.ttl:
+            self._entries.pop(token)
+            record_token_cache_lookup("stale")
+            return None
+        record_token_cache_lookup("hit")
+        return snapshot
+
+    def peek(self, token: str) -> Optional[TokenSnapshot]:
+        """Like ``get`` for a fresh entry, without counting a lookup."""
+        entry = self._entries.get(token)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def put(self, token: Union[GenerationToken, TokenSnapshot]) -> TokenSnapshot:
+        """Cache the current state of a committed token."""
+        snapshot = token if isinstance(token, TokenSnapshot) else TokenSnapshot.from_model(token)
+        self._entries.put(snapshot.token, (snapshot, time.monotonic()))
+        return snapshot
+
+    def invalidate(self, token: str):
+        self._entries.pop(token)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL_SECONDS)
+
+
+async def get_token_snapshot(db: AsyncSession, token: str) -> Optional[TokenSnapshot]:
+    """Snapshot for ``token`` from the cache, falling back to the DB."""
+    if not token_may_be_valid(token):
+        return None
+    snapshot = token_cache.get(token)
+    if snapshot is not None:
+        return snapshot
+    if known_ids.token_missing(token):
+        return None
+    row = (await db.execute(SNAPSHOT_BY_TOKEN, {"token": token})).first()
+    if row is None:
+        return None
+    return token_cache.put(TokenSnapshot.from_row(row))
+
+
+async def get_valid_snapshots(db: AsyncSession, device_id: str) -> list[TokenSnapshot]:
+    """A device's usable tokens, soonest expiry first."""
+    result = await db.execute(
+        VALID_SNAPSHOTS_BY_DEVICE(), {**device_params(device_id), "now": datetime.utcnow()}
+    )
+    return [TokenSnapshot.from_row(row) for row in result]
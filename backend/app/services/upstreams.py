@@ -0,0 +1,197 @@
+"""Pool of image generation upstreams.
+
+Each request picks an upstream by power-of-two-choices: two random eligible
+upstreams are compared on their decayed (EWMA) latency scaled by in-flight
+requests and recent error rate, and the cheaper one wins. Upstreams at their
+concurrency cap are skipped. After ``UPSTREAM_EJECT_AFTER_FAILURES``
+consecutive failures an upstream is ejected; once the ejection expires a
+single probe request is let through, and its outcome either restores the
+upstream or ejects it again for twice as long (capped).
+"""
+import asyncio
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+from app.core import tracing
+from app.core.config import settings
+from app.core.metrics import record_upstream_ejected, record_upstream_request
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Upstream:
+    name: str
+    url: str
+    key: str
+    model: str
+    max_concurrency: int
+    in_flight: int = 0
+    latency: float = 0.0  # EWMA seconds; 0 until the first sample
+    error_rate: float = 0.0  # EWMA of failures in [0, 1]
+    last_sample: float = 0.0
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+    eject_seconds: float = 0.0
+    probing: bool = False
+    client: Optional[httpx.AsyncClient] = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        """Pooled client, so connections (and TLS sessions) are reused."""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=settings.UPSTREAM_TIMEOUT_SECONDS,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                event_hooks=tracing.httpx_event_hooks(),
+            )
+        return self.client
+
+    def cost(self) -> float:
+        # Unsampled upstreams look fast so they get traffic and a real score.
+        return self.latency * (self.in_flight + 1) * (1 + 10 * self.error_rate)
+
+
+class UpstreamPool:
+    """Routes requests across upstreams and tracks their health."""
+
+    def __init__(self, upstreams: list[Upstream], decay_seconds: float,
+                 eject_after: int, eject_seconds: float, max_eject_seconds: float):
+        self.upstreams = upstreams
+        self.decay_seconds = decay_seconds
+        self.eject_after = eject_after
+        self.base_eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+
+    def _eligible(self, upstream: Upstream, now: float, exclude: set[str]) -> bool:
+        if upstream.name in exclude or upstream.in_flight >= upstream.max_concurrency:
+            return False
+        if upstream.ejected_until == 0.0:
+            return True
+        # Ejected: only a single probe once the ejection has expired.
+        return now >= upstream.ejected_until and not upstream.probing
+
+    def acquire(self, exclude: set[str] = frozenset(), now: Optional[float] = None) -> Optional[Upstream]:
+        """Pick an upstream and count the request in flight; None if none is free."""
+        now = time.monotonic() if now is None else now
+        eligible = [u for u in self.upstreams if self._eligible(u, now, exclude)]
+        if not eligible:
+            return None
+        if len(eligible) == 1:
+            chosen = eligible[0]
+        else:
+            a, b = random.sample(eligible, 2)
+            chosen = min((a, b), key=Upstream.cost)
+        if chosen.ejected_until:
+            chosen.probing = True
+        chosen.in_flight += 1
+        return chosen
+
+    def release(self, upstream: Upstream, latency: float, ok: bool, now: Optional[float] = None):
+        """Record the outcome of a request started with ``acquire``."""
+        now = time.monotonic() if now is None else now
+        upstream.in_flight -= 1
+        if upstream.last_sample and self.decay_seconds > 0:
+            weight = math.exp(-(now - upstream.last_sample) / self.decay_seconds)
+        else:
+            weight = 0.0
+        upstream.latency = weight * upstream.latency + (1 - weight) * latency
+        upstream.error_rate = weight * upstream.error_rate + (1 - weight) * (0.0 if ok else 1.0)
+        upstream.last_sample = now
+        record_upstream_request(upstream.name, "success" if ok else "failure", latency)
+
+        was_probe = upstream.probing
+        upstream.probing = False
+        if ok:
+            upstream.consecutive_failures = 0
+            if upstream.ejected_until:
+                logger.info(f"Upstream {upstream.name} restored after probe")
+                upstream.ejected_until = 0.0
+                upstream.eject_seconds = 0.0
+            return
+        upstream.consecutive_failures += 1
+        if was_probe or upstream.consecutive_failures >= self.eject_after:
+            self._eject(upstream, now, again=was_probe)
+
+    def abandon(self, upstream: Upstream):
+        """Release a request that ended without an outcome (e.g. cancelled)."""
+        upstream.in_flight -= 1
+        upstream.probing = False
+
+    def _eject(self, upstream: Upstream, now: float, again: bool):
+        if again and upstream.eject_seconds:
+            upstream.eject_seconds = min(self.max_eject_seconds, upstream.eject_seconds * 2)
+        else:
+            upstream.eject_seconds = self.base_eject_seconds
+        upstream.ejected_until = now + upstream.eject_seconds
+        record_upstream_ejected(upstream.name)
+        logger.warning(
+            f"Upstream {upstream.name} ejected for {upstream.eject_seconds:.0f}s "
+            f"after {upstream.consecutive_failures} failures"
+        )
+
+    def reset(self):
+        """Forget all health state (tests, reconfiguration)."""
+        for upstream in self.upstreams:
+            upstream.in_flight = 0
+            upstream.latency = upstream.error_rate = upstream.last_sample = 0.0
+            upstream.consecutive_failures = 0
+            upstream.ejected_until = upstream.eject_seconds = 0.0
+            upstream.probing = False
+            upstream.client = None
+
+    async def warm(self, timeout: float):
+        """Open a connection to every upstream so the first generation skips connect/TLS."""
+        async def connect(upstream: Upstream):
+            try:
+                await upstream.get_client().head(upstream.url, timeout=timeout)
+            except httpx.HTTPError as e:
+                logger.warning(f"Upstream {upstream.name} warmup failed: {e!r}")
+
+        await asyncio.gather(*(connect(u) for u in self.upstreams))
+
+    async def aclose(self):
+        """Close the pooled HTTP clients."""
+        for upstream in self.upstreams:
+            if upstream.client is not None:
+                await upstream.client.aclose()
+                upstream.client = None
+
+
+def upstreams_from_settings() -> list[Upstream]:
+    """``LLM_UPSTREAMS`` entries, or the single ``LLM_PROXY_URL`` upstream."""
+    entries = settings.LLM_UPSTREAMS or [{
+        "name": "default", "url": settings.LLM_PROXY_URL, "key": settings.LLM_PROXY_KEY,
+    }]
+    return [
+        Upstream(
+            name=entry.get("name") or f"upstream-{i}",
+            url=entry["url"].rstrip("/"),
+            key=entry.get("key", settings.LLM_PROXY_KEY),
+            model=entry.get("model", settings.LLM_IMAGE_MODEL),
+            max_concurrency=int(entry.get("max_concurrency", settings.UPSTREAM_MAX_CONCURRENCY)),
+        )
+        for i, entry in enumerate(entries)
+    ]
+
+
+upstream_pool = UpstreamPool(
+    [], settings.UPSTREAM_EWMA_DECAY_SECONDS, settings.UPSTREAM_EJECT_AFTER_FAILURES,
+    settings.UPSTREAM_EJECT_SECONDS, settings.UPSTREAM_MAX_EJECT_SECONDS,
+)
+
+
+def configure_upstreams():
+    """(Re)build the pool from settings."""
+    upstream_pool.upstreams = upstreams_from_settings()
+
+
+configure_upstreams()
@@ -0,0 +1,327 @@
+"""Webhook inbox — ack-first intake and batched background processing.
+
+The webhook endpoint only verifies the signature and appends the raw event to
+``webhook_inbox``. ``InboxConsumer`` drains pending rows in batches, minting
+tokens for a whole batch in one transaction so purchase spikes take the
+SQLite writer lock once per batch instead of once per event.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.database import async_session, insert_or_ignore
+from app.core.metrics import record_inbox_delay, record_inbox_state, record_webhook_duplicate
+from app.models import GenerationToken, PaymentTransaction, WebhookInbox
+from app.services.known_ids import known_ids
+from app.services.token_cache import token_cache
+
+logger = logging.getLogger(__name__)
+
+# Checkout ids already turned into tokens, so redeliveries skip the DB.
+processed_checkouts = LRUCache(maxsize=settings.WEBHOOK_DEDUPE_CACHE_SIZE)
+
+
+def inbox_event_id(event: dict) -> Optional[str]:
+    """Dedupe key for an event: Creem's event id, else type + object id."""
+    if event.get("id"):
+        return str(event["id"])
+    obj = event.get("object")
+    object_id = obj.get("id") if isinstance(obj, dict) else None
+    if object_id:
+        return f"{event.get('eventType')}:{object_id}"
+    return None
+
+
+async def append_event(db: AsyncSession, event: dict, payload: bytes) -> bool:
+    """Durably store a verified event. Returns False if it was already stored."""
+    result = await db.execute(
+        insert_or_ignore(WebhookInbox, db.get_bind().dialect.name).values(
+            event_id=inbox_event_id(event),
+            event_type=str(event.get("eventType") or "unknown"),
+            payload=payload.decode("utf-8"),
+            status="pending",
+            attempts=0,
+            received_at=datetime.utcnow(),
+        )
+    )
+    await db.commit()
+    return result.rowcount != 0
+
+
+def _mapping(value, name: str) -> dict:
+    """``value`` as a JSON object, missing counting as empty; ValueError otherwise."""
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError(f"checkout {name} is not an object")
+    return value
+
+
+def _parse_checkout(event: dict) -> dict:
+    """Extract the fields needed to mint a token; raises ValueError if unusable."""
+    obj = _mapping(_mapping(event, "event").get("object"), "object")
+    metadata = _mapping(obj.get("metadata"), "metadata")
+    order = _mapping(obj.get("order"), "order")
+    product_sku = metadata.get("product_sku")
+    if not product_sku:
+        raise ValueError("checkout has no product_sku")
+    amount = order.get("amount")
+    if amount is None:
+        raise ValueError("checkout has no order amount")
+    return {
+        "checkout_id": obj.get("id"),
+        "product_sku": product_sku,
+        "device_id": metadata.get("device_id"),
+        "generations": int(metadata.get("generations", 1)),
+        "amount_cents": int(amount),
+        "currency": order.get("currency", "usd"),
+        "email": _mapping(obj.get("customer"), "customer").get("email"),
+    }
+
+
+async def _known_checkouts(db: AsyncSession, checkout_ids: list[str]) -> set[str]:
+    """Checkout ids that already have a transaction (LRU first, then one IN query)."""
+    known = {cid for cid in checkout_ids if cid in processed_checkouts}
+    if known:
+        record_webhook_duplicate("cache")
+    unknown = [cid for cid in checkout_ids if cid not in known]
+    if unknown:
+        result = await db.execute(
+            select(PaymentTransaction.provider_transaction_id).where(
+                PaymentTransaction.provider_transaction_id.in_(unknown)
+            )
+        )
+        found = set(result.scalars().all())
+        if found:
+            record_webhook_duplicate("db")
+        known |= found
+    return known
+
+
+async def _mint(db: AsyncSession, checkout: dict) -> Optional[GenerationToken]:
+    """Create token + transaction in the current DB transaction.
+
+    The transaction row uses insert-or-ignore, so if another worker processed
+    the same checkout concurrently the token is removed again and None is
+    returned: tokens are never double-minted.
+    """
+    token = GenerationToken.create_token(
+        product_sku=checkout["product_sku"],
+        generations=checkout["generations"],
+        device_id=checkout["device_id"],
+    )
+    db.add(token)
+    await db.flush()
+    known_ids.add_token(token.token, token.device_id)
+
+    result = await db.execute(
+        insert_or_ignore(PaymentTransaction, db.get_bind().dialect.name).values(
+            id=str(uuid.uuid4()),
+            token_id=token.id,
+            product_sku=checkout["product_sku"],
+            provider="creem",
+            provider_transaction_id=checkout["checkout_id"],
+            amount_cents=checkout["amount_cents"],
+            currency=checkout["currency"],
+            status="succeeded",
+            device_id=checkout["device_id"],
+            optional_email=checkout["email"],
+            created_at=datetime.utcnow(),
+        )
+    )
+    if result.rowcount == 0:
+        await db.delete(token)
+        await db.flush()
+        record_webhook_duplicate("db")
+        return None
+    return token
+
+
+async def _apply(
+    db: AsyncSession, rows: list[WebhookInbox]
+) -> tuple[set[str], list[GenerationToken]]:
+    """Process rows inside the caller's transaction.
+
+    Returns the checkout ids that are settled and the tokens minted once the
+    transaction commits.
+    """
+    now = datetime.utcnow()
+    checkouts: dict[int, dict] = {}
+    for row in rows:
+        row.attempts += 1
+        if row.event_type != "checkout.completed":
+            continue
+        try:
+            checkouts[row.id] = _parse_checkout(json.loads(row.payload))
+        except (ValueError, TypeError) as exc:
+            row.status = "failed"
+            row.last_error = str(exc)
+            row.processed_at = now
+
+    ids = [c["checkout_id"] for c in checkouts.values() if c["checkout_id"]]
+    settled = await _known_checkouts(db, ids) if ids else set()
+    minted = []
+    for row in rows:
+        if row.status == "failed":
+            continue
+        checkout = checkouts.get(row.id)
+        if checkout is not None and checkout["checkout_id"] not in settled:
+            token = await _mint(db, checkout)
+            if token is not None:
+                minted.append(token)
+            if checkout["checkout_id"]:
+                settled.add(checkout["checkout_id"])
+        row.status = "done"
+        row.processed_at = now
+        record_inbox_delay((now - row.received_at).total_seconds())
+    return settled, minted
+
+
+async def process_inbox_batch(db: AsyncSession, limit: int = None) -> int:
+    """Process up to ``limit`` pending events. Returns how many rows were handled.
+
+    The batch is applied in one transaction. If that fails, rows are retried
+    one per transaction so a single bad event cannot block the rest.
+    """
+    limit = limit or settings.WEBHOOK_INBOX_BATCH_SIZE
+    result = await db.execute(
+        select(WebhookInbox)
+        .where(WebhookInbox.status == "pending")
+        .order_by(WebhookInbox.id)
+        .limit(limit)
+    )
+    rows = result.scalars().all()
+    if not rows:
+        return 0
+    row_ids = [row.id for row in rows]
+
+    try:
+        settled, minted = await _apply(db, rows)
+        await db.commit()
+    except SQLAlchemyError:
+        logger.exception("Inbox batch failed; retrying events individually")
+        await db.rollback()
+        settled, minted = set(), []
+        for row_id in row_ids:
+            row_settled, row_minted = await _process_single(db, row_id)
+            settled |= row_settled
+            minted += row_minted
+    for checkout_id in settled:
+        processed_checkouts.put(checkout_id)
+    for token in minted:
+        token_cache.put(token)
+    return len(rows)
+
+
+async def _process_single(
+    db: AsyncSession, row_id: int
+) -> tuple[set[str], list[GenerationToken]]:
+    row = await db.get(WebhookInbox, row_id)
+    if row is None or row.status != "pending":
+        return set(), []
+    try:
+        result = await _apply(db, [row])
+        await db.commit()
+        return result
+    except SQLAlchemyError as exc:
+        await db.rollback()
+        row = await db.get(WebhookInbox, row_id)
+        row.attempts += 1
+        row.last_error = str(exc)[:1000]
+        if row.attempts >= settings.WEBHOOK_INBOX_MAX_ATTEMPTS:
+            row.status = "failed"
+            row.processed_at = datetime.utcnow()
+            logger.error(f"Webhook inbox event {row_id} failed permanently: {exc}")
+        await db.commit()
+        return set(), []
+
+
+async def inbox_state(db: AsyncSession) -> tuple[int, float]:
+    """Return (pending count, age in seconds of the oldest pending event)."""
+    result = await db.execute(
+        select(func.count(), func.min(WebhookInbox.received_at)).where(
+            WebhookInbox.status == "pending"
+        )
+    )
+    pending, oldest = result.one()
+    lag = (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    return pending, max(0.0, lag)
+
+
+class InboxConsumer:
+    """Background task draining the webhook inbox."""
+
+    def __init__(self, sessionmaker: async_sessionmaker = async_session):
+        self.sessionmaker = sessionmaker
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def wake(self):
+        """Signal that new events were appended."""
+        self._wakeup.set()
+
+    def start(self):
+        """Start consuming; pending events left by a previous process go first."""
+        if self.running:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="webhook-inbox-consumer")
+
+    async def stop(self, timeout: float = 10.0):
+        """Finish the current batch and stop."""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
+
+    async def run_once(self) -> int:
+        """Process one batch and refresh inbox metrics."""
+        async with self.sessionmaker() as db:
+            processed = await process_inbox_batch(db)
+            record_inbox_state(*await inbox_state(db))
+        return processed
+
+    async def _run(self):
+        async with self.sessionmaker() as db:
+            pending, lag = await inbox_state(db)
+        if pending:
+            logger.info(f"Resuming {pending} unprocessed webhook events (oldest {lag:.0f}s)")
+        while not self._stopping:
+            try:
+                processed = await self.run_once()
+            except Exception:
+                logger.exception("Webhook inbox consumer error")
+                processed = 0
+            if processed >= settings.WEBHOOK_INBOX_BATCH_SIZE:
+                continue  # Backlog: keep draining.
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.WEBHOOK_INBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._stopping and settings.WEBHOOK_INBOX_LINGER_MS:
+                # Let a burst accumulate into one batch.
+                await asyncio.sleep(settings.WEBHOOK_INBOX_LINGER_MS / 1000)
+
+
+inbox_consumer = InboxConsumer()
@@ -0,0 +1,8 @@
+"""Load and latency benchmarks for the AI Image Gen backend.
+
+Modules:
+    fake_upstream -- stand-in for the LLM proxy image endpoint
+    fake_creem    -- stand-in for the Creem checkout API plus webhook signing
+    load          -- load driver reporting req/s, latency percentiles and DB waits
+    compare       -- diff two JSON result files from ``load``
+"""
@@ -0,0 +1,55 @@
+"""Compare two ``benchmarks.load`` JSON reports.
+
+    python -m benchmarks.compare base.json head.json
+"""
+import argparse
+import json
+from pathlib import Path
+
+METRICS = (("rps", lambda r: r["rps"]),
+           ("p50", lambda r: r["latency_ms"]["p50"]),
+           ("p95", lambda r: r["latency_ms"]["p95"]),
+           ("p99", lambda r: r["latency_ms"]["p99"]),
+           ("cpu", lambda r: r.get("cpu_ms_per_request", 0.0)))
+
+
+def _index(report: dict) -> dict:
+    return {(r["scenario"], r["concurrency"]): r for r in report["results"]}
+
+
+def compare(base: dict, head: dict) -> list[dict]:
+    """Return per (scenario, concurrency) deltas for levels present in both."""
+    base_idx, head_idx = _index(base), _index(head)
+    rows = []
+    for key in sorted(base_idx.keys() & head_idx.keys()):
+        row = {"scenario": key[0], "concurrency": key[1]}
+        for name, getter in METRICS:
+            old, new = getter(base_idx[key]), getter(head_idx[key])
+            change = ((new - old) / old * 100) if old else 0.0
+            row[name] = {"base": old, "head": new, "change_pct": round(change, 1)}
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--json", action="store_true", help="emit JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    rows = compare(json.loads(Path(args.base).read_text()),
+                   json.loads(Path(args.head).read_text()))
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    for row in rows:
+        cells = " ".join(
+            f"{name}={row[name]['base']}->{row[name]['head']} ({row[name]['change_pct']:+}%)"
+            for name, _ in METRICS
+        )
+        print(f"{row['scenario']:<17} c={row['concurrency']:<4} {cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Device lookup benchmark: device_id string indexes vs compact device_key indexes.
+
+Seeds a throwaway SQLite file with ``--devices`` devices (free trial row,
+token and generation each) using long fingerprint-like device ids, then
+reports the on-disk size of each device index (from ``dbstat``) and the
+latency of the app's device lookups with ``DEVICE_KEY_SECRET`` off and on.
+
+    python -m benchmarks.device_keys --devices 1000000 --lookups 20000 --output keys.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.config import settings
+from app.core.database import init_db
+from app.models import FreeTrialUsage, GenerationToken, ImageGeneration
+from benchmarks.load import _git_commit
+from benchmarks.stats import summarize
+
+SEED_BATCH = 10_000
+INDEXES = {
+    "free_trial_usage": ("sqlite_autoindex_free_trial_usage_1", "ix_free_trial_usage_device_id",
+                         "ix_free_trial_usage_device_key"),
+    "generation_tokens": ("ix_generation_tokens_device_id", "ix_generation_tokens_device_key"),
+    "image_generations": ("ix_image_generations_device_created",
+                          "ix_image_generations_device_key_created"),
+}
+
+
+def _device_id(i: int, length: int) -> str:
+    return (uuid.UUID(int=i).hex * (length // 32 + 1))[:length - 8] + f"{i:08x}"
+
+
+async def seed(engine, devices: int, id_length: int):
+    now = datetime.utcnow()
+    expires = now + timedelta(days=365)
+    for start in range(0, devices, SEED_BATCH):
+        ids = [_device_id(i, id_length) for i in range(start, min(start + SEED_BATCH, devices))]
+        async with engine.begin() as conn:
+            await conn.execute(insert(FreeTrialUsage), [
+                {"id": str(uuid.uuid4()), "device_id": d, "used_count": 1} for d in ids
+            ])
+            await conn.execute(insert(GenerationToken), [
+                {"id": str(uuid.uuid4()), "token": f"tok_{uuid.uuid4().hex}",
+                 "product_sku": "starter_10", "total_generations": 10,
+                 "remaining_generations": 5, "expires_at": expires, "device_id": d}
+                for d in ids
+            ])
+            await conn.execute(insert(ImageGeneration), [
+                {"id": str(uuid.uuid4()), "device_id": d, "prompt": "seed", "model": "dall-e-3",
+                 "status": "completed", "created_at": now}
+                for d in ids
+            ])
+
+
+async def index_sizes(engine) -> dict:
+    async with engine.connect() as conn:
+        rows = (await conn.execute(text(
+            "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"
+        ))).all()
+    sizes = dict(rows)
+    return {
+        table: {name: sizes.get(name, 0) for name in names} for table, names in INDEXES.items()
+    }
+
+
+async def time_lookups(sessionmaker, devices: list[str]) -> dict:
+    # Imported here so each run sees the statements for the current key mode.
+    from app.api.v1.generate import get_paid_remaining, get_usage
+    from app.api.v1.generations import list_generations
+    from app.services.token_cache import get_valid_snapshots
+
+    lookups = {
+        "usage": lambda db, d: get_usage(d, db),
+        "paid_remaining": get_paid_remaining,
+        "valid_tokens": get_valid_snapshots,
+        "history": lambda db, d: list_generations(d, limit=20, after=None, include=None, db=db),
+    }
+    results = {}
+    async with sessionmaker() as db:
+        for name, lookup in lookups.items():
+            samples = []
+            for device_id in devices:
+                started = time.perf_counter()
+                await lookup(db, device_id)
+                samples.append(time.perf_counter() - started)
+            await db.rollback()
+            results[name] = summarize(samples)
+    return results
+
+
+async def query_plans(engine, device_id: str) -> dict:
+    from app.api.v1.generate import FREE_USED_COUNT, PAID_REMAINING
+    from app.models.device_key import device_params
+
+    params = {**device_params(device_id), "now": datetime.utcnow()}
+    plans = {}
+    async with engine.connect() as conn:
+        for name, statement in (("free_used_count", FREE_USED_COUNT()),
+                                ("paid_remaining", PAID_REMAINING())):
+            compiled = statement.compile(engine.sync_engine)
+            values = compiled.construct_params(params)
+            rows = (await conn.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {compiled}",
+                tuple(values[key] for key in compiled.positiontup),
+            )).all()
+            plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+async def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="device-keys-") as workdir:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{Path(workdir) / 'keys.db'}")
+        sessionmaker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        settings.DEVICE_KEY_SECRET = "bench-device-key"
+        await init_db(engine)
+        started = time.perf_counter()
+        await seed(engine, args.devices, args.id_length)
+        seed_s = time.perf_counter() - started
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("ANALYZE")
+
+        rng = random.Random(args.seed)
+        sample = [_device_id(rng.randrange(args.devices), args.id_length) for _ in range(args.lookups)]
+        modes = {}
+        for mode, secret in (("device_id", ""), ("device_key", "bench-device-key")):
+            settings.DEVICE_KEY_SECRET = secret
+            modes[mode] = {
+                "plans": await query_plans(engine, sample[0]),
+                "lookup_ms": await time_lookups(sessionmaker, sample),
+            }
+        sizes = await index_sizes(engine)
+        await engine.dispose()
+
+    return {
+        "meta": {
+            "git_commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+            "seed_s": round(seed_s, 1),
+        },
+        "index_bytes": sizes,
+        "modes": modes,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=20_000, help="lookups per query and mode")
+    parser.add_argument("--id-length", type=int, default=64, help="characters per device id")
+    parser.add_argument("--seed", type=int, default=1, help="RNG seed for the lookup sample")
+    parser.add_argument("--output", default="-", help="JSON output path, '-' for stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    for table, sizes in report["index_bytes"].items():
+        print(f"{table:<18} " + " ".join(f"{k}={v / 2**20:.1f}MiB" for k, v in sizes.items()),
+              file=sys.stderr)
+    for mode, result in report["modes"].items():
+        print(f"{mode:<10} " + " ".join(
+            f"{name}_p50={s['p50']}ms" for name, s in result["lookup_ms"].items()
+        ), file=sys.stderr)
+    text_ = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text_)
+    else:
+        Path(args.output).write_text(text_ + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Fake Creem checkout API and webhook event builder.
+
+Run standalone:
+
+    python -m benchmarks.fake_creem --port 9200 --latency fixed:0.15
+
+Point the backend at it with ``CREEM_API_BASE=http://127.0.0.1:9200/v1``.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.fake_upstream import LatencyModel
+
+
+def create_app(latency: LatencyModel | None = None, error_rate: float = 0.0,
+               seed: int | None = None) -> FastAPI:
+    """Build the fake Creem ASGI app."""
+    app = FastAPI(title="Fake Creem")
+    latency = latency or LatencyModel()
+    rng = random.Random(seed)
+
+    @app.post("/v1/checkouts")
+    async def create_checkout(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency.sample(rng))
+        if rng.random() < error_rate:
+            return JSONResponse(status_code=502, content={"error": "injected failure"})
+        checkout_id = f"ch_{uuid.uuid4().hex}"
+        return {
+            "id": checkout_id,
+            "checkout_url": f"https://fake-creem.local/checkout/{checkout_id}",
+            "product": body.get("product_id"),
+            "metadata": body.get("metadata", {}),
+        }
+
+    return app
+
+
+def checkout_completed_event(
+    device_id: str,
+    product_sku: str = "starter_10",
+    generations: int = 10,
+    amount_cents: int = 299,
+    checkout_id: str | None = None,
+) -> dict:
+    """Build a ``checkout.completed`` event shaped like Creem's."""
+    checkout_id = checkout_id or f"ch_{uuid.uuid4().hex}"
+    return {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "eventType": "checkout.completed",
+        "object": {
+            "id": checkout_id,
+            "metadata": {
+                "product_sku": product_sku,
+                "device_id": device_id,
+                "generations": str(generations),
+            },
+            "customer": {"email": f"{device_id}@bench.local"},
+            "order": {"amount": amount_cents, "currency": "usd"},
+        },
+    }
+
+
+def sign_event(event: dict, secret: str) -> tuple[bytes, str]:
+    """Serialize an event and compute its ``creem-signature`` header."""
+    payload = json.dumps(event).encode()
+    signature = hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
+    return payload, signature
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", default="fixed:0")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(LatencyModel.parse(args.latency), args.error_rate, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
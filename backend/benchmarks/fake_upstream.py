@@ -0,0 +1,130 @@
+"""Fake LLM proxy image endpoint with configurable latency, errors and payloads.
+
+Run standalone:
+
+    python -m benchmarks.fake_upstream --port 9100 \\
+        --latency lognormal:0.8:0.4 --error-rate 0.02 --payload b64:250000
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class LatencyModel:
+    """Latency distribution parsed from ``kind:arg[:arg]``.
+
+    Supported kinds (all values in seconds):
+        fixed:S            constant delay
+        uniform:LO:HI      uniform between LO and HI
+        exp:MEAN           exponential with the given mean
+        lognormal:MED:SIG  lognormal with median MED and shape SIG
+    """
+    kind: str = "fixed"
+    args: tuple = (0.0,)
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        kind, _, rest = spec.partition(":")
+        args = tuple(float(a) for a in rest.split(":")) if rest else ()
+        expected = {"fixed": 1, "uniform": 2, "exp": 1, "lognormal": 2}
+        if kind not in expected or len(args) != expected[kind]:
+            raise ValueError(f"Invalid latency spec: {spec!r}")
+        return cls(kind=kind, args=args)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.args)
+        if self.kind == "exp":
+            return rng.expovariate(1.0 / self.args[0]) if self.args[0] > 0 else 0.0
+        median, sigma = self.args
+        return rng.lognormvariate(0.0, sigma) * median
+
+
+@dataclass
+class UpstreamConfig:
+    """Behaviour of the fake upstream."""
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    error_rate: float = 0.0
+    error_status: int = 500
+    payload: str = "url"  # "url" or "b64:<bytes>"
+    seed: int | None = None
+
+    @property
+    def b64_size(self) -> int:
+        if self.payload.startswith("b64:"):
+            return int(self.payload.split(":", 1)[1])
+        return 0
+
+
+def create_app(config: UpstreamConfig) -> FastAPI:
+    """Build the fake upstream ASGI app."""
+    app = FastAPI(title="Fake LLM Proxy")
+    rng = random.Random(config.seed)
+    # Encode once so the fake itself does not dominate CPU at large sizes.
+    b64_blob = base64.b64encode(os.urandom(config.b64_size)).decode() if config.b64_size else ""
+    stats = {"requests": 0, "errors": 0}
+
+    @app.post("/v1/images/generations")
+    async def generations(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        await asyncio.sleep(config.latency.sample(rng))
+        if rng.random() < config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                status_code=config.error_status,
+                content={"error": {"message": "injected upstream failure"}},
+            )
+        n = stats["requests"]
+        if b64_blob:
+            item = {"b64_json": b64_blob}
+        else:
+            item = {"url": f"https://fake-upstream.local/images/{n}.png"}
+        return {"created": n, "model": body.get("model"), "data": [item]}
+
+    @app.head("/")
+    @app.get("/")
+    async def root():
+        return {"status": "ok"}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="fixed:0", help="see LatencyModel")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--payload", default="url", help="url | b64:<bytes>")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = UpstreamConfig(
+        latency=LatencyModel.parse(args.latency),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        payload=args.payload,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
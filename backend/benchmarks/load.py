@@ -0,0 +1,427 @@
+"""Load driver for the backend API.
+
+By default the app is run in-process against a throwaway SQLite file, with the
+fake upstream and fake Creem started as subprocesses. This mode also hooks the
+SQLAlchemy engine to report DB write/commit waits, and ``cpu_ms_per_request``
+is the process CPU time (app plus load driver) spent per completed request.
+Use ``--target`` to drive an already running server instead (no DB probe in
+that mode, and CPU is the driver's only).
+
+    python -m benchmarks.load --scenarios generate,usage --concurrency 1,16,64 \\
+        --requests 500 --upstream-latency lognormal:0.5:0.3 --output result.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from benchmarks.fake_creem import checkout_completed_event, sign_event
+from benchmarks.stats import summarize
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+WEBHOOK_SECRET = "bench_webhook_secret"
+SCENARIOS = ("generate", "usage", "tokens_validate", "tokens_info", "tokens_by_device",
+             "webhook", "checkout")
+
+
+class DBProbe:
+    """Collect write-statement, commit and lock-error timings from an engine."""
+
+    def __init__(self):
+        self.write_waits: list[float] = []
+        self.commit_waits: list[float] = []
+        self.locked_errors = 0
+        self._commit_started: dict[int, float] = {}
+        self._engine = None
+
+    def attach(self, engine):
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session
+
+        self._engine = engine.sync_engine
+        event.listen(self._engine, "before_cursor_execute", self._before_execute)
+        event.listen(self._engine, "after_cursor_execute", self._after_execute)
+        event.listen(self._engine, "handle_error", self._on_error)
+        event.listen(Session, "before_commit", self._before_commit)
+        event.listen(Session, "after_commit", self._after_commit)
+
+    def detach(self):
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session
+
+        event.remove(self._engine, "before_cursor_execute", self._before_execute)
+        event.remove(self._engine, "after_cursor_execute", self._after_execute)
+        event.remove(self._engine, "handle_error", self._on_error)
+        event.remove(Session, "before_commit", self._before_commit)
+        event.remove(Session, "after_commit", self._after_commit)
+
+    def reset(self):
+        self.write_waits.clear()
+        self.commit_waits.clear()
+        self.locked_errors = 0
+        self._commit_started.clear()
+
+    def report(self) -> dict:
+        return {
+            "write_statement_ms": summarize(self.write_waits),
+            "commit_ms": summarize(self.commit_waits),
+            "locked_errors": self.locked_errors,
+        }
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bench_starts", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["bench_starts"].pop()
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self.write_waits.append(time.perf_counter() - started)
+
+    def _on_error(self, context):
+        starts = context.connection.info.get("bench_starts") if context.connection else None
+        if starts:
+            starts.pop()
+        if "database is locked" in str(context.original_exception):
+            self.locked_errors += 1
+
+    def _before_commit(self, session):
+        self._commit_started[id(session)] = time.perf_counter()
+
+    def _after_commit(self, session):
+        started = self._commit_started.pop(id(session), None)
+        if started is not None:
+            self.commit_waits.append(time.perf_counter() - started)
+
+
+class Workload:
+    """Request generators for each scenario, sharing seeded devices and tokens."""
+
+    def __init__(self, client: httpx.AsyncClient, webhook_secret: str, seed: int):
+        self.client = client
+        self.webhook_secret = webhook_secret
+        self.rng = random.Random(seed)
+        self.devices: list[str] = []
+        self.tokens: list[str] = []
+
+    async def seed(self, count: int, timeout: float = 30.0):
+        """Buy a pack for ``count`` devices through the webhook and collect tokens."""
+        devices = [f"bench-seed-{uuid.uuid4().hex[:12]}" for _ in range(count)]
+        for device_id in devices:
+            payload, signature = sign_event(
+                checkout_completed_event(device_id, generations=1000), self.webhook_secret
+            )
+            response = await self.client.post(
+                "/api/v1/webhooks/creem", content=payload,
+                headers={"creem-signature": signature},
+            )
+            response.raise_for_status()
+        # Webhook processing may be asynchronous; poll until tokens are visible.
+        deadline = time.monotonic() + timeout
+        pending = list(devices)
+        while pending and time.monotonic() < deadline:
+            still_pending = []
+            for device_id in pending:
+                response = await self.client.get(f"/api/v1/tokens/by-device/{device_id}")
+                tokens = response.json().get("tokens", []) if response.status_code == 200 else []
+                if tokens:
+                    self.tokens.append(tokens[0]["token"])
+                else:
+                    still_pending.append(device_id)
+            pending = still_pending
+            if pending:
+                await asyncio.sleep(0.2)
+        if pending:
+            raise RuntimeError(f"{len(pending)} seeded devices never received tokens")
+        self.devices = devices
+
+    def _known_or_fresh_device(self) -> str:
+        if self.devices and self.rng.random() < 0.5:
+            return self.rng.choice(self.devices)
+        return f"bench-{uuid.uuid4().hex[:16]}"
+
+    def _known_or_bogus_token(self) -> str:
+        if self.tokens and self.rng.random() < 0.8:
+            return self.rng.choice(self.tokens)
+        return f"tok_{uuid.uuid4().hex}"
+
+    async def generate(self) -> httpx.Response:
+        return await self.client.post("/api/v1/generate", json={
+            "prompt": f"benchmark prompt {self.rng.randrange(1_000_000)}",
+            "device_id": f"bench-{uuid.uuid4().hex[:16]}",
+        })
+
+    async def usage(self) -> httpx.Response:
+        return await self.client.get(f"/api/v1/usage/{self._known_or_fresh_device()}")
+
+    async def tokens_validate(self) -> httpx.Response:
+        return await self.client.post(
+            "/api/v1/tokens/validate", params={"token": self._known_or_bogus_token()}
+        )
+
+    async def tokens_info(self) -> httpx.Response:
+        return await self.client.get(f"/api/v1/tokens/info/{self._known_or_bogus_token()}")
+
+    async def tokens_by_device(self) -> httpx.Response:
+        return await self.client.get(
+            f"/api/v1/tokens/by-device/{self._known_or_fresh_device()}"
+        )
+
+    async def webhook(self) -> httpx.Response:
+        event = checkout_completed_event(f"bench-buyer-{uuid.uuid4().hex[:12]}")
+        payload, signature = sign_event(event, self.webhook_secret)
+        return await self.client.post(
+            "/api/v1/webhooks/creem", content=payload, headers={"creem-signature": signature}
+        )
+
+    async def checkout(self) -> httpx.Response:
+        return await self.client.post("/api/v1/payment/create-checkout", json={
+            "product_sku": "starter_10",
+            "device_id": self._known_or_fresh_device(),
+            "success_url": "https://bench.local/success",
+        })
+
+
+async def run_level(operation, concurrency: int, requests: int, duration: float) -> dict:
+    """Run a closed-loop load level and summarize it."""
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    exceptions: dict[str, int] = {}
+    issued = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        nonlocal issued
+        while True:
+            if requests and issued >= requests:
+                return
+            if deadline and time.perf_counter() >= deadline:
+                return
+            issued += 1
+            started = time.perf_counter()
+            try:
+                response = await operation()
+            except Exception as exc:  # noqa: BLE001 - every failure is a data point
+                name = type(exc).__name__
+                exceptions[name] = exceptions.get(name, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            key = str(response.status_code)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    completed = len(latencies)
+    server_errors = sum(v for k, v in statuses.items() if k.startswith("5"))
+    return {
+        "concurrency": concurrency,
+        "completed": completed,
+        "duration_s": round(elapsed, 3),
+        "rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "cpu_ms_per_request": round(cpu / completed * 1000, 3) if completed else 0.0,
+        "status_counts": statuses,
+        "server_errors": server_errors,
+        "exceptions": exceptions,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_until_up(url: str, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not come up")
+                await asyncio.sleep(0.1)
+
+
+@asynccontextmanager
+async def _subprocess_server(module: str, *args: str):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", module, "--port", str(port), *args], cwd=BACKEND_DIR
+    )
+    try:
+        await _wait_until_up(f"http://127.0.0.1:{port}/docs")
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+@asynccontextmanager
+async def in_process_app(args, stack: AsyncExitStack):
+    """Start fakes, configure and boot the app, and yield (client, probe)."""
+    upstream_url = await stack.enter_async_context(_subprocess_server(
+        "benchmarks.fake_upstream",
+        "--latency", args.upstream_latency,
+        "--error-rate", str(args.upstream_error_rate),
+        "--payload", args.upstream_payload,
+        "--seed", str(args.seed),
+    ))
+    creem_url = await stack.enter_async_context(_subprocess_server(
+        "benchmarks.fake_creem", "--latency", args.creem_latency, "--seed", str(args.seed),
+    ))
+    workdir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="bench-")))
+    os.environ.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir / 'bench.db'}",
+        "LLM_PROXY_URL": upstream_url,
+        "LLM_PROXY_KEY": "bench",
+        "CREEM_API_BASE": f"{creem_url}/v1",
+        "CREEM_API_KEY": "creem_test_bench",
+        "CREEM_WEBHOOK_SECRET": args.webhook_secret,
+        "CREEM_PRODUCT_IDS": json.dumps({"starter_10": "prod_bench"}),
+        # All load comes from one client address.
+        "RATE_LIMIT_ENABLED": "false",
+    })
+    # Settings are read at import time, so the app is imported only now.
+    from app.core.database import engine
+    from app.main import app
+
+    await stack.enter_async_context(app.router.lifespan_context(app))
+    probe = DBProbe()
+    probe.attach(engine)
+    stack.callback(probe.detach)
+    client = await stack.enter_async_context(httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout,
+    ))
+    yield client, probe
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    results = []
+    async with AsyncExitStack() as stack:
+        if args.target:
+            client = await stack.enter_async_context(httpx.AsyncClient(
+                base_url=args.target, timeout=args.timeout,
+                limits=httpx.Limits(max_connections=max(args.concurrency) * 2),
+            ))
+            probe = None
+        else:
+            client, probe = await stack.enter_async_context(in_process_app(args, stack))
+
+        workload = Workload(client, args.webhook_secret, args.seed)
+        if args.seed_devices and set(args.scenarios) - {"generate", "webhook"}:
+            await workload.seed(args.seed_devices)
+
+        for scenario in args.scenarios:
+            operation = getattr(workload, scenario)
+            for concurrency in args.concurrency:
+                if args.warmup:
+                    await run_level(operation, min(concurrency, args.warmup), args.warmup, 0)
+                if probe:
+                    probe.reset()
+                level = await run_level(operation, concurrency, args.requests, args.duration)
+                level["scenario"] = scenario
+                if probe:
+                    level["db"] = probe.report()
+                results.append(level)
+                _print_level(level)
+
+    return {
+        "meta": {
+            "git_commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "external" if args.target else "in-process",
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": results,
+    }
+
+
+def _print_level(level: dict):
+    lat = level["latency_ms"]
+    line = (
+        f"{level['scenario']:<17} c={level['concurrency']:<4} n={level['completed']:<6} "
+        f"rps={level['rps']:<9} p50={lat['p50']:<8} p95={lat['p95']:<8} p99={lat['p99']:<8} "
+        f"cpu={level['cpu_ms_per_request']}ms 5xx={level['server_errors']}"
+    )
+    if "db" in level:
+        db = level["db"]
+        line += (
+            f" db_write_p99={db['write_statement_ms']['p99']} "
+            f"commit_p99={db['commit_ms']['p99']} locked={db['locked_errors']}"
+        )
+    print(line, file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default="generate,usage,tokens_validate,webhook",
+                        help=f"comma separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per level")
+    parser.add_argument("--duration", type=float, default=0.0,
+                        help="seconds per level (overrides --requests when set)")
+    parser.add_argument("--warmup", type=int, default=10, help="warmup requests per level")
+    parser.add_argument("--seed-devices", type=int, default=20,
+                        help="devices given a paid token before read scenarios")
+    parser.add_argument("--target", default="", help="base URL of a running server")
+    parser.add_argument("--webhook-secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--upstream-latency", default="lognormal:0.05:0.5")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--upstream-payload", default="url", help="url | b64:<bytes>")
+    parser.add_argument("--creem-latency", default="fixed:0.05")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="-", help="JSON output path, '-' for stdout")
+    args = parser.parse_args(argv)
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c]
+    if args.duration:
+        args.requests = 0
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Cold-start benchmark: import time and lifespan startup phases.
+
+Each sample is a fresh interpreter that imports ``app.main`` and runs the
+lifespan startup (then shutdown) against a throwaway SQLite file, with the
+fake upstream as the only upstream. The first start on a new database runs
+the DDL ("cold"); later starts find the schema fingerprint and skip it
+("warm"). ``--seed-devices`` fills the database first so deferred cache
+loads have something to scan.
+
+    python -m benchmarks.startup --runs 5 --seed-devices 50000 --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.load import BACKEND_DIR, _git_commit, _subprocess_server
+from benchmarks.stats import summarize
+
+CHILD_FLAG = "--child"
+
+
+async def _child_startup() -> dict:
+    started = time.perf_counter()
+    from app.main import app, startup_phases
+    imported = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+    return {
+        "import_s": imported - started,
+        "startup_s": ready - imported,
+        "phases": dict(startup_phases),
+    }
+
+
+async def _child_seed(devices: int):
+    from datetime import timedelta
+    from app.core.database import async_session, init_db
+    from app.models import FreeTrialUsage, ImageGeneration
+
+    await init_db()
+    now = datetime.utcnow()
+    async with async_session() as db:
+        for start in range(0, devices, 5000):
+            ids = range(start, min(start + 5000, devices))
+            db.add_all(FreeTrialUsage(device_id=f"seed-{i}", used_count=1) for i in ids)
+            db.add_all(
+                ImageGeneration(
+                    device_id=f"seed-{i}", prompt=f"seed prompt {i}", model="dall-e-3",
+                    status="completed", image_url=f"https://example.com/{i}.png",
+                    created_at=now - timedelta(seconds=i),
+                )
+                for i in ids
+            )
+            await db.commit()
+
+
+def _run_child(env: dict, *args: str) -> str:
+    return subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.startup", CHILD_FLAG, *args],
+        cwd=BACKEND_DIR, env=env, text=True, stderr=subprocess.DEVNULL,
+    )
+
+
+def _summarize(samples: list[dict]) -> dict:
+    phases = sorted({name for s in samples for name in s["phases"]})
+    return {
+        "runs": len(samples),
+        "import_ms": summarize([s["import_s"] for s in samples]),
+        "startup_ms": summarize([s["startup_s"] for s in samples]),
+        "phases_ms": {
+            name: summarize([s["phases"][name] for s in samples if name in s["phases"]])
+            for name in phases
+        },
+    }
+
+
+async def run(args) -> dict:
+    async with AsyncExitStack() as stack:
+        upstream_url = await stack.enter_async_context(
+            _subprocess_server("benchmarks.fake_upstream", "--latency", "fixed:0")
+        )
+        workdir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="startup-")))
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite+aiosqlite:///{workdir / 'startup.db'}",
+            "ARCHIVE_DATABASE_URL": f"sqlite+aiosqlite:///{workdir / 'archive.db'}",
+            "LLM_PROXY_URL": upstream_url,
+            "LLM_PROXY_KEY": "bench",
+            "STARTUP_DEFER_CACHES": str(not args.eager_caches).lower(),
+        }
+        cold = json.loads(_run_child(env, "startup"))
+        if args.seed_devices:
+            _run_child(env, "seed", str(args.seed_devices))
+        warm = [json.loads(_run_child(env, "startup")) for _ in range(args.runs)]
+
+    return {
+        "meta": {
+            "git_commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": [
+            {"scenario": "cold", **_summarize([cold])},
+            {"scenario": "warm", **_summarize(warm)},
+        ],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="warm starts to sample")
+    parser.add_argument("--seed-devices", type=int, default=0,
+                        help="devices/generations inserted before the warm starts")
+    parser.add_argument("--eager-caches", action="store_true",
+                        help="load lookup caches before ready (STARTUP_DEFER_CACHES=false)")
+    parser.add_argument("--output", default="-", help="JSON output path, '-' for stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == CHILD_FLAG:
+        if argv[1] == "seed":
+            asyncio.run(_child_seed(int(argv[2])))
+        else:
+            print(json.dumps(asyncio.run(_child_startup())))
+        return
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    for result in report["results"]:
+        print(
+            f"{result['scenario']:<5} import_p50={result['import_ms']['p50']}ms "
+            f"startup_p50={result['startup_ms']['p50']}ms "
+            + " ".join(f"{k}={v['p50']}ms" for k, v in result["phases_ms"].items()),
+            file=sys.stderr,
+        )
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
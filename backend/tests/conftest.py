@@ -6,7 +6,17 @@ from httpx import AsyncClient, ASGITransport
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 
 from app.main import app
-from app.core.database import Base, get_db
+from app.services.drain import generation_drain
+from app.services.idempotency import pending_keys
+from app.services.known_ids import known_ids
+from app.services.similar_prompts import prompt_index
+from app.services.token_cache import token_cache
+from app.services.upstreams import upstream_pool
+from app.services.webhook_inbox import processed_checkouts
+from app.core.database import Base, get_archive_sessionmaker, get_db, get_sessionmaker
+from app.core.admission import generate_admission
+from app.core.ratelimit import generate_limiter
+from app.models.archive import ArchiveBase
 
 
 # Test database URL
@@ -15,6 +25,10 @@ TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 # Create test engine
 test_engine = create_async_engine(TEST_DATABASE_URL, echo=False)
 test_async_session = async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+test_archive_engine = create_async_engine(TEST_DATABASE_URL, echo=False)
+test_archive_session = async_sessionmaker(
+    test_archive_engine, class_=AsyncSession, expire_on_commit=False
+)
 
 
 async def override_get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -39,12 +53,31 @@ async def setup_database():
     yield
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
+    async with test_archive_engine.begin() as conn:
+        await conn.run_sync(ArchiveBase.metadata.drop_all)
+
+
+@pytest.fixture(autouse=True)
+def reset_in_process_state():
+    """Clear in-process caches so tests stay independent."""
+    processed_checkouts.clear()
+    token_cache.clear()
+    known_ids.disable()
+    generate_limiter.clear()
+    generate_admission.reset()
+    prompt_index.clear()
+    upstream_pool.reset()
+    generation_drain.reset()
+    pending_keys.clear()
+    yield
 
 
 @pytest.fixture
 async def client() -> AsyncGenerator[AsyncClient, None]:
     """Create test client."""
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_sessionmaker] = lambda: test_async_session
+    app.dependency_overrides[get_archive_sessionmaker] = lambda: test_archive_session
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         yield ac
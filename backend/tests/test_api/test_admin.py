@@ -0,0 +1,159 @@
+"""Tests for admin profiling endpoints."""
+import asyncio
+import pytest
+from httpx import AsyncClient
+
+from app.core.config import settings
+from app.core.profiling import cpu_accounting, profiler
+
+
+@pytest.fixture
+def admin_headers():
+    """Enable the admin surface for one test."""
+    original_key = settings.ADMIN_API_KEY
+    settings.ADMIN_API_KEY = "test_admin_key"
+    yield {"X-Admin-Key": "test_admin_key"}
+    settings.ADMIN_API_KEY = original_key
+    profiler.stop()
+    cpu_accounting.disable()
+    cpu_accounting.reset()
+
+
+@pytest.mark.asyncio
+async def test_admin_disabled_without_key(client: AsyncClient):
+    """Admin endpoints do not exist when ADMIN_API_KEY is unset."""
+    response = await client.get("/api/v1/admin/tasks", headers={"X-Admin-Key": ""})
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_admin_rejects_wrong_key(client: AsyncClient, admin_headers):
+    """Wrong admin key is rejected."""
+    response = await client.get("/api/v1/admin/tasks", headers={"X-Admin-Key": "nope"})
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_profile_time_window(client: AsyncClient, admin_headers):
+    """A timed profile collects folded stacks and stops on its own."""
+    response = await client.post(
+        "/api/v1/admin/profile/start",
+        json={"seconds": 0.1, "interval_ms": 1},
+        headers=admin_headers,
+    )
+    assert response.status_code == 200
+    assert response.json()["running"] == True
+
+    conflict = await client.post(
+        "/api/v1/admin/profile/start", json={"seconds": 1}, headers=admin_headers
+    )
+    assert conflict.status_code == 409
+
+    await asyncio.sleep(0.3)
+    status = (await client.get("/api/v1/admin/profile", headers=admin_headers)).json()
+    assert status["running"] == False
+    assert status["samples"] > 0
+
+    folded = await client.get("/api/v1/admin/profile/folded", headers=admin_headers)
+    line = folded.text.splitlines()[0]
+    stack, count = line.rsplit(" ", 1)
+    assert stack.startswith("thread:")
+    assert int(count) > 0
+
+
+@pytest.mark.asyncio
+async def test_profile_next_n_requests(client: AsyncClient, admin_headers):
+    """A request-bounded profile stops after N non-admin requests."""
+    response = await client.post(
+        "/api/v1/admin/profile/start", json={"requests": 2}, headers=admin_headers
+    )
+    assert response.json()["remaining_requests"] == 2
+
+    await client.get("/health")
+    status = (await client.get("/api/v1/admin/profile", headers=admin_headers)).json()
+    assert status["remaining_requests"] == 1
+
+    await client.get("/health")
+    await asyncio.sleep(0.05)
+    status = (await client.get("/api/v1/admin/profile", headers=admin_headers)).json()
+    assert status["remaining_requests"] == 0
+    assert status["running"] == False
+
+
+@pytest.mark.asyncio
+async def test_task_dump(client: AsyncClient, admin_headers):
+    """Task dump lists running tasks with await chains."""
+    response = await client.get("/api/v1/admin/tasks", headers=admin_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] >= 1
+    assert all("stack" in task for task in data["tasks"])
+
+
+@pytest.mark.asyncio
+async def test_per_route_cpu(client: AsyncClient, admin_headers):
+    """Per-route CPU accounting groups by route template and counts DB time."""
+    response = await client.put("/api/v1/admin/cpu?enabled=true", headers=admin_headers)
+    assert response.json()["enabled"] == True
+
+    await client.get("/api/v1/usage/cpu-device-1")
+    await client.get("/api/v1/usage/cpu-device-2")
+
+    report = (await client.get("/api/v1/admin/cpu", headers=admin_headers)).json()
+    usage = report["routes"]["GET /api/v1/usage/{device_id}"]
+    assert usage["requests"] == 2
+    assert usage["cpu_seconds"] > 0
+    assert usage["db_statements"] > 0
+
+    await client.put("/api/v1/admin/cpu?enabled=false", headers=admin_headers)
+    await client.get("/api/v1/usage/cpu-device-3")
+    report = (await client.get("/api/v1/admin/cpu", headers=admin_headers)).json()
+    assert report["routes"]["GET /api/v1/usage/{device_id}"]["requests"] == 2
+
+
+@pytest.mark.asyncio
+async def test_export_streams_time_range(client: AsyncClient, admin_headers, db):
+    """Exports honour the created_at range and span several read windows."""
+    import csv
+    import io
+    import json
+    from datetime import datetime, timedelta
+    from app.models import ImageGeneration
+
+    base = datetime(2025, 3, 1)
+    db.add_all(
+        ImageGeneration(
+            id=f"exp-{i:02d}", device_id="export-device", prompt=f"p{i}", model="dall-e-3",
+            status="completed", created_at=base + timedelta(hours=i),
+        )
+        for i in range(10)
+    )
+    await db.commit()
+
+    original = settings.EXPORT_WINDOW_ROWS, settings.EXPORT_BATCH_SIZE
+    settings.EXPORT_WINDOW_ROWS, settings.EXPORT_BATCH_SIZE = 3, 2
+    try:
+        params = {"since": (base + timedelta(hours=2)).isoformat() + "Z",
+                  "until": (base + timedelta(hours=9)).isoformat()}
+        response = await client.get(
+            "/api/v1/admin/export/generations", params=params, headers=admin_headers
+        )
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["id"] for r in rows] == [f"exp-{i:02d}" for i in range(2, 9)]
+        assert rows[0]["created_at"] == "2025-03-01T02:00:00"
+
+        response = await client.get(
+            "/api/v1/admin/export/generations",
+            params={**params, "format": "csv"}, headers=admin_headers,
+        )
+        records = list(csv.DictReader(io.StringIO(response.text)))
+        assert [r["id"] for r in records] == [f"exp-{i:02d}" for i in range(2, 9)]
+        assert records[0]["prompt"] == "p2"
+
+        empty = await client.get(
+            "/api/v1/admin/export/transactions", params={"format": "csv"}, headers=admin_headers
+        )
+        assert empty.text.startswith("id,token_id,")
+    finally:
+        settings.EXPORT_WINDOW_ROWS, settings.EXPORT_BATCH_SIZE = original
@@ -155,3 +155,134 @@ async def test_402_error_detail_is_serializable(client: AsyncClient):
                 f"Object detail must have 'error' or 'message' field: {detail}"
         else:
             assert isinstance(detail, str), f"detail must be string or object with error field: {detail}"
+
+
+@pytest.mark.asyncio
+async def test_generate_rate_limited_per_device(client: AsyncClient):
+    """A device over its burst gets 429 + Retry-After before any DB work."""
+    from app.core.config import settings
+
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/image.png"}
+        statuses = []
+        for i in range(int(settings.RATE_LIMIT_FREE_BURST)):
+            response = await client.post(
+                "/api/v1/generate", json={"prompt": f"p{i}", "device_id": "burst-device"}
+            )
+            statuses.append(response.status_code)
+        assert 429 not in statuses
+
+        with patch("app.api.v1.generate.select") as mock_select:
+            response = await client.post(
+                "/api/v1/generate", json={"prompt": "again", "device_id": "burst-device"}
+            )
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.json()["detail"]["code"] == "rate_limited"
+        mock_select.assert_not_called()
+
+        # Other devices are unaffected.
+        response = await client.post(
+            "/api/v1/generate", json={"prompt": "hi", "device_id": "other-device"}
+        )
+        assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_forged_legacy_token_gets_free_rate_limit(client: AsyncClient):
+    """A well-formed but unknown tok_ token does not unlock the paid tier."""
+    from app.core.config import settings
+
+    forged = "tok_" + "a" * 32
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/image.png"}
+        statuses = []
+        for i in range(int(settings.RATE_LIMIT_FREE_BURST) + 1):
+            response = await client.post(
+                "/api/v1/generate",
+                json={"prompt": f"p{i}", "device_id": "forged-device", "token": forged},
+            )
+            statuses.append(response.status_code)
+    assert settings.RATE_LIMIT_FREE_BURST < settings.RATE_LIMIT_PAID_BURST
+    assert 429 not in statuses[:-1]
+    assert statuses[-1] == 429
+
+
+@pytest.mark.asyncio
+async def test_cached_token_gets_paid_tier(db):
+    """A token this worker has seen and that is still usable counts as paid."""
+    from app.core.ratelimit import token_confirmed
+    from app.models import GenerationToken
+    from app.services.token_cache import token_cache
+
+    token = GenerationToken.create_token("starter_10", 1, device_id="paid-device")
+    assert token_confirmed(token.token) == False
+    db.add(token)
+    await db.commit()
+    token_cache.put(token)
+    assert token_confirmed(token.token) == True
+
+    token.remaining_generations = 0
+    token_cache.put(token)
+    assert token_confirmed(token.token) == False
+
+
+@pytest.mark.asyncio
+async def test_generate_cancelled_on_disconnect_refunds(client: AsyncClient):
+    """A client disconnect cancels the upstream call and refunds the trial."""
+    import asyncio
+    from app.core.metrics import generations_cancelled, TOOL_NAME
+
+    upstream_cancelled = asyncio.Event()
+
+    async def slow_generate(*args, **kwargs):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            upstream_cancelled.set()
+            raise
+
+    cancelled = generations_cancelled.labels(tool=TOOL_NAME, reason="client_disconnect")
+    before = cancelled._value.get()
+    with patch("app.api.v1.generate.generate_image", side_effect=slow_generate), \
+            patch("app.api.v1.generate.settings.DISCONNECT_POLL_SECONDS", 0.01), \
+            patch("starlette.requests.Request.is_disconnected", new_callable=AsyncMock) as gone:
+        gone.return_value = True
+        response = await client.post(
+            "/api/v1/generate",
+            json={"prompt": "A slow painting", "device_id": "test-device-disconnect"},
+        )
+
+    assert response.status_code == 499
+    assert upstream_cancelled.is_set()
+    assert cancelled._value.get() == before + 1
+    usage = await client.get("/api/v1/usage/test-device-disconnect")
+    assert usage.json()["free_remaining"] == 3
+
+
+@pytest.mark.asyncio
+async def test_generate_spends_soonest_expiring_device_token(client: AsyncClient, db):
+    """With several paid tokens and none given, the first to expire is used."""
+    from datetime import datetime, timedelta
+    from app.models import GenerationToken
+
+    later = GenerationToken.create_token("starter_10", 5, device_id="two-token-device")
+    sooner = GenerationToken.create_token("starter_10", 2, device_id="two-token-device")
+    sooner.expires_at = datetime.utcnow() + timedelta(days=1)
+    db.add_all([later, sooner])
+    await db.commit()
+
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        response = await client.post(
+            "/api/v1/generate",
+            json={"prompt": "A cat", "device_id": "two-token-device"},
+        )
+
+    data = response.json()
+    assert data["is_free_trial"] == False
+    assert data["remaining_generations"] == 1
+    usage = (await client.get("/api/v1/usage/two-token-device")).json()
+    assert usage["paid_remaining"] == 6
+    info = (await client.get(f"/api/v1/tokens/info/{later.token}")).json()
+    assert info["remaining_generations"] == 5
@@ -0,0 +1,91 @@
+"""Tests for generation history."""
+import pytest
+from datetime import datetime, timedelta
+from httpx import AsyncClient
+
+from app.models import ImageGeneration
+from app.services.known_ids import known_ids
+from tests import conftest
+
+
+async def _add_history(db, device_id: str, count: int) -> list[ImageGeneration]:
+    base = datetime(2025, 1, 1)
+    rows = [
+        ImageGeneration(
+            id=f"gen-{i:03d}",
+            device_id=device_id,
+            prompt=f"prompt {i}",
+            model="dall-e-3",
+            status="completed" if i % 2 else "failed",
+            error_message=None if i % 2 else "upstream error",
+            image_url=f"https://example.com/{i}.png" if i % 2 else None,
+            # Pairs share a timestamp so the id tie-breaker matters.
+            created_at=base + timedelta(minutes=i // 2),
+        )
+        for i in range(count)
+    ]
+    db.add_all(rows)
+    db.add(ImageGeneration(device_id="someone-else", prompt="x", model="dall-e-3", created_at=base))
+    await db.commit()
+    return rows
+
+
+@pytest.mark.asyncio
+async def test_history_keyset_pages(client: AsyncClient, db):
+    """Pages walk the history newest first without gaps or repeats."""
+    await _add_history(db, "history-device", 5)
+
+    seen, cursor = [], None
+    while True:
+        params = {"device_id": "history-device", "limit": 2}
+        if cursor:
+            params["after"] = cursor
+        page = (await client.get("/api/v1/generations", params=params)).json()
+        seen += [item["id"] for item in page["items"]]
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+
+    assert seen == ["gen-004", "gen-003", "gen-002", "gen-001", "gen-000"]
+    assert "prompt" not in page["items"][0]
+    assert "error_message" not in page["items"][0]
+
+
+@pytest.mark.asyncio
+async def test_history_include_and_validation(client: AsyncClient, db):
+    """Optional fields are opt-in; bad input is rejected."""
+    await _add_history(db, "history-device", 2)
+    response = await client.get(
+        "/api/v1/generations",
+        params={"device_id": "history-device", "include": "prompt,error_message"},
+    )
+    items = response.json()["items"]
+    assert items[0]["prompt"] == "prompt 1"
+    assert items[1]["error_message"] == "upstream error"
+    assert "next_cursor" not in response.json()
+
+    bad_include = await client.get(
+        "/api/v1/generations", params={"device_id": "history-device", "include": "model"}
+    )
+    assert bad_include.status_code == 400
+    bad_cursor = await client.get(
+        "/api/v1/generations", params={"device_id": "history-device", "after": "nope"}
+    )
+    assert bad_cursor.status_code == 400
+    too_big = await client.get(
+        "/api/v1/generations", params={"device_id": "history-device", "limit": 1000}
+    )
+    assert too_big.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_history_of_device_unknown_to_the_id_filter(client: AsyncClient, db):
+    """A device that only generated with a token bought elsewhere still has history."""
+    await _add_history(db, "borrowed-token-device", 2)
+    await known_ids.load(conftest.test_async_session)
+    assert known_ids.device_missing("borrowed-token-device")
+
+    response = await client.get(
+        "/api/v1/generations", params={"device_id": "borrowed-token-device"}
+    )
+    assert [item["id"] for item in response.json()["items"]] == ["gen-001", "gen-000"]
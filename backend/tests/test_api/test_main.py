@@ -46,6 +46,34 @@ async def test_get_products(client: AsyncClient):
         assert "generations" in product
 
 
+@pytest.mark.asyncio
+async def test_get_products_etag(client: AsyncClient):
+    """The catalog carries a strong ETag and revalidates with 304."""
+    response = await client.get("/api/v1/payment/products")
+    etag = response.headers["ETag"]
+    assert etag.startswith('"') and "max-age" in response.headers["Cache-Control"]
+
+    cached = await client.get("/api/v1/payment/products", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+
+    stale = await client.get("/api/v1/payment/products", headers={"If-None-Match": '"stale"'})
+    assert stale.status_code == 200
+
+
+def test_product_catalog_discounts():
+    """Discounts are relative to the most expensive per-unit price."""
+    from app.api.v1.payment import build_product_catalog
+
+    catalog = build_product_catalog({
+        "one": {"price": 100, "generations": 1},
+        "ten": {"price": 500, "generations": 10},
+    })
+    assert [p.discount_percent for p in catalog] == [None, 50]
+    assert build_product_catalog({"one": {"price": 100, "generations": 1}})[0].discount_percent is None
+
+
 @pytest.mark.asyncio
 async def test_get_usage_new_device(client: AsyncClient):
     """Test get usage for new device."""
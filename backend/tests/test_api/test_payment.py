@@ -47,9 +47,10 @@ async def test_webhook_missing_signature(client: AsyncClient):
 
 
 @pytest.mark.asyncio
-async def test_webhook_checkout_completed(client: AsyncClient):
+async def test_webhook_checkout_completed(client: AsyncClient, db):
     """Test webhook processes checkout.completed correctly."""
     from app.core.config import settings
+    from app.services.webhook_inbox import process_inbox_batch
     
     # Set test webhook secret
     original_secret = settings.CREEM_WEBHOOK_SECRET
@@ -91,6 +92,9 @@ async def test_webhook_checkout_completed(client: AsyncClient):
         assert response.status_code == 200
         assert response.json()["received"] == True
         
+        # Tokens are minted by the inbox consumer after the ack
+        assert await process_inbox_batch(db) == 1
+        
         # Verify token was created
         token_response = await client.get(
             "/api/v1/tokens/by-device/webhook-test-device"
@@ -139,3 +143,161 @@ async def test_create_checkout_success(client: AsyncClient):
             assert "session_id" in data
     finally:
         settings.CREEM_PRODUCT_IDS = original_ids
+
+
+def _signed_checkout_event(checkout_id: str, device_id: str, secret: str) -> tuple[bytes, str]:
+    """Build a signed checkout.completed payload."""
+    event = {
+        "eventType": "checkout.completed",
+        "object": {
+            "id": checkout_id,
+            "metadata": {
+                "product_sku": "pro_50",
+                "device_id": device_id,
+                "generations": "50"
+            },
+            "customer": {"email": "replay@example.com"},
+            "order": {"amount": 999, "currency": "usd"}
+        }
+    }
+    payload = json.dumps(event).encode()
+    return payload, hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
+
+
+@pytest.fixture
+def webhook_secret():
+    """Configure a webhook secret for one test."""
+    from app.core.config import settings
+
+    original_secret = settings.CREEM_WEBHOOK_SECRET
+    settings.CREEM_WEBHOOK_SECRET = "test_webhook_secret"
+    yield settings.CREEM_WEBHOOK_SECRET
+    settings.CREEM_WEBHOOK_SECRET = original_secret
+
+
+@pytest.mark.asyncio
+async def test_webhook_replay_is_acknowledged(client: AsyncClient, db, webhook_secret):
+    """A redelivered event returns 200 and does not mint a second token."""
+    from app.services.webhook_inbox import process_inbox_batch
+
+    payload, signature = _signed_checkout_event("checkout_replay", "replay-device", webhook_secret)
+    headers = {"creem-signature": signature}
+
+    first = await client.post("/api/v1/webhooks/creem", content=payload, headers=headers)
+    assert first.status_code == 200
+    assert "duplicate" not in first.json()
+
+    second = await client.post("/api/v1/webhooks/creem", content=payload, headers=headers)
+    assert second.status_code == 200
+    assert second.json()["duplicate"] == True
+
+    assert await process_inbox_batch(db) == 1
+    third = await client.post("/api/v1/webhooks/creem", content=payload, headers=headers)
+    assert third.json()["duplicate"] == True
+    assert await process_inbox_batch(db) == 0
+
+    tokens = (await client.get("/api/v1/tokens/by-device/replay-device")).json()["tokens"]
+    assert len(tokens) == 1
+
+
+@pytest.mark.asyncio
+async def test_inbox_dedupes_checkout_across_events(client: AsyncClient, db, webhook_secret):
+    """Distinct events for one checkout mint once, via the cache or the DB."""
+    from app.services.webhook_inbox import process_inbox_batch, processed_checkouts
+
+    for event_id in ("evt_1", "evt_2"):
+        payload, signature = _signed_checkout_event("checkout_multi", "multi-device", webhook_secret)
+        event = json.loads(payload)
+        event["id"] = event_id
+        payload = json.dumps(event).encode()
+        signature = hmac.new(webhook_secret.encode(), payload, hashlib.sha256).hexdigest()
+        response = await client.post(
+            "/api/v1/webhooks/creem", content=payload, headers={"creem-signature": signature}
+        )
+        assert "duplicate" not in response.json()
+        if event_id == "evt_1":
+            assert await process_inbox_batch(db) == 1
+            processed_checkouts.clear()  # Force the indexed DB check
+
+    assert await process_inbox_batch(db) == 1
+    tokens = (await client.get("/api/v1/tokens/by-device/multi-device")).json()["tokens"]
+    assert len(tokens) == 1
+
+
+@pytest.mark.asyncio
+async def test_inbox_skips_bad_events(client: AsyncClient, db, webhook_secret):
+    """Unusable events are marked failed without blocking good ones."""
+    from sqlalchemy import select
+    from app.models import WebhookInbox
+    from app.services.webhook_inbox import process_inbox_batch
+
+    bad = {"eventType": "checkout.completed", "object": {"id": "checkout_bad", "metadata": {}}}
+    payload = json.dumps(bad).encode()
+    signature = hmac.new(webhook_secret.encode(), payload, hashlib.sha256).hexdigest()
+    await client.post("/api/v1/webhooks/creem", content=payload, headers={"creem-signature": signature})
+    payload, signature = _signed_checkout_event("checkout_good", "good-device", webhook_secret)
+    await client.post("/api/v1/webhooks/creem", content=payload, headers={"creem-signature": signature})
+
+    assert await process_inbox_batch(db) == 2
+    rows = (await db.execute(select(WebhookInbox).order_by(WebhookInbox.id))).scalars().all()
+    assert [r.status for r in rows] == ["failed", "done"]
+    tokens = (await client.get("/api/v1/tokens/by-device/good-device")).json()["tokens"]
+    assert len(tokens) == 1
+
+
+@pytest.mark.asyncio
+async def test_webhook_concurrent_redelivery_mints_once(tmp_path, webhook_secret):
+    """Many parallel deliveries and consumers of one event mint exactly one token."""
+    import asyncio
+    from httpx import ASGITransport
+    from sqlalchemy import func, select
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+    from app.main import app
+    from app.core.database import Base, get_db
+    from app.models import GenerationToken, PaymentTransaction
+    from app.services.webhook_inbox import process_inbox_batch
+
+    # A file database gives each session its own connection, like production.
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'stress.db'}")
+    sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async def file_get_db():
+        async with sessions() as session:
+            yield session
+
+    async def consume():
+        async with sessions() as session:
+            return await process_inbox_batch(session)
+
+    app.dependency_overrides[get_db] = file_get_db
+    payload, signature = _signed_checkout_event("checkout_stress", "stress-device", webhook_secret)
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            responses = await asyncio.gather(*(
+                ac.post("/api/v1/webhooks/creem", content=payload,
+                        headers={"creem-signature": signature})
+                for _ in range(25)
+            ))
+    finally:
+        app.dependency_overrides.clear()
+
+    assert all(r.status_code == 200 for r in responses)
+    assert sum(1 for r in responses if not r.json().get("duplicate")) == 1
+
+    # Separate events for the same checkout, drained by competing consumers
+    async with sessions() as session:
+        from app.services.webhook_inbox import append_event
+        for i in range(5):
+            event = json.loads(payload)
+            event["id"] = f"evt_stress_{i}"
+            await append_event(session, event, json.dumps(event).encode())
+    await asyncio.gather(*(consume() for _ in range(4)))
+
+    async with sessions() as session:
+        token_count = await session.scalar(select(func.count()).select_from(GenerationToken))
+        txn_count = await session.scalar(select(func.count()).select_from(PaymentTransaction))
+    await engine.dispose()
+    assert token_count == 1
+    assert txn_count == 1
@@ -0,0 +1,52 @@
+"""Tests for bulk token validation."""
+import pytest
+from datetime import datetime, timedelta
+from httpx import AsyncClient
+
+from app.core.config import settings
+from app.models import GenerationToken
+
+
+@pytest.fixture
+def small_chunks():
+    """Force several IN (...) chunks per request."""
+    original_size = settings.BULK_VALIDATE_CHUNK_SIZE
+    settings.BULK_VALIDATE_CHUNK_SIZE = 2
+    yield
+    settings.BULK_VALIDATE_CHUNK_SIZE = original_size
+
+
+@pytest.mark.asyncio
+async def test_bulk_validate(client: AsyncClient, db, small_chunks):
+    """Tokens and devices resolve in request order across chunks."""
+    tokens = [GenerationToken.create_token("starter_10", 10, device_id=f"bulk-{i}") for i in range(3)]
+    tokens[1].remaining_generations = 0
+    tokens[2].expires_at = datetime.utcnow() - timedelta(days=1)
+    db.add_all(tokens)
+    await db.commit()
+
+    bogus = f"tok_{'f' * 32}"
+    response = await client.post("/api/v1/tokens/validate/bulk", json={
+        "tokens": [tokens[0].token, bogus, tokens[1].token, tokens[2].token, tokens[0].token, "junk"],
+        "device_ids": ["bulk-0", "nobody"],
+    })
+    assert response.status_code == 200
+    results = response.json()["results"]
+
+    assert [r.get("token") for r in results[:5]] == [
+        tokens[0].token, bogus, tokens[1].token, tokens[2].token, "junk"
+    ]
+    assert [r["valid"] for r in results[:5]] == [True, False, False, False, False]
+    assert results[0]["remaining_generations"] == 10
+    assert results[0]["expires_at"] == tokens[0].expires_at.isoformat()
+    assert results[1]["found"] == False
+    assert results[5] == {**results[0], "device_id": "bulk-0"}
+    assert results[6] == {"device_id": "nobody", "found": False, "valid": False}
+
+
+@pytest.mark.asyncio
+async def test_bulk_validate_limit(client: AsyncClient):
+    """Requests above BULK_VALIDATE_MAX_ITEMS are rejected."""
+    tokens = [f"tok_{i:032x}" for i in range(settings.BULK_VALIDATE_MAX_ITEMS + 1)]
+    response = await client.post("/api/v1/tokens/validate/bulk", json={"tokens": tokens})
+    assert response.status_code == 400
@@ -0,0 +1,85 @@
+"""Tests for CoDel-style admission control."""
+import pytest
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+
+from app.core.admission import AdmissionController, generate_admission
+
+
+def make_controller():
+    controller = AdmissionController()
+    controller.configure("paid", target=10.0, interval=2.0, max_in_flight=4)
+    controller.configure("free", target=2.0, interval=2.0, max_in_flight=3)
+    return controller
+
+
+def test_sheds_free_before_paid():
+    """Sojourn above the free target for an interval sheds only free traffic."""
+    controller = make_controller()
+    controller.observe("free", 3.0, now=0.0)
+    controller.observe("free", 3.0, now=1.0)
+    assert controller.rejection("free", now=1.0) is None  # Interval not elapsed yet
+    controller.observe("free", 3.0, now=2.0)
+    assert controller.rejection("free", now=2.0) == "delay"
+    assert controller.rejection("paid", now=2.0) is None
+
+    controller.observe("free", 0.5, now=3.0)
+    assert controller.rejection("free", now=3.0) is None
+
+    controller.observe("paid", 12.0, now=4.0)
+    controller.observe("paid", 12.0, now=6.0)
+    assert controller.rejection("paid", now=6.0) == "delay"
+    controller.queue_drained()
+    assert controller.rejection("paid", now=6.0) is None
+
+
+def test_shedding_ends_after_an_interval_without_long_sojourns():
+    """Nothing queues while shedding, so silence for an interval ends it."""
+    controller = make_controller()
+    for now in (0.0, 1.0, 2.0):
+        controller.observe("free", 3.0, now=now)
+    assert controller.rejection("free", now=3.9) == "delay"
+    assert controller.rejection("free", now=4.0) is None
+
+
+def test_sojourns_only_feed_their_own_class():
+    """Long free waits do not shed paid traffic, and short paid waits do not
+    end free shedding."""
+    controller = make_controller()
+    for now in (0.0, 1.0, 2.0, 3.0):
+        controller.observe("free", 15.0, now=now)
+        controller.observe("paid", 0.1, now=now + 0.5)
+    assert controller.rejection("free", now=3.5) == "delay"
+    assert controller.rejection("paid", now=3.5) is None
+
+
+def test_in_flight_caps_free_first():
+    controller = make_controller()
+    controller.in_flight = 3
+    assert controller.rejection("free") == "in_flight"
+    assert controller.rejection("paid") is None
+    controller.in_flight = 4
+    assert controller.rejection("paid") == "in_flight"
+
+
+@pytest.mark.asyncio
+async def test_generate_sheds_free_with_fast_503(client: AsyncClient):
+    """A shed request gets 503 + Retry-After before any DB work."""
+    generate_admission.detectors["free"].shedding = True
+    with patch("app.api.v1.generate.select") as mock_select:
+        response = await client.post(
+            "/api/v1/generate", json={"prompt": "hi", "device_id": "shed-device"}
+        )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    assert response.json()["detail"]["code"] == "overloaded"
+    mock_select.assert_not_called()
+
+    generate_admission.detectors["free"].shedding = False
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/image.png"}
+        response = await client.post(
+            "/api/v1/generate", json={"prompt": "hi", "device_id": "shed-device"}
+        )
+    assert response.status_code == 200
+    assert generate_admission.in_flight == 0
@@ -0,0 +1,27 @@
+"""Tests for database startup helpers."""
+import pytest
+from unittest.mock import patch
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.database import init_db
+
+
+@pytest.mark.asyncio
+async def test_init_db_skips_ddl_when_schema_matches():
+    """DDL runs on a new database and again only when the models change."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    try:
+        assert await init_db(engine) is True
+        async with engine.connect() as conn:
+            tables = await conn.run_sync(lambda c: inspect(c).get_table_names())
+        assert {"image_generations", "schema_version"} <= set(tables)
+
+        with patch("app.core.database.Base.metadata.create_all") as create_all:
+            assert await init_db(engine) is False
+        create_all.assert_not_called()
+
+        with patch("app.core.database.schema_fingerprint", return_value="changed"):
+            assert await init_db(engine) is True
+    finally:
+        await engine.dispose()
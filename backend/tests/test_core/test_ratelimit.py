@@ -0,0 +1,35 @@
+"""Tests for the token-bucket rate limiter."""
+from app.core.ratelimit import BucketStore, RateLimiter
+
+
+def test_bucket_refills_over_time():
+    """Tokens refill at the configured rate up to the burst."""
+    store = BucketStore(rate=1.0, burst=2)
+    for _ in range(2):
+        assert store.wait_time("k", 0.0) == 0
+        store.take("k", 0.0)
+    assert store.wait_time("k", 0.0) == 1.0
+    assert store.wait_time("k", 0.5) == 0.5
+    assert store.wait_time("k", 1.0) == 0
+
+
+def test_limiter_takes_only_when_all_buckets_allow():
+    """A request rejected by one bucket leaves the others untouched."""
+    limiter = RateLimiter()
+    limiter.configure("ip", per_minute=60, burst=10, max_keys=100)
+    limiter.configure("device", per_minute=60, burst=1, max_keys=100)
+
+    assert limiter.acquire([("ip", "1.2.3.4"), ("device", "d")], now=0) == (0.0, None)
+    wait, limited_by = limiter.acquire([("ip", "1.2.3.4"), ("device", "d")], now=0)
+    assert limited_by == "device" and wait == 1.0
+    assert limiter.stores["ip"].wait_time("1.2.3.4", 0) == 0
+    assert limiter.stores["ip"]._tokens("1.2.3.4", 0) == 9
+
+
+def test_idle_keys_evicted():
+    """Shards are bounded; an evicted key starts again with a full bucket."""
+    store = BucketStore(rate=0.0, burst=1, shards=2, max_keys=4)
+    for i in range(50):
+        store.take(f"key-{i}", 0.0)
+    assert len(store) <= 4
+    assert store.wait_time("key-0", 0.0) == 0
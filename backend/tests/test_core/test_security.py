@@ -0,0 +1,79 @@
+"""Tests for self-validating tokens."""
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+
+from app.core.config import settings
+from app.core.security import sign_token, token_rejection
+from app.models import GenerationToken
+
+
+@pytest.fixture
+def signing_secret():
+    """Issue signed tokens for one test."""
+    original_secret = settings.TOKEN_SIGNING_SECRET
+    settings.TOKEN_SIGNING_SECRET = "test_signing_secret"
+    yield settings.TOKEN_SIGNING_SECRET
+    settings.TOKEN_SIGNING_SECRET = original_secret
+
+
+def test_signed_token_checks(signing_secret):
+    """Tampered, expired and malformed tokens are rejected offline."""
+    token_id = "3f2b8c1e-1d2a-4c6b-9e7f-0a1b2c3d4e5f"
+    token = sign_token(token_id, datetime.utcnow() + timedelta(days=1))
+    assert token.startswith("tks_3f2b8c1e1d2a4c6b9e7f0a1b2c3d4e5f.")
+    assert token_rejection(token) is None
+
+    head, expiry, sig = token.split(".")
+    assert token_rejection(f"{head}.{int(expiry) + 1}.{sig}") == "signature"
+    expired = sign_token(token_id, datetime.utcnow() - timedelta(seconds=1))
+    assert token_rejection(expired) == "expired"
+    assert token_rejection("'; DROP TABLE generation_tokens; --") == "malformed"
+    assert token_rejection("tok_" + "a" * 32) is None  # legacy: needs the DB
+
+    settings.TOKEN_SIGNING_SECRET = "rotated"
+    assert token_rejection(token) == "signature"
+    with patch.object(settings, "TOKEN_SIGNING_SECRETS", [signing_secret]):
+        assert token_rejection(token) is None
+
+    settings.TOKEN_SIGNING_SECRET = ""
+    assert token_rejection(token) is None  # Unverifiable: the DB decides
+
+
+@pytest.mark.asyncio
+async def test_old_token_redeems_after_secret_rotation(client: AsyncClient, db, signing_secret):
+    """Rotating the secret keeps tokens signed with a listed previous secret working."""
+    token = GenerationToken.create_token("starter_10", 10, device_id="rotation-device")
+    db.add(token)
+    await db.commit()
+    settings.TOKEN_SIGNING_SECRET = "new_signing_secret"
+
+    with patch.object(settings, "TOKEN_SIGNING_SECRETS", [signing_secret]), \
+            patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        response = await client.post("/api/v1/generate", json={
+            "prompt": "A cat", "device_id": "another-device", "token": token.token,
+        })
+    assert response.json()["is_free_trial"] == False
+    assert response.json()["remaining_generations"] == 9
+
+
+@pytest.mark.asyncio
+async def test_signed_token_endpoints(client: AsyncClient, db, signing_secret):
+    """Signed tokens work end to end; forged ones never reach the DB."""
+    token = GenerationToken.create_token("starter_10", 10, device_id="signed-device")
+    db.add(token)
+    await db.commit()
+    assert token.token.startswith("tks_" + token.id.replace("-", ""))
+
+    response = await client.post("/api/v1/tokens/validate", params={"token": token.token})
+    assert response.json()["valid"] == True
+
+    forged = token.token[:-1] + ("A" if token.token[-1] != "A" else "B")
+    with patch("app.services.token_cache.select") as mock_select:
+        response = await client.post("/api/v1/tokens/validate", params={"token": forged})
+        info = await client.get(f"/api/v1/tokens/info/{forged}")
+    assert response.json()["valid"] == False
+    assert info.status_code == 404
+    mock_select.assert_not_called()
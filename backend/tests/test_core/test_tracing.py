@@ -0,0 +1,116 @@
+"""Tests for request tracing."""
+import json
+import pytest
+import httpx
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+
+from app.core import tracing
+
+
+class CollectingExporter:
+    """Keep exported traces in memory."""
+
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append(list(spans))
+
+    def shutdown(self):
+        pass
+
+
+@pytest.fixture
+def exporter():
+    collecting = CollectingExporter()
+    tracing.set_exporter(collecting)
+    yield collecting
+    tracing.set_exporter(None)
+
+
+@pytest.mark.asyncio
+async def test_generate_phases_traced(client: AsyncClient, exporter):
+    """Each generate phase and DB statement becomes a span."""
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        response = await client.post(
+            "/api/v1/generate", json={"prompt": "A fox", "device_id": "trace-device"}
+        )
+
+    assert response.status_code == 200
+    trace_id = response.headers["X-Trace-Id"]
+    assert response.headers["traceparent"].startswith(f"00-{trace_id}-")
+
+    spans = exporter.traces[-1]
+    names = [s.name for s in spans]
+    for phase in ("token_lookup", "free_trial_lookup", "commit.reserve",
+                  "generate_image", "commit.settle", "db.statement"):
+        assert phase in names
+    root = next(s for s in spans if s.name == "POST /api/v1/generate")
+    assert root.attributes["http.status_code"] == 200
+    assert all(s.trace_id == trace_id for s in spans)
+    upstream = next(s for s in spans if s.name == "generate_image")
+    assert upstream.parent_id == root.span_id
+    assert upstream.attributes["success"] == True
+
+
+@pytest.mark.asyncio
+async def test_incoming_traceparent_continued(client: AsyncClient, exporter):
+    """An incoming W3C traceparent keeps its trace id."""
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    response = await client.get(
+        "/health", headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"}
+    )
+    assert response.headers["X-Trace-Id"] == trace_id
+    root = exporter.traces[-1][0]
+    assert root.parent_id == "00f067aa0ba902b7"
+
+
+@pytest.mark.asyncio
+async def test_tracing_disabled_adds_nothing(client: AsyncClient):
+    """Without an exporter there are no trace headers."""
+    response = await client.get("/health")
+    assert "X-Trace-Id" not in response.headers
+    assert tracing.httpx_event_hooks() == {}
+
+
+@pytest.mark.asyncio
+async def test_httpx_hooks_propagate_traceparent(exporter):
+    """Upstream requests carry the current trace id."""
+    seen = {}
+
+    def handler(request: httpx.Request):
+        seen["traceparent"] = request.headers.get("traceparent")
+        return httpx.Response(200, json={"ok": True})
+
+    root = tracing.start_trace("test")
+    with tracing._SpanScope(root):
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(handler), event_hooks=tracing.httpx_event_hooks()
+        ) as http:
+            await http.get("http://upstream.test/x")
+
+    assert seen["traceparent"].split("-")[1] == root.trace_id
+
+
+def test_otlp_file_exporter(tmp_path):
+    """The file exporter writes one OTLP/JSON document per trace."""
+    path = tmp_path / "traces.jsonl"
+    file_exporter = tracing.OTLPFileExporter(str(path), service_name="test-svc")
+    tracing.set_exporter(file_exporter)
+    try:
+        root = tracing.start_trace("root")
+        with tracing._SpanScope(root):
+            with tracing.span("child", step=1):
+                pass
+    finally:
+        tracing.set_exporter(None)
+
+    doc = json.loads(path.read_text().splitlines()[0])
+    resource_spans = doc["resourceSpans"][0]
+    assert resource_spans["resource"]["attributes"][0]["value"]["stringValue"] == "test-svc"
+    spans = resource_spans["scopeSpans"][0]["spans"]
+    assert {s["name"] for s in spans} == {"root", "child"}
+    child = next(s for s in spans if s["name"] == "child")
+    assert child["attributes"] == [{"key": "step", "value": {"intValue": "1"}}]
@@ -0,0 +1,96 @@
+"""Tests for compact device keys."""
+import pytest
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+from sqlalchemy import inspect, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.database import init_db
+from app.core.security import device_key
+from app.models import FreeTrialUsage, GenerationToken
+from app.models.device_key import device_is
+from app.services.device_keys import backfill_device_keys
+
+
+@pytest.mark.asyncio
+async def test_backfill_keys_existing_rows_once():
+    """Rows written before the secret was set get keys; later startups skip the scan."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    try:
+        await init_db(engine)
+        async with engine.begin() as conn:
+            await conn.execute(FreeTrialUsage.__table__.insert(), [
+                {"id": f"row-{i}", "device_id": f"device-{i}", "used_count": 1} for i in range(5)
+            ])
+        assert await backfill_device_keys(engine) == 0
+
+        with patch("app.core.config.settings.DEVICE_KEY_SECRET", "s3cret"), \
+                patch("app.core.config.settings.DEVICE_KEY_BACKFILL_BATCH_SIZE", 2):
+            assert await backfill_device_keys(engine) == 5
+            assert await backfill_device_keys(engine) == 0
+            async with engine.connect() as conn:
+                rows = (await conn.execute(
+                    select(FreeTrialUsage.device_id, FreeTrialUsage.device_key)
+                )).all()
+            assert all(row.device_key == device_key(row.device_id) for row in rows)
+
+        with patch("app.core.config.settings.DEVICE_KEY_SECRET", "rotated"):
+            assert await backfill_device_keys(engine) == 5
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_init_db_adds_device_key_to_existing_tables():
+    """Databases created before the column existed get it on the next startup."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    try:
+        async with engine.begin() as conn:
+            await conn.exec_driver_sql(
+                "CREATE TABLE free_trial_usage (id VARCHAR(36) PRIMARY KEY, "
+                "device_id VARCHAR(255) NOT NULL UNIQUE, used_count INTEGER, "
+                "first_used_at DATETIME, last_used_at DATETIME)"
+            )
+        await init_db(engine)
+        async with engine.connect() as conn:
+            columns = await conn.run_sync(
+                lambda c: {col["name"] for col in inspect(c).get_columns("free_trial_usage")}
+            )
+            indexes = await conn.run_sync(
+                lambda c: {ix["name"] for ix in inspect(c).get_indexes("free_trial_usage")}
+            )
+        assert "device_key" in columns
+        assert "ix_free_trial_usage_device_key" in indexes
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+@patch("app.core.config.settings.DEVICE_KEY_SECRET", "s3cret")
+async def test_keyed_lookups_recheck_device_id(client: AsyncClient, db):
+    """A key collision never returns another device's rows."""
+    mine = GenerationToken.create_token("starter_10", 3, device_id="keyed-device")
+    other = GenerationToken.create_token("starter_10", 7, device_id="other-device")
+    db.add_all([mine, other])
+    await db.commit()
+    assert mine.device_key == device_key("keyed-device")
+    await db.execute(
+        update(GenerationToken)
+        .where(GenerationToken.id == other.id)
+        .values(device_key=mine.device_key)
+    )
+    await db.commit()
+
+    result = await db.execute(
+        select(GenerationToken.id).where(device_is(GenerationToken, "keyed-device"))
+    )
+    assert result.scalars().all() == [mine.id]
+    usage = (await client.get("/api/v1/usage/keyed-device")).json()
+    assert usage["paid_remaining"] == 3
+
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        response = await client.post(
+            "/api/v1/generate", json={"prompt": "A cat", "device_id": "keyed-device"}
+        )
+    assert response.json()["remaining_generations"] == 2
@@ -0,0 +1,102 @@
+"""Tests for graceful drain of in-flight generations."""
+import asyncio
+import signal
+import pytest
+from unittest.mock import patch
+from httpx import AsyncClient
+
+from app.services.drain import generation_drain
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_in_flight_generation(client: AsyncClient):
+    """Draining rejects new work, reports not-ready and lets running work finish."""
+    release = asyncio.Event()
+
+    async def gated_generate(*args, **kwargs):
+        await release.wait()
+        return {"success": True, "image_url": "https://example.com/done.png"}
+
+    with patch("app.api.v1.generate.generate_image", side_effect=gated_generate):
+        running = asyncio.create_task(client.post(
+            "/api/v1/generate", json={"prompt": "slow", "device_id": "drain-a"},
+        ))
+        while not any(generation_drain.active.values()):
+            await asyncio.sleep(0.01)
+
+        drain = asyncio.create_task(generation_drain.drain(timeout=5.0))
+        await asyncio.sleep(0)
+        health = await client.get("/health")
+        assert health.status_code == 503
+        assert health.json()["status"] == "draining"
+        rejected = await client.post(
+            "/api/v1/generate", json={"prompt": "new", "device_id": "drain-b"},
+        )
+        assert rejected.status_code == 503
+        assert rejected.json()["detail"]["code"] == "draining"
+
+        release.set()
+        response = await running
+        await drain
+
+    assert response.status_code == 200
+    assert response.json()["remaining_generations"] == 2
+    assert generation_drain.state == "drained"
+
+
+@pytest.mark.asyncio
+async def test_drain_timeout_cancels_and_refunds(client: AsyncClient):
+    """Work still running at the drain deadline is cancelled and refunded."""
+    async def stuck_generate(*args, **kwargs):
+        await asyncio.sleep(30)
+
+    with patch("app.api.v1.generate.generate_image", side_effect=stuck_generate):
+        running = asyncio.create_task(client.post(
+            "/api/v1/generate", json={"prompt": "stuck", "device_id": "drain-c"},
+        ))
+        while not any(generation_drain.active.values()):
+            await asyncio.sleep(0.01)
+        await generation_drain.drain(timeout=0.05)
+        await asyncio.gather(running, return_exceptions=True)
+
+    assert not generation_drain.active
+    generation_drain.reset()
+    usage = await client.get("/api/v1/usage/drain-c")
+    assert usage.json()["free_remaining"] == 3
+
+
+@pytest.mark.asyncio
+async def test_shutdown_signal_drains_before_server_exit(client: AsyncClient):
+    """SIGTERM drains while the server still serves; its own handler runs after."""
+    exits = []
+    original = signal.signal(signal.SIGTERM, lambda signum, frame: exits.append(signum))
+    release = asyncio.Event()
+
+    async def gated_generate(*args, **kwargs):
+        await release.wait()
+        return {"success": True, "image_url": "https://example.com/done.png"}
+
+    try:
+        generation_drain.drain_on_signal(timeout=5.0, signals=(signal.SIGTERM,))
+        with patch("app.api.v1.generate.generate_image", side_effect=gated_generate):
+            running = asyncio.create_task(client.post(
+                "/api/v1/generate", json={"prompt": "slow", "device_id": "drain-d"},
+            ))
+            while not any(generation_drain.active.values()):
+                await asyncio.sleep(0.01)
+
+            signal.raise_signal(signal.SIGTERM)
+            await asyncio.sleep(0.05)
+            assert (await client.get("/health")).status_code == 503
+            assert exits == []
+
+            release.set()
+            response = await running
+            while not exits:
+                await asyncio.sleep(0.01)
+    finally:
+        signal.signal(signal.SIGTERM, original)
+
+    assert response.status_code == 200
+    assert exits == [signal.SIGTERM]
+    assert generation_drain.state == "drained"
@@ -0,0 +1,132 @@
+"""Tests for Idempotency-Key handling on /generate."""
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from app.models import FreeTrialUsage, IdempotencyKey
+from app.services.idempotency import cleanup_expired
+
+BODY = {"prompt": "A cat", "device_id": "idem-device"}
+
+
+async def _used_count(db) -> int:
+    result = await db.execute(
+        select(FreeTrialUsage.used_count).where(FreeTrialUsage.device_id == "idem-device")
+    )
+    return result.scalar_one()
+
+
+@pytest.mark.asyncio
+async def test_retry_after_completion_replays_response(client: AsyncClient, db):
+    """The second request with the same key spends no quota and no upstream call."""
+    headers = {"Idempotency-Key": "retry-1"}
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        first = await client.post("/api/v1/generate", json=BODY, headers=headers)
+        second = await client.post("/api/v1/generate", json=BODY, headers=headers)
+
+    assert mock_gen.await_count == 1
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert await _used_count(db) == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_during_processing_attaches(client: AsyncClient, db):
+    """A retry that arrives mid-generation waits for and returns the original result."""
+    release = asyncio.Event()
+
+    async def slow_generate(*args, **kwargs):
+        await release.wait()
+        return {"success": True, "image_url": "https://example.com/slow.png"}
+
+    headers = {"Idempotency-Key": "retry-2"}
+    with patch("app.api.v1.generate.generate_image", side_effect=slow_generate) as mock_gen:
+        first = asyncio.create_task(client.post("/api/v1/generate", json=BODY, headers=headers))
+        await asyncio.sleep(0.1)
+        second = asyncio.create_task(client.post("/api/v1/generate", json=BODY, headers=headers))
+        await asyncio.sleep(0.1)
+        assert not second.done()
+        release.set()
+        first, second = await first, await second
+
+    assert mock_gen.call_count == 1
+    assert second.json()["image_url"] == "https://example.com/slow.png"
+    assert second.json() == first.json()
+    assert await _used_count(db) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_generation_releases_key(client: AsyncClient, db):
+    """A refunded failure is not replayed; the retry gets a fresh attempt."""
+    headers = {"Idempotency-Key": "retry-3"}
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": False, "error": "upstream down"}
+        await client.post("/api/v1/generate", json=BODY, headers=headers)
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        retry = await client.post("/api/v1/generate", json=BODY, headers=headers)
+
+    assert mock_gen.await_count == 2
+    assert retry.json()["success"] == True
+    assert await _used_count(db) == 1
+
+
+@pytest.mark.asyncio
+async def test_key_reused_for_different_request(client: AsyncClient):
+    """Reusing a key with another body is rejected instead of replaying."""
+    headers = {"Idempotency-Key": "retry-4"}
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        await client.post("/api/v1/generate", json=BODY, headers=headers)
+        response = await client.post(
+            "/api/v1/generate", json={**BODY, "prompt": "A dog"}, headers=headers
+        )
+
+    assert response.status_code == 422
+    assert response.json()["detail"]["code"] == "idempotency_key_reused"
+
+
+@pytest.mark.asyncio
+async def test_keys_are_scoped_to_the_device(client: AsyncClient):
+    """Another device sending the same key gets its own generation, not a replay."""
+    headers = {"Idempotency-Key": "retry-5"}
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        mine = await client.post("/api/v1/generate", json=BODY, headers=headers)
+        theirs = await client.post(
+            "/api/v1/generate", json={**BODY, "device_id": "other-device"}, headers=headers
+        )
+
+    assert mock_gen.await_count == 2
+    assert theirs.status_code == 200
+    assert "idempotent-replayed" not in theirs.headers
+    assert theirs.json()["remaining_generations"] == mine.json()["remaining_generations"]
+
+
+@pytest.mark.asyncio
+async def test_cleanup_deletes_expired_keys_in_batches(db):
+    """Expired keys go in batches; live ones stay, even under the same key."""
+    now = datetime.utcnow()
+    db.add_all(
+        IdempotencyKey(
+            key=f"old-{i}", device_id="d", request_hash="h", generation_id=f"g-{i}",
+            expires_at=now - timedelta(seconds=1),
+        )
+        for i in range(5)
+    )
+    db.add(IdempotencyKey(
+        key="old-0", device_id="live-device", request_hash="h", generation_id="g",
+        expires_at=now + timedelta(hours=1),
+    ))
+    await db.commit()
+
+    with patch("app.core.config.settings.IDEMPOTENCY_CLEANUP_BATCH_SIZE", 2), \
+            patch("app.core.config.settings.IDEMPOTENCY_CLEANUP_PAUSE_MS", 0):
+        assert await cleanup_expired(db, now) == 5
+    keys = (await db.execute(select(IdempotencyKey.device_id, IdempotencyKey.key))).all()
+    assert [tuple(k) for k in keys] == [("live-device", "old-0")]
@@ -0,0 +1,96 @@
+"""Tests for the known-id Bloom filters."""
+import pytest
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+from sqlalchemy import func, select
+
+from app.core.bloom import BloomFilter
+from app.models import FreeTrialUsage, GenerationToken
+from app.services.known_ids import known_ids
+from tests import conftest
+
+
+def test_bloom_filter_error_rate():
+    """No false negatives; false positives near the configured rate."""
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f"member-{i}")
+    assert all(f"member-{i}" in bloom for i in range(10000))
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 200
+    assert 0.005 < bloom.estimated_error_rate() < 0.02
+
+
+@pytest.mark.asyncio
+async def test_unknown_ids_skip_the_database(client: AsyncClient, db):
+    """Once loaded, unknown devices and tokens are answered without a query."""
+    token = GenerationToken.create_token("starter_10", 10, device_id="paid-device")
+    db.add(token)
+    db.add(FreeTrialUsage(device_id="trial-device", used_count=2))
+    await db.commit()
+    await known_ids.load(conftest.test_async_session)
+
+    with patch("app.api.v1.generate.select") as gen_select, \
+            patch("app.api.v1.tokens.select") as tok_select, \
+            patch("app.services.token_cache.select") as cache_select:
+        usage = await client.get("/api/v1/usage/random-device")
+        listed = await client.get("/api/v1/tokens/by-device/random-device")
+        info = await client.get(f"/api/v1/tokens/info/tok_{'0' * 32}")
+    assert usage.json() == {"free_remaining": 3, "paid_remaining": 0, "total_remaining": 3}
+    assert listed.json() == {"tokens": []}
+    assert info.status_code == 404
+    gen_select.assert_not_called()
+    tok_select.assert_not_called()
+    cache_select.assert_not_called()
+
+    usage = await client.get("/api/v1/usage/trial-device")
+    assert usage.json()["free_remaining"] == 1
+    listed = await client.get("/api/v1/tokens/by-device/paid-device")
+    assert len(listed.json()["tokens"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_new_devices_added_on_insert(client: AsyncClient, db):
+    """A device's first generation makes it known; usage never writes."""
+    await known_ids.load(conftest.test_async_session)
+    await client.get("/api/v1/usage/new-device")
+    count = await db.scalar(select(func.count()).select_from(FreeTrialUsage))
+    assert count == 0
+
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        await client.post("/api/v1/generate", json={"prompt": "An owl", "device_id": "new-device"})
+
+    usage = await client.get("/api/v1/usage/new-device")
+    assert usage.json()["free_remaining"] == 2
+
+
+@pytest.mark.asyncio
+async def test_generate_spends_tokens_the_filter_has_not_seen(client: AsyncClient, db):
+    """A token inserted by another worker is still spent, not the free trial."""
+    await known_ids.load(conftest.test_async_session)
+    token = GenerationToken.create_token("starter_10", 5, device_id="other-worker-device")
+    db.add(token)
+    await db.commit()
+    assert known_ids.token_missing(token.token)
+
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        by_token = await client.post("/api/v1/generate", json={
+            "prompt": "A cat", "device_id": "some-device", "token": token.token,
+        })
+        by_device = await client.post("/api/v1/generate", json={
+            "prompt": "A cat", "device_id": "other-worker-device",
+        })
+    assert by_token.json()["is_free_trial"] == False
+    assert by_token.json()["remaining_generations"] == 4
+    assert by_device.json()["is_free_trial"] == False
+    assert by_device.json()["remaining_generations"] == 3
+
+
+@pytest.mark.asyncio
+@patch("app.core.config.settings.WEB_CONCURRENCY", 4)
+async def test_filters_stay_off_with_several_workers():
+    await known_ids.load(conftest.test_async_session)
+    assert not known_ids.ready
+    assert not known_ids.device_missing("any-device")
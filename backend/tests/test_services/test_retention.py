@@ -0,0 +1,60 @@
+"""Tests for generation retention and archival."""
+import pytest
+from datetime import datetime, timedelta
+from httpx import AsyncClient
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.models import ImageGeneration
+from app.services.retention import run_retention
+from app.services.rollups import run_rollups
+from tests import conftest
+
+
+@pytest.fixture
+def retention_settings():
+    """Keep 30 days, move rows in batches of 2."""
+    original = settings.RETENTION_DAYS, settings.RETENTION_BATCH_SIZE, settings.RETENTION_BATCH_PAUSE_MS
+    settings.RETENTION_DAYS, settings.RETENTION_BATCH_SIZE, settings.RETENTION_BATCH_PAUSE_MS = 30, 2, 0
+    yield
+    settings.RETENTION_DAYS, settings.RETENTION_BATCH_SIZE, settings.RETENTION_BATCH_PAUSE_MS = original
+
+
+@pytest.mark.asyncio
+async def test_old_generations_move_to_archive(client: AsyncClient, db, retention_settings):
+    """Rows past retention leave the hot table but stay readable by id."""
+    now = datetime.utcnow()
+    db.add_all(
+        ImageGeneration(
+            id=f"old-{i}", device_id="retention-device", prompt=f"old prompt {i}",
+            model="dall-e-3", status="completed", image_url="data:image/png;base64," + "A" * 5000,
+            created_at=now - timedelta(days=40 + i),
+        )
+        for i in range(5)
+    )
+    db.add(ImageGeneration(
+        id="recent", device_id="retention-device", prompt="recent", model="dall-e-3",
+        status="completed", created_at=now - timedelta(days=1),
+    ))
+    await db.commit()
+
+    # Rows that are not rolled up yet are kept.
+    assert await run_retention(db, conftest.test_archive_session) == 0
+    await run_rollups(db)
+    assert await run_retention(db, conftest.test_archive_session) == 5
+    assert await run_retention(db, conftest.test_archive_session) == 0
+
+    remaining = await db.scalar(select(func.count()).select_from(ImageGeneration))
+    assert remaining == 1
+
+    response = await client.get("/api/v1/generations/old-3")
+    assert response.status_code == 200
+    record = response.json()
+    assert record["archived"] == True
+    assert record["prompt"] == "old prompt 3"
+    assert record["image_url"].endswith("A" * 10)
+
+    hot = await client.get("/api/v1/generations/recent")
+    assert hot.json()["archived"] == False
+    missing = await client.get("/api/v1/generations/never-existed")
+    assert missing.status_code == 404
@@ -0,0 +1,83 @@
+"""Tests for incremental usage rollups."""
+import pytest
+from datetime import datetime, timedelta
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.models import GenerationToken, ImageGeneration, PaymentTransaction, UsageRollup
+from app.services.rollups import run_rollups
+
+NOW = datetime(2025, 6, 2, 12, 0)
+
+
+def _generation(minutes_ago: float, style: str, status: str) -> ImageGeneration:
+    return ImageGeneration(
+        device_id="rollup-device", prompt="p", model="dall-e-3", style=style,
+        status=status, created_at=NOW - timedelta(minutes=minutes_ago),
+    )
+
+
+@pytest.mark.asyncio
+async def test_rollups_are_incremental(db):
+    """Each pass folds only rows past the watermark and older than the settle lag."""
+    db.add_all([
+        _generation(125, "anime", "completed"),
+        _generation(121, "anime", "completed"),
+        _generation(119, "anime", "failed"),
+        _generation(1, "anime", "processing"),  # Not settled yet.
+    ])
+    await db.commit()
+
+    assert await run_rollups(db, now=NOW) == {"image_generations": 3, "payment_transactions": 0}
+    assert await run_rollups(db, now=NOW) == {"image_generations": 0, "payment_transactions": 0}
+
+    db.add(_generation(100, "sketch", "completed"))
+    await db.commit()
+    later = NOW + timedelta(seconds=settings.ROLLUP_SETTLE_SECONDS)
+    assert (await run_rollups(db, now=later))["image_generations"] == 2
+
+    rollups = (await db.execute(
+        select(UsageRollup).order_by(UsageRollup.hour, UsageRollup.style, UsageRollup.status)
+    )).scalars().all()
+    assert [(r.hour.hour, r.style, r.status, r.count) for r in rollups] == [
+        (9, "anime", "completed", 2),
+        (10, "anime", "failed", 1),
+        (10, "sketch", "completed", 1),
+        (11, "anime", "processing", 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_analytics_endpoint_reads_rollups(client: AsyncClient, db):
+    """Revenue per SKU per day comes from the rollup table."""
+    token = GenerationToken.create_token("pro_50", 50)
+    db.add(token)
+    await db.flush()
+    for hours_ago, sku, amount in ((30, "pro_50", 999), (26, "pro_50", 999), (3, "starter_10", 299)):
+        db.add(PaymentTransaction(
+            token_id=token.id, product_sku=sku, amount_cents=amount, currency="usd",
+            status="succeeded", created_at=NOW - timedelta(hours=hours_ago),
+        ))
+    await db.commit()
+    await run_rollups(db, now=NOW)
+
+    original_key = settings.ADMIN_API_KEY
+    settings.ADMIN_API_KEY = "test_admin_key"
+    try:
+        response = await client.get(
+            "/api/v1/admin/analytics",
+            params={"metric": "payment", "granularity": "day"},
+            headers={"X-Admin-Key": "test_admin_key"},
+        )
+    finally:
+        settings.ADMIN_API_KEY = original_key
+
+    report = response.json()
+    assert report["watermarks"]["payment_transactions"].startswith("2025-06-02T09:00")
+    assert [(r["bucket"][:10], r["product_sku"], r["count"], r["amount_cents"], r["currency"])
+            for r in report["rows"]] == [
+        ("2025-06-01", "pro_50", 2, 1998, "USD"),
+        ("2025-06-02", "starter_10", 1, 299, "USD"),
+    ]
+    assert "style" not in report["rows"][0]
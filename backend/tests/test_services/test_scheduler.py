@@ -0,0 +1,88 @@
+"""Tests for priority scheduling of generation slots."""
+import asyncio
+import pytest
+
+from app.core.admission import generate_admission
+from app.services.scheduler import GenerationScheduler, PriorityClass, QueueTimeout
+
+
+def make_scheduler(slots=1, paid_share=3.0, free_share=1.0, max_wait=5.0):
+    return GenerationScheduler(slots, [
+        PriorityClass("paid", paid_share, max_wait),
+        PriorityClass("free", free_share, max_wait),
+    ])
+
+
+async def run_queued(scheduler, requests):
+    """Hold the only slot, queue ``requests``, then record the grant order."""
+    order = []
+
+    async def worker(class_name, device_id, label):
+        async with scheduler.slot(class_name, device_id):
+            order.append(label)
+            await asyncio.sleep(0)
+
+    await scheduler.acquire("paid", "holder")
+    tasks = []
+    for class_name, device_id, label in requests:
+        tasks.append(asyncio.create_task(worker(class_name, device_id, label)))
+        await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_classes_share_slots_by_weight():
+    """With paid:free = 3:1, paid is granted three times per free grant."""
+    scheduler = make_scheduler()
+    requests = [("free", f"f{i}", f"free{i}") for i in range(4)]
+    requests += [("paid", f"p{i}", f"paid{i}") for i in range(6)]
+    order = await run_queued(scheduler, requests)
+
+    assert order[:8] == [
+        "paid0", "free0", "paid1", "paid2", "paid3", "free1", "paid4", "paid5",
+    ]
+    assert scheduler.in_use == 0 and scheduler.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_devices_round_robin_within_class():
+    """A device with many queued requests does not delay other devices."""
+    scheduler = make_scheduler()
+    requests = [("free", "busy", f"busy{i}") for i in range(3)]
+    requests += [("free", "other", "other0")]
+    order = await run_queued(scheduler, requests)
+
+    assert order == ["busy0", "other0", "busy1", "busy2"]
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_frees_place():
+    """Waiting past max wait raises QueueTimeout and leaves no queued entry."""
+    scheduler = make_scheduler(max_wait=0.01)
+    await scheduler.acquire("paid", "holder")
+    with pytest.raises(QueueTimeout):
+        await scheduler.acquire("free", "late")
+    assert scheduler.waiting == 0
+    scheduler.release()
+    assert scheduler.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_last_waiter_ends_shedding():
+    """If the last queued request is cancelled, the idle queue admits again."""
+    scheduler = make_scheduler()
+    await scheduler.acquire("paid", "holder")
+    waiter = asyncio.create_task(scheduler.acquire("free", "leaver"))
+    await asyncio.sleep(0)
+    detector = generate_admission.detectors["free"]
+    for now in (0.0, detector.interval):
+        generate_admission.observe("free", detector.target + 1, now=now)
+    assert generate_admission.rejection("free", now=detector.interval) == "delay"
+
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert scheduler.waiting == 0
+    assert generate_admission.rejection("free", now=detector.interval) is None
+    scheduler.release()
@@ -0,0 +1,103 @@
+"""Tests for near-duplicate prompt reuse."""
+import time
+import pytest
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+from sqlalchemy import delete
+
+from app.core.metrics import upstream_calls_avoided, TOOL_NAME
+from app.models import ImageGeneration
+from app.services.similar_prompts import PromptIndex, normalize_prompt
+
+
+def test_normalization_ignores_case_punctuation_and_order():
+    """Equivalent phrasings normalize to the same word set."""
+    assert normalize_prompt("a cat on a sofa, anime") == normalize_prompt("Cat  on SOFA anime!")
+    assert normalize_prompt("sofa cat anime") == {"sofa", "cat", "anime"}
+
+
+def test_index_threshold_style_and_age():
+    """Matches respect the threshold, the style and the max age."""
+    index = PromptIndex(max_entries=100, num_perm=64, threshold=0.8, max_age=60)
+    index.add("g1", "d1", "A red fox jumping over a frozen lake at dawn", "anime")
+    index.add("g2", "d1", "A spaceship landing in the desert", "anime")
+
+    match = index.find("red fox, jumping over frozen lake at dawn", "anime")
+    assert match.generation_id == "g1" and match.similarity == 1.0
+    assert index.find("A red fox jumping over a frozen lake at dawn", "sketch") is None
+    assert index.find("A red fox sleeping in a warm den", "anime") is None
+
+    index.add("g3", "d1", "An old lighthouse in a storm", None, created=time.time() - 120)
+    assert index.find("old lighthouse storm", None) is None
+
+
+def test_index_is_bounded():
+    """The oldest entries are evicted past max_entries."""
+    index = PromptIndex(max_entries=3, num_perm=16, threshold=0.8, max_age=60)
+    for i in range(5):
+        index.add(f"g{i}", "d1", f"prompt number {i} with unique word{i}", None)
+    assert len(index) == 3
+    assert index.find("prompt number 0 with unique word0", None) is None
+    assert index.find("prompt number 4 with unique word4", None).generation_id == "g4"
+
+
+@pytest.mark.asyncio
+async def test_generate_reuses_similar_image_when_allowed(client: AsyncClient):
+    """Opted-in requests reuse a recent image and skip the upstream."""
+    avoided = upstream_calls_avoided.labels(tool=TOOL_NAME, reason="similar_prompt")
+    before = avoided._value.get()
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/cat.png"}
+        first = await client.post("/api/v1/generate", json={
+            "prompt": "a cat on a sofa", "style": "anime", "device_id": "reuse-a",
+        })
+        not_allowed = await client.post("/api/v1/generate", json={
+            "prompt": "Cat on sofa", "style": "anime", "device_id": "reuse-c",
+        })
+        reused = await client.post("/api/v1/generate", json={
+            "prompt": "Cat on sofa", "style": "anime", "device_id": "reuse-b",
+            "allow_similar": True,
+        })
+        own = await client.post("/api/v1/generate", json={
+            "prompt": "sofa cat", "style": "anime", "device_id": "reuse-a",
+            "allow_similar": True,
+        })
+
+    assert first.json()["reused_from"] is None
+    assert not_allowed.json()["reused_from"] is None
+    assert mock_gen.await_count == 2
+    body = reused.json()
+    assert body["image_url"] == "https://example.com/cat.png"
+    assert body["reused_from"] is None  # Another device's generation id is not exposed
+    assert body["remaining_generations"] == 2
+    assert own.json()["reused_from"] == (
+        await client.get("/api/v1/generations", params={"device_id": "reuse-a"})
+    ).json()["items"][-1]["id"]
+    assert avoided._value.get() == before + 2
+
+
+@pytest.mark.asyncio
+async def test_reused_image_is_read_from_the_database(client: AsyncClient, db):
+    """The index keeps ids only; a hit on a deleted generation calls the upstream."""
+    data_url = "data:image/png;base64," + "A" * 4096
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": data_url}
+        await client.post("/api/v1/generate", json={
+            "prompt": "a lighthouse in a storm", "device_id": "reuse-db",
+        })
+        reused = await client.post("/api/v1/generate", json={
+            "prompt": "lighthouse storm", "device_id": "reuse-db", "allow_similar": True,
+        })
+        assert reused.json()["image_url"] == data_url
+        assert mock_gen.await_count == 1
+
+        await db.execute(delete(ImageGeneration).where(ImageGeneration.device_id == "reuse-db"))
+        await db.commit()
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/new.png"}
+        fresh = await client.post("/api/v1/generate", json={
+            "prompt": "lighthouse storm", "device_id": "reuse-db", "allow_similar": True,
+        })
+
+    assert mock_gen.await_count == 2
+    assert fresh.json()["image_url"] == "https://example.com/new.png"
+    assert fresh.json()["reused_from"] is None
@@ -0,0 +1,75 @@
+"""Tests for the token snapshot cache."""
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch, AsyncMock
+from httpx import AsyncClient
+from sqlalchemy import delete
+
+from app.models import GenerationToken
+from app.services.token_cache import TokenCache, token_cache
+
+
+async def _add_token(db, generations: int = 5) -> GenerationToken:
+    token = GenerationToken.create_token("starter_10", generations, device_id="cache-device")
+    db.add(token)
+    await db.commit()
+    return token
+
+
+@pytest.mark.asyncio
+async def test_validate_served_from_cache(client: AsyncClient, db):
+    """After the first lookup the token endpoints do not need the DB row."""
+    token = await _add_token(db)
+    response = await client.post(f"/api/v1/tokens/validate?token={token.token}")
+    assert response.json()["valid"] == True
+
+    await db.execute(delete(GenerationToken))
+    await db.commit()
+
+    response = await client.get(f"/api/v1/tokens/info/{token.token}")
+    assert response.status_code == 200
+    assert response.json()["remaining_generations"] == 5
+
+
+@pytest.mark.asyncio
+async def test_generate_updates_cached_snapshot(client: AsyncClient, db):
+    """Consuming and refunding quota refreshes the cached snapshot."""
+    token = await _add_token(db, generations=2)
+    await client.get(f"/api/v1/tokens/info/{token.token}")
+
+    with patch("app.api.v1.generate.generate_image", new_callable=AsyncMock) as mock_gen:
+        mock_gen.return_value = {"success": True, "image_url": "https://example.com/i.png"}
+        await client.post(
+            "/api/v1/generate",
+            json={"prompt": "A cat", "device_id": "cache-device", "token": token.token},
+        )
+        info = await client.get(f"/api/v1/tokens/info/{token.token}")
+        assert info.json()["remaining_generations"] == 1
+
+        mock_gen.return_value = {"success": False, "error": "upstream down"}
+        await client.post(
+            "/api/v1/generate",
+            json={"prompt": "A cat", "device_id": "cache-device", "token": token.token},
+        )
+        info = await client.get(f"/api/v1/tokens/info/{token.token}")
+        assert info.json()["remaining_generations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_snapshot_checks_expiry(db):
+    """Validity is computed from the cached expires_at, not at cache time."""
+    token = await _add_token(db)
+    token.expires_at = datetime.utcnow() + timedelta(milliseconds=1)
+    token_cache.put(token)
+    with patch("app.services.token_cache.datetime") as mock_dt:
+        mock_dt.utcnow.return_value = datetime.utcnow() + timedelta(seconds=1)
+        assert token_cache.get(token.token).is_valid == False
+
+
+def test_entries_expire_after_ttl():
+    """Entries older than the TTL are dropped."""
+    cache = TokenCache(maxsize=10, ttl=0)
+    token = GenerationToken.create_token("starter_10", 1)
+    cache.put(token)
+    assert cache.get(token.token) is None
+    assert len(cache) == 0
@@ -0,0 +1,83 @@
+"""Tests for upstream routing and failover."""
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from app.services.image_generator import generate_image
+from app.services.upstreams import Upstream, UpstreamPool
+
+
+def make_pool(*caps, eject_after=2):
+    upstreams = [
+        Upstream(name=f"u{i}", url=f"http://u{i}", key="k", model=f"model-{i}", max_concurrency=cap)
+        for i, cap in enumerate(caps)
+    ]
+    return UpstreamPool(upstreams, decay_seconds=10.0, eject_after=eject_after,
+                        eject_seconds=30.0, max_eject_seconds=100.0)
+
+
+def test_prefers_faster_upstream_and_respects_caps():
+    """P2C picks the lower-latency upstream; full upstreams are skipped."""
+    pool = make_pool(2, 2)
+    slow, fast = pool.upstreams
+    pool.release(pool.acquire({"u1"}), 5.0, ok=True, now=1.0)
+    pool.release(pool.acquire({"u0"}), 0.5, ok=True, now=1.0)
+
+    assert pool.acquire() is fast
+    assert pool.acquire() is fast
+    assert fast.in_flight == 2
+    assert pool.acquire() is slow  # fast is at its cap
+    assert pool.acquire() is slow
+    assert pool.acquire() is None
+
+
+def test_ejection_probe_and_backoff():
+    """Consecutive failures eject; one probe decides restore or longer ejection."""
+    pool = make_pool(10, eject_after=2)
+    (upstream,) = pool.upstreams
+    for now in (1.0, 2.0):
+        pool.release(pool.acquire(now=now), 1.0, ok=False, now=now)
+    assert upstream.ejected_until == 32.0
+    assert pool.acquire(now=10.0) is None
+
+    probe = pool.acquire(now=40.0)
+    assert probe is upstream and upstream.probing
+    assert pool.acquire(now=40.0) is None  # Only one probe at a time
+    pool.release(probe, 1.0, ok=False, now=41.0)
+    assert upstream.ejected_until == 41.0 + 60.0
+
+    pool.release(pool.acquire(now=200.0), 1.0, ok=True, now=201.0)
+    assert upstream.ejected_until == 0.0
+    assert pool.acquire(now=202.0) is upstream
+
+
+@pytest.mark.asyncio
+async def test_generate_image_fails_over_and_reports_model():
+    """A 5xx on one upstream is retried on another, which names the model."""
+    pool = make_pool(5, 5)
+    responses = {
+        "http://u0/v1/images/generations": MagicMock(status_code=503, text="unavailable"),
+        "http://u1/v1/images/generations": MagicMock(status_code=200),
+    }
+    responses["http://u1/v1/images/generations"].json.return_value = {
+        "data": [{"url": "https://example.com/ok.png"}]
+    }
+
+    async def post(url, **kwargs):
+        return responses[url]
+
+    with patch("app.services.image_generator.upstream_pool", pool), \
+            patch("app.services.image_generator.settings.UPSTREAM_MAX_ATTEMPTS", 2), \
+            patch("app.services.upstreams.random.sample", lambda seq, k: list(seq)[:k]), \
+            patch("httpx.AsyncClient") as mock_client:
+        instance = AsyncMock()
+        instance.post.side_effect = post
+        instance.__aenter__.return_value = instance
+        mock_client.return_value = instance
+        result = await generate_image("A sunset")
+
+    assert result == {
+        "success": True, "image_url": "https://example.com/ok.png",
+        "model": "model-1", "upstream": "u1",
+    }
+    assert pool.upstreams[0].consecutive_failures == 1
+    assert all(u.in_flight == 0 for u in pool.upstreams)
@@ -0,0 +1,101 @@
+"""Tests for the webhook inbox consumer."""
+import asyncio
+import json
+import pytest
+from sqlalchemy import select
+
+from app.models import GenerationToken, WebhookInbox
+from app.services.webhook_inbox import (
+    InboxConsumer, append_event, inbox_state, process_inbox_batch,
+)
+from tests import conftest
+
+
+def _checkout_event(checkout_id: str, device_id: str) -> dict:
+    return {
+        "eventType": "checkout.completed",
+        "object": {
+            "id": checkout_id,
+            "metadata": {"product_sku": "starter_10", "device_id": device_id, "generations": "10"},
+            "order": {"amount": 299, "currency": "usd"},
+        },
+    }
+
+
+@pytest.mark.asyncio
+async def test_consumer_resumes_pending_events_on_start(db):
+    """Events left unprocessed by a previous process are handled at startup."""
+    for i in range(3):
+        event = _checkout_event(f"checkout_resume_{i}", f"resume-device-{i}")
+        await append_event(db, event, json.dumps(event).encode())
+    assert (await inbox_state(db))[0] == 3
+
+    consumer = InboxConsumer(conftest.test_async_session)
+    consumer.start()
+    for _ in range(50):
+        await asyncio.sleep(0.02)
+        if (await inbox_state(db))[0] == 0:
+            break
+    await consumer.stop()
+
+    assert await inbox_state(db) == (0, 0.0)
+    tokens = (await db.execute(select(GenerationToken))).scalars().all()
+    assert sorted(t.device_id for t in tokens) == [f"resume-device-{i}" for i in range(3)]
+
+
+@pytest.mark.asyncio
+async def test_consumer_wakes_on_new_event(db):
+    """A running consumer picks up appended events when woken."""
+    consumer = InboxConsumer(conftest.test_async_session)
+    consumer.start()
+    try:
+        event = _checkout_event("checkout_wake", "wake-device")
+        await append_event(db, event, json.dumps(event).encode())
+        consumer.wake()
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            row = (await db.execute(select(WebhookInbox.status))).scalar_one()
+            if row == "done":
+                break
+    finally:
+        await consumer.stop()
+    assert row == "done"
+
+
+@pytest.mark.asyncio
+async def test_inbox_lag_reports_oldest_pending(db):
+    """Lag is the age of the oldest pending event."""
+    from datetime import datetime, timedelta
+
+    event = _checkout_event("checkout_lag", "lag-device")
+    await append_event(db, event, json.dumps(event).encode())
+    row = (await db.execute(select(WebhookInbox))).scalar_one()
+    row.received_at = datetime.utcnow() - timedelta(seconds=30)
+    await db.commit()
+
+    pending, lag = await inbox_state(db)
+    assert pending == 1
+    assert 29 <= lag < 60
+
+
+@pytest.mark.asyncio
+async def test_malformed_nested_payload_is_marked_failed(db):
+    """Wrongly-typed nested fields fail the row instead of leaving it pending."""
+    good = _checkout_event("checkout_good", "good-device")
+    bad_object = {**good, "object": ["not", "an", "object"]}
+    bad_metadata = _checkout_event("checkout_bad_meta", "bad-device")
+    bad_metadata["object"]["metadata"] = "starter_10"
+    bad_order = _checkout_event("checkout_bad_order", "bad-device")
+    bad_order["object"]["order"] = 299
+    payloads = [bad_object, bad_metadata, bad_order, ["checkout.completed"], good]
+    for i, payload in enumerate(payloads):
+        await append_event(
+            db, {"id": f"evt_{i}", "eventType": "checkout.completed"}, json.dumps(payload).encode()
+        )
+
+    assert await process_inbox_batch(db) == len(payloads)
+    rows = (await db.execute(select(WebhookInbox).order_by(WebhookInbox.id))).scalars().all()
+    assert [row.status for row in rows] == ["failed"] * 4 + ["done"]
+    assert all(row.last_error for row in rows[:4])
+    tokens = (await db.execute(select(GenerationToken))).scalars().all()
+    assert [t.device_id for t in tokens] == ["good-device"]